@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+import simulator  # patches the standard library for gevent, must be imported first
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+import gevent
+
+import db
+import diagnosis_helper as dh
+from delivery import outbox
+from engine import HospitalSimulation
+from instance_generator import generate_arrivals
+from planner import planner, OccupancyTimeline
+from registry import PatientRegistry
+from storage import SQLiteStore, DurableStore, MemoryStore
+from time_helper import start_time, end_time
+
+# Sizes of the workloads, 'quick' keeps a run within a few seconds
+SIZES = {
+    'full': {'planner_patients': (0, 100, 1000, 10000), 'planner_calls': 50, 'db_operations': 2000,
+             'dispatch_patients': 5000, 'arrival_repeats': 10},
+    'quick': {'planner_patients': (0, 100, 1000), 'planner_calls': 10, 'db_operations': 200,
+              'dispatch_patients': 500, 'arrival_repeats': 3},
+}
+
+TASKS = ('Intake', 'Surgery', 'Nursing')
+
+
+def summarize(durations):
+    """
+    Latency statistics in milliseconds of a list of durations in seconds.
+    """
+    durations = sorted(durations)
+    return {
+        'calls': len(durations),
+        'mean_ms': round(statistics.fmean(durations) * 1000, 4),
+        'p50_ms': round(durations[len(durations) // 2] * 1000, 4),
+        'p95_ms': round(durations[min(len(durations) - 1, int(0.95 * len(durations)))] * 1000, 4),
+    }
+
+
+def measure(function, calls, setup=None):
+    """
+    Durations of the given number of calls of function(index), setup(index) runs before each call and is not timed.
+    """
+    durations = []
+    for index in range(calls):
+        if setup is not None:
+            setup(index)
+        began = time.perf_counter()
+        function(index)
+        durations.append(time.perf_counter() - began)
+    return durations
+
+
+def random_patients(rng, count, now):
+    """
+    Patient states around the given time with durations drawn from DiagnosisHelper, some of them waiting.
+    """
+    helper = dh.DiagnosisHelper()
+    patients = []
+    for index in range(count):
+        task = rng.choice(TASKS)
+        diagnosis = rng.choice(helper.diagnosis_type_A + helper.diagnosis_type_B)
+        if task == 'Surgery' and not helper.requires_surgery(diagnosis):
+            task = 'Nursing'
+        start = now - datetime.timedelta(hours=rng.uniform(0, 24))
+        wait = rng.random() < 0.05
+        duration = None if wait else rng.uniform(0.5, 16)
+        patients.append((f"patient-{index}", task, start, diagnosis, wait, duration))
+    return patients
+
+
+def bench_planner(rng, sizes):
+    """
+    Planner latency versus number of patients, with the incrementally maintained registry and with a plain list
+    of patient states that has to be turned into a timeline on every call. With the registry, the slot search is
+    timed with an empty feasibility cache ('registry') and with the cache filled by the previous call of the same
+    arrival ('registry_cached').
+    """
+    now = start_time + datetime.timedelta(days=3, hours=9)
+    results = {}
+    for count in sizes['planner_patients']:
+        registry = PatientRegistry(OccupancyTimeline())
+        for patient in random_patients(rng, count, now):
+            registry.add(*patient)
+        states = [record.as_dict() for record in registry]
+        calls = sizes['planner_calls']
+        arrival = now.isoformat()
+        plan = lambda i: planner(i, arrival, {'diagnosis': 'A2'}, registry)
+        results[str(count)] = {
+            'registry': summarize(measure(plan, calls, lambda i: registry.timeline.feasibility.clear())),
+            'registry_cached': summarize(measure(plan, calls, plan)),
+            'list': summarize(measure(lambda i: planner(i, arrival, {'diagnosis': 'A2'}, states),
+                                      max(1, calls // 10))),
+        }
+    return results
+
+
+def bench_db(rng, sizes):
+    """
+    Cost per operation of every db function for every storage backend.
+    """
+    results = {}
+    operations = sizes['db_operations']
+    previous = db.backend
+    with tempfile.TemporaryDirectory() as directory:
+        stores = (('memory', MemoryStore()), ('sqlite', SQLiteStore(os.path.join(directory, 'bench.db'))),
+                  ('durable', DurableStore(os.path.join(directory, 'durable.db'))))
+        try:
+            for name, store in stores:
+                db.use_backend(store)
+                db.init_db()
+                statuses = ('Intake finished', 'ER Treatment finished', 'Surgery finished')
+                rows = [(f"patient-{i}", rng.choice(('A2', 'B3')), rng.choice(statuses), f"http://callback/{i}")
+                        for i in range(operations)]
+                queue_type = 'Queue_Surgery'
+                results[name] = {
+                    'update_resource': summarize(measure(lambda i: db.update_resource('Bed_A', i % 30), operations)),
+                    'get_resource': summarize(measure(lambda i: db.get_resource('Bed_A'), operations)),
+                    'try_acquire': summarize(measure(lambda i: db.try_acquire('Bed_A'), operations)),
+                    'release': summarize(measure(lambda i: db.release('Bed_A'), operations)),
+                    'add_to_queue': summarize(measure(lambda i: db.add_to_queue(queue_type, *rows[i], float(i)),
+                                                      operations)),
+                    'get_queue_length': summarize(measure(lambda i: db.get_queue_length(queue_type), operations)),
+                    'get_count_queue': summarize(measure(lambda i: db.get_count_queue(queue_type, 'Intake finished'),
+                                                         operations)),
+                    'get_queue': summarize(measure(lambda i: db.get_queue(queue_type), max(1, operations // 100))),
+                    'delete_from_queue': summarize(measure(lambda i: db.delete_from_queue(queue_type, rows[i][3]),
+                                                           operations // 2)),
+                    'pop_from_queue': summarize(measure(lambda i: db.pop_from_queue(queue_type), operations // 2)),
+                    'add_to_queue_er': summarize(measure(lambda i: db.add_to_queue_er(rows[i][0], rows[i][3], float(i)),
+                                                         operations)),
+                    'get_queue_length_er': summarize(measure(lambda i: db.get_queue_length_er(), operations)),
+                    'get_queue_er': summarize(measure(lambda i: db.get_queue_er(), max(1, operations // 100))),
+                    'delete_from_queue_er': summarize(measure(lambda i: db.delete_from_queue_er(rows[i][3]),
+                                                              operations // 2)),
+                    'pop_from_queue_er': summarize(measure(lambda i: db.pop_from_queue_er(), operations // 2)),
+                }
+        finally:
+            db.use_backend(previous)
+            for _, store in stores:
+                store.close()
+    return results
+
+
+def bench_dispatch(sizes):
+    """
+    Patients per second the queue workers of simulator.py hand over to free units and call back,
+    with service times that take (almost) no wall-clock time and callbacks that are dropped in-process.
+    """
+    results = {}
+    count = sizes['dispatch_patients']
+    departments = (
+        ('ER', 'Queue_ER', simulator.process_queue_er, 'ER Treatment'),
+        ('Surgery', 'Queue_Surgery', simulator.process_queue_surgery, 'Surgery'),
+        ('Bed_A', 'Queue_Nursing_A', simulator.process_queue_nursing_a, 'Nursing'),
+        ('Bed_B', 'Queue_Nursing_B', simulator.process_queue_nursing_b, 'Nursing'),
+    )
+    seconds_per_hour, transport, previous = simulator.SECONDS_PER_HOUR, outbox.transport, db.backend
+    simulator.SECONDS_PER_HOUR = 1e-9
+    try:
+        for resource, queue_type, worker, task in departments:
+            store = db.use_backend(MemoryStore())
+            delivered = []
+            outbox.transport = lambda method, url, **kwargs: delivered.append(url) or SimpleNamespace(status_code=200)
+            diagnosis = {'Bed_A': 'A1', 'Bed_B': 'B1'}.get(resource, 'A2')
+            for index in range(count):
+                patient_id = f"patient-{index}"
+                simulator.resources.add(patient_id, task, start_time, diagnosis, True)
+                if queue_type == 'Queue_ER':
+                    db.add_to_queue_er(patient_id, f"http://callback/{index}", 0.0)
+                else:
+                    db.add_to_queue(queue_type, patient_id, diagnosis, 'Intake finished', f"http://callback/{index}", 0.0)
+            began = time.perf_counter()
+            greenlet = gevent.spawn(worker)
+            while len(delivered) < count:
+                gevent.sleep(0.001)
+            elapsed = time.perf_counter() - began
+            greenlet.kill()
+            for index in range(count):
+                simulator.resources.remove(f"patient-{index}")
+            store.close()
+            results[resource] = {'patients': count, 'seconds': round(elapsed, 4),
+                                 'patients_per_second': round(count / elapsed, 1)}
+    finally:
+        simulator.SECONDS_PER_HOUR, outbox.transport = seconds_per_hour, transport
+        db.use_backend(previous)
+    return results
+
+
+def bench_arrivals(seed, sizes):
+    """
+    Time to generate the arrivals of the whole simulation period.
+    """
+    durations = measure(lambda i: generate_arrivals(start_time, end_time, seed=seed + i), sizes['arrival_repeats'])
+    arrivals = len(generate_arrivals(start_time, end_time, seed=seed))
+    result = summarize(durations)
+    result['arrivals'] = arrivals
+    result['arrivals_per_second'] = round(arrivals / statistics.fmean(durations), 1)
+    return result
+
+
+def bench_full_year(seed, replan=False):
+    """
+    Simulated patients per second of wall-clock time for the full 2018 run of engine.py.
+    """
+    simulation = HospitalSimulation(seed=seed, replan=replan)
+    began = time.perf_counter()
+    summary = simulation.run()
+    elapsed = time.perf_counter() - began
+    patients = summary['arrived']['Planned'] + summary['arrived']['ER']
+    return {
+        'replan': replan,
+        'seconds': round(elapsed, 3),
+        'patients': patients,
+        'events': summary['events'],
+        'patients_per_second': round(patients / elapsed, 1),
+        'events_per_second': round(summary['events'] / elapsed, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(seed=0, size='full', sections=None):
+    """
+    Run the selected benchmark sections with seeded workloads and return the results.
+    """
+    sizes = SIZES[size]
+    sections = sections or ('planner', 'db', 'dispatch', 'arrivals', 'full_year')
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': seed,
+            'size': size,
+        }
+    }
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        if 'planner' in sections:
+            results['planner'] = bench_planner(random.Random(seed), sizes)
+        if 'db' in sections:
+            results['db'] = bench_db(random.Random(seed), sizes)
+        if 'dispatch' in sections:
+            results['dispatch'] = bench_dispatch(sizes)
+        if 'arrivals' in sections:
+            results['arrivals'] = bench_arrivals(seed, sizes)
+        if 'full_year' in sections:
+            results['full_year'] = [bench_full_year(seed), bench_full_year(seed, replan=True)]
+    return results
+
+
+def flatten(results, prefix=''):
+    if isinstance(results, list):
+        results = {str(index): value for index, value in enumerate(results)}
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, (dict, list)):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def compare(baseline, current):
+    """
+    Relative change of every timing and throughput metric against a baseline result.
+    """
+    before, after = flatten(baseline), flatten(current)
+    changes = {}
+    for key, value in after.items():
+        if key.startswith('meta.') or not key.endswith(('_ms', '_per_second', 'seconds')):
+            continue
+        if before.get(key):
+            changes[key] = round((value - before[key]) / before[key] * 100, 1)
+    return changes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the planner, the storage, the queue workers and the engine.')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated workloads')
+    parser.add_argument('--quick', action='store_true', help='use small workloads')
+    parser.add_argument('--only', nargs='+', choices=('planner', 'db', 'dispatch', 'arrivals', 'full_year'),
+                        help='run only the given sections')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare with (change in percent)')
+    args = parser.parse_args()
+
+    results = run(args.seed, 'quick' if args.quick else 'full', args.only)
+    if args.compare:
+        with open(args.compare) as file:
+            results['change_percent'] = compare(json.load(file), results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
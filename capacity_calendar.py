@@ -0,0 +1,152 @@
+import datetime
+import os
+from bisect import bisect_left, bisect_right
+
+from storage import RESOURCE_CAPACITIES, OFF_HOURS_CAPACITIES
+from time_helper import start_time, end_time
+
+# Working shifts per weekday (0 is Monday) as (start, end) times of the day, days not listed have none.
+# The working shift lasts until 5:01 PM, so patients arriving at 5:00 PM are still taken in.
+WORKING_SHIFTS = {weekday: ((datetime.time(8, 0), datetime.time(17, 1)),) for weekday in range(5)}
+
+# Days without working shifts, e.g. public holidays
+HOLIDAYS = ()
+
+# Days covered after the end of the simulation, the planner looks up to 7 days ahead
+HORIZON_MARGIN = datetime.timedelta(days=8)
+
+HOUR = datetime.timedelta(hours=1)
+
+
+class CapacityCalendar:
+    """
+    Alternating working and non-working shifts from `start` until `end` (plus HORIZON_MARGIN), precomputed as
+    sorted transition times, so the shift, the capacity and the next transition at a time are found by bisection.
+    Resources have their `capacities` in the working shifts and their `off_hours` capacities outside (if listed).
+    The capacity dicts are kept by reference, changing them changes the calendar.
+    """
+
+    def __init__(self, start=start_time, end=end_time, shifts=None, holidays=HOLIDAYS, capacities=None,
+                 off_hours=None):
+        self.start = start
+        self.shifts_per_weekday = WORKING_SHIFTS if shifts is None else shifts
+        self.holidays = frozenset(holidays)
+        self.capacities = dict(RESOURCE_CAPACITIES) if capacities is None else capacities
+        self.off_hours = dict(OFF_HOURS_CAPACITIES) if off_hours is None else off_hours
+        # transitions[i] starts a shift lasting until transitions[i + 1], working[i] tells whether it is working
+        self.transitions = [start]
+        self.working = [False]
+        # starts of the full hours within the working shifts, the slots of the planner
+        self.hours = []
+        day = start.date()
+        last_day = (end + HORIZON_MARGIN).date()
+        while day <= last_day:
+            if day not in self.holidays:
+                for shift_start, shift_end in self.shifts_per_weekday.get(day.weekday(), ()):
+                    self._add_shift(datetime.datetime.combine(day, shift_start),
+                                    datetime.datetime.combine(day, shift_end))
+            day += datetime.timedelta(days=1)
+        # the calendar is valid until the end of its last day, the limit closes the last shift
+        self.limit = datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time())
+        self.transitions.append(self.limit)
+        self.working.append(False)
+
+    def _add_transition(self, moment, working):
+        if moment <= self.transitions[-1]:
+            # shifts before the start of the calendar only set the state at the start
+            self.working[-1] = working
+        elif working != self.working[-1]:
+            self.transitions.append(moment)
+            self.working.append(working)
+
+    def _add_shift(self, shift_start, shift_end):
+        self._add_transition(shift_start, True)
+        self._add_transition(shift_end, False)
+        hour = shift_start.replace(minute=0, second=0, microsecond=0)
+        if hour < shift_start:
+            hour += HOUR
+        while hour + HOUR <= shift_end:
+            self.hours.append(hour)
+            hour += HOUR
+
+    def covers(self, start, end):
+        return self.start <= start and end <= self.limit
+
+    def index(self, moment):
+        """
+        Index of the shift the time falls into.
+        """
+        if not self.start <= moment < self.limit:
+            raise ValueError(f"{moment} is outside the capacity calendar ({self.start} to {self.limit})")
+        return bisect_right(self.transitions, moment) - 1
+
+    def is_working(self, moment):
+        return self.working[self.index(moment)]
+
+    def next_transition(self, moment):
+        """
+        Start of the shift after the one the time falls into.
+        """
+        return self.transitions[self.index(moment) + 1]
+
+    def capacity(self, resource, moment):
+        if self.is_working(moment):
+            return self.capacities[resource]
+        return self.off_hours.get(resource, self.capacities[resource])
+
+    def capacities_at(self, moment):
+        """
+        Capacity of every resource at the given time.
+        """
+        working = self.is_working(moment)
+        return {name: count if working else self.off_hours.get(name, count) for name, count in self.capacities.items()}
+
+    def shifts(self, start, end):
+        """
+        Yield (shift_start, shift_end, working) for the shifts from start until end, the first one starting at start.
+        The last shift ends at its regular end, which may be after end.
+        """
+        index = self.index(start)
+        while index + 1 < len(self.transitions) and self.transitions[index] < end:
+            yield max(start, self.transitions[index]), self.transitions[index + 1], self.working[index]
+            index += 1
+
+    def working_hours(self, start, end):
+        """
+        Starts of the full hours within the working shifts from start until before end.
+        """
+        return self.hours[bisect_left(self.hours, start):bisect_left(self.hours, end)]
+
+
+# Calendar of the simulated period with the default shifts and capacities, see configure()
+CALENDAR = None
+
+
+def configure(shifts=None, holidays=HOLIDAYS):
+    """
+    Set the working shifts per weekday and the holidays of the default calendar, used by the simulator,
+    the engine, the arrival generator and the planner.
+    """
+    global CALENDAR
+    CALENDAR = CapacityCalendar(shifts=shifts, holidays=holidays)
+    return CALENDAR
+
+
+def calendar_for(start, end, capacities=None, off_hours=None):
+    """
+    The default calendar if it covers the time frame, else a calendar of the time frame with the same shifts.
+    Given capacities always give a new calendar.
+    """
+    if capacities is None and off_hours is None and CALENDAR.covers(start, end):
+        return CALENDAR
+    return CapacityCalendar(start, end, CALENDAR.shifts_per_weekday, CALENDAR.holidays, capacities, off_hours)
+
+
+def parse_holidays(value):
+    """
+    Dates of a comma-separated list in ISO format, e.g. '2018-12-25,2018-12-26'.
+    """
+    return [datetime.date.fromisoformat(day.strip()) for day in value.split(',') if day.strip()]
+
+
+configure(holidays=parse_holidays(os.environ.get('HOSPITAL_HOLIDAYS', '')))
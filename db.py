@@ -1,283 +1,234 @@
-import sqlite3
-
-
-def init_db():
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Resources (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        Intake INTEGER,
-        Surgery INTEGER,
-        Bed_A INTEGER,
-        Bed_B INTEGER,
-        ER INTEGER
-    )
-    ''')
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Queue_Surgery (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_id TEXT,
-        diagnosis TEXT,
-        status TEXT,
-        callback_url TEXT,
-        duration REAL
-    )
-    ''')
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Queue_Nursing_A (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_id TEXT,
-        diagnosis TEXT,
-        status TEXT,
-        callback_url TEXT,
-        duration REAL
-    )
-    ''')
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Queue_Nursing_B (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        patient_id TEXT,
-        diagnosis TEXT,
-        status TEXT,
-        callback_url TEXT,
-        duration REAL
-    )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Queue_ER (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id TEXT,
-            callback_url TEXT,
-            duration REAL
-        )
-    ''')
-
-    cursor.execute("INSERT INTO Resources (Intake, Surgery, Bed_A, Bed_B, ER) VALUES (4, 5, 30, 40, 9)")
-    conn.commit()
-    conn.close()
+import os
+import threading
+import time
+from collections import deque
+
+from storage import RESOURCE_CAPACITIES, OFF_HOURS_CAPACITIES, SQLiteStore, DurableStore, MemoryStore
+
+# Backend used if none is given to configure() and HOSPITAL_DB_BACKEND is not set
+DEFAULT_BACKEND = 'memory'
+
+# Storage backend behind the functions of this module ('sqlite', 'durable' or 'memory'), created by configure()
+# or on first use
+backend = None
+
+# Functions called with the queue or resource name whenever a patient is enqueued or a resource count changes
+listeners = []
+
+# Events of the callers blocked in acquire() per resource, in arrival order
+waiters = {}
+
+
+def configure(name=None, path='hospital_resources.db', snapshot_path=None, snapshot_interval=60, capacities=None):
+    """
+    Select the storage backend, HOSPITAL_DB_BACKEND or DEFAULT_BACKEND if no name is given.
+    'sqlite' keeps resources and queues in the database file, 'durable' as well but in WAL mode with one
+    connection and group commit, 'memory' keeps them in process memory and optionally writes a snapshot
+    to snapshot_path every snapshot_interval seconds. The previous backend is closed.
+    """
+    global backend
+    name = name or os.environ.get('HOSPITAL_DB_BACKEND', DEFAULT_BACKEND)
+    if name == 'sqlite':
+        store = SQLiteStore(path)
+    elif name == 'durable':
+        store = DurableStore(path, capacities=capacities)
+    elif name == 'memory':
+        store = MemoryStore(capacities, snapshot_path=snapshot_path, snapshot_interval=snapshot_interval)
+    else:
+        raise ValueError(f"Unknown storage backend: {name}")
+    if backend is not None:
+        backend.close()
+    backend = store
+    return backend
+
+
+def get_backend():
+    """
+    The storage backend, the default one is created on first use.
+    """
+    if backend is None:
+        configure()
+    return backend
+
+
+def use_backend(store):
+    """
+    Use an already created storage backend.
+    """
+    global backend
+    backend = store
+    return backend
+
+
+def subscribe(listener):
+    """
+    Register a listener that is notified when a patient is added to a queue or a resource is updated.
+    """
+    listeners.append(listener)
+
+
+def notify(name):
+    for listener in listeners:
+        listener(name)
+
+
+def init_db(capacities=None):
+    get_backend().init_db(capacities)
 
 
 def update_resource(resource, count):
     """
     Update the resource with new count.
     """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-    cursor.execute(f"UPDATE Resources SET {resource} = ? WHERE id = 1", (count,))
-    conn.commit()
-    conn.close()
+    get_backend().update_resource(resource, count)
+    notify(resource)
+    wake(resource)
 
 
 def get_resource(resource):
     """
     Get resource count.
     """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-    cursor.execute(f"SELECT {resource} FROM Resources WHERE id = 1")
-    result = cursor.fetchone()[0]
-    conn.close()
-    return result
+    return get_backend().get_resource(resource)
+
+
+def try_acquire(resource, n=1):
+    """
+    Take n units of the resource in one atomic operation if they are available, return whether they were taken.
+    Fails while callers wait in acquire(), so the waiters are served first.
+    """
+    if waiters.get(resource) or not get_backend().try_acquire(resource, n):
+        return False
+    notify(resource)
+    return True
 
 
-def add_to_queue(queue_type, patient_id, diagnosis, status, callback_url):
+def release(resource, n=1):
+    """
+    Give n units of the resource back and wake the first caller waiting for it.
+    A negative n withdraws units unconditionally, e.g. at the end of a shift.
+    """
+    get_backend().release(resource, n)
+    notify(resource)
+    wake(resource)
+
+
+def wake(resource):
+    queue = waiters.get(resource)
+    if queue:
+        queue[0].set()
+
+
+def acquire(resource, n=1, timeout=None):
+    """
+    Take n units of the resource, waiting up to timeout seconds (forever if None) in first come, first served order.
+    Return whether the units were taken.
+    """
+    queue = waiters.setdefault(resource, deque())
+    if not queue and get_backend().try_acquire(resource, n):
+        notify(resource)
+        return True
+    deadline = None if timeout is None else time.monotonic() + timeout
+    waiter = threading.Event()
+    queue.append(waiter)
+    try:
+        while True:
+            if queue[0] is waiter and get_backend().try_acquire(resource, n):
+                notify(resource)
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            waiter.wait(remaining)
+            waiter.clear()
+    finally:
+        queue.remove(waiter)
+        # hand the turn to the next waiter, the released units may be enough for it
+        if queue:
+            queue[0].set()
+
+
+def add_to_queue(queue_type, patient_id, diagnosis, status, callback_url, enqueued_at=0):
     """
     Add a patient to the queue, ER patient has priority.
+    enqueued_at is the simulation time the patient joins the queue, the waiting time is derived from it on dequeue.
     """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-
-    if queue_type == 'Queue_Surgery':
-        cursor.execute(
-            "INSERT INTO Queue_Surgery (patient_id, diagnosis, status, callback_url, duration) VALUES (?, ?, ?,?,?)",
-            (patient_id, diagnosis, status, callback_url, 0))
-        conn.commit()
-
-        if status == 'ER Treatment finished':
-            cursor.execute(
-                "SELECT patient_id, diagnosis, status, callback_url, duration FROM Queue_Surgery ORDER BY CASE WHEN status = 'ER Treatment finished' THEN 1 ELSE 2 END, id")
-            sorted_queue = cursor.fetchall()
-            cursor.execute("DELETE FROM Queue_Surgery")
-            for patient in sorted_queue:
-                cursor.execute(
-                    "INSERT INTO Queue_Surgery (patient_id, diagnosis, status, callback_url, duration) VALUES (?, ?, ?, ?, ?)",
-                    (patient[0], patient[1], patient[2], patient[3], patient[4]))
-        conn.commit()
-        conn.close()
-
-    if queue_type == 'Queue_Nursing_A':
-        cursor.execute(
-            "INSERT INTO Queue_Nursing_A (patient_id, diagnosis, status, callback_url, duration) VALUES (?, ?, ?, ?,?)",
-            (patient_id, diagnosis, status, callback_url, 0))
-        conn.commit()
-
-        if status == 'ER Treatment finished':
-            cursor.execute(
-                "SELECT patient_id, diagnosis, status, callback_url, duration FROM Queue_Nursing_A ORDER BY CASE WHEN status = 'ER Treatment finished' THEN 1 ELSE 2 END, id")
-            sorted_queue = cursor.fetchall()
-            cursor.execute("DELETE FROM Queue_Nursing_A")
-            for patient in sorted_queue:
-                cursor.execute(
-                    "INSERT INTO Queue_Nursing_A (patient_id, diagnosis, status, callback_url, duration) VALUES (?, ?, ?, ?,?)",
-                    (patient[0], patient[1], patient[2], patient[3], patient[4]))
-        conn.commit()
-        conn.close()
-
-    if queue_type == 'Queue_Nursing_B':
-        cursor.execute(
-            "INSERT INTO Queue_Nursing_B (patient_id, diagnosis, status, callback_url, duration) VALUES (?, ?, ?, ?,?)",
-            (patient_id, diagnosis, status, callback_url, 0))
-        conn.commit()
-
-        if status == 'ER Treatment finished':
-            cursor.execute(
-                "SELECT patient_id, diagnosis, status, callback_url, duration FROM Queue_Nursing_B ORDER BY CASE WHEN status = 'ER Treatment finished' THEN 1 ELSE 2 END, id")
-            sorted_queue = cursor.fetchall()
-            cursor.execute("DELETE FROM Queue_Nursing_B")
-            for patient in sorted_queue:
-                cursor.execute(
-                    "INSERT INTO Queue_Nursing_B (patient_id, diagnosis, status, callback_url, duration) VALUES (?, ?, ?, ?,?)",
-                    (patient[0], patient[1], patient[2], patient[3], patient[4]))
-        conn.commit()
-        conn.close()
+    get_backend().add_to_queue(queue_type, patient_id, diagnosis, status, callback_url, enqueued_at)
+    notify(queue_type)
 
 
 def get_count_queue(queue_type, status):
     """
     Count patient in the queue according to given status.
     """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-
-    if queue_type == 'Queue_Surgery':
-        cursor.execute("SELECT COUNT(*) FROM Queue_Surgery WHERE status = ?", (status,))
-    if queue_type == 'Queue_Nursing_A':
-        cursor.execute("SELECT COUNT(*) FROM Queue_Nursing_A WHERE status = ?", (status,))
-    if queue_type == 'Queue_Nursing_B':
-        cursor.execute("SELECT COUNT(*) FROM Queue_Nursing_A WHERE status = ?", (status,))
-
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    return get_backend().get_count_queue(queue_type, status)
 
 
 def get_queue(queue_type):
     """
     Get the queue.
     """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
+    return get_backend().get_queue(queue_type)
+
+
+def get_queue_length(queue_type):
+    """
+    Count all patients in the queue.
+    """
+    return get_backend().get_queue_length(queue_type)
 
-    if queue_type == 'Queue_Surgery':
-        cursor.execute("SELECT patient_id, diagnosis, status, callback_url, duration FROM Queue_Surgery")
-    if queue_type == 'Queue_Nursing_A':
-        cursor.execute("SELECT patient_id, diagnosis, status, callback_url, duration FROM Queue_Nursing_A")
-    if queue_type == 'Queue_Nursing_B':
-        cursor.execute("SELECT patient_id, diagnosis, status, callback_url, duration FROM Queue_Nursing_B")
 
-    queue = cursor.fetchall()
-    conn.close()
-    return queue
+def pop_from_queue(queue_type):
+    """
+    Remove and return the first patient of the queue, ER patients first, or None if the queue is empty.
+    """
+    return get_backend().pop_from_queue(queue_type)
 
 
 def delete_from_queue(queue_type, callback_url):
     """
     Delete a patient from the queue.
     """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-
-    if queue_type == 'Queue_Surgery':
-        cursor.execute("DELETE FROM Queue_Surgery WHERE callback_url = ?", (callback_url,))
-    if queue_type == 'Queue_Nursing_A':
-        cursor.execute("DELETE FROM Queue_Nursing_A WHERE callback_url = ?", (callback_url,))
-    if queue_type == 'Queue_Nursing_B':
-        cursor.execute("DELETE FROM Queue_Nursing_B WHERE callback_url = ?", (callback_url,))
-    conn.commit()
-    conn.close()
-
-
-def update_queue(queue_type, callback_url, duration):
-    """
-    Update a patient's record in the Queue.
-    """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-    if queue_type == 'Queue_Surgery':
-        cursor.execute('''
-                    UPDATE Queue_Surgery
-                    SET duration = ?
-                    WHERE callback_url = ?
-                ''', (duration, callback_url))
-    if queue_type == 'Queue_Nursing_A':
-        cursor.execute('''
-                    UPDATE Queue_Nursing_A
-                    SET duration = ?
-                    WHERE callback_url = ?
-                ''', (duration, callback_url))
-    if queue_type == 'Queue_Nursing_A':
-        cursor.execute('''
-                    UPDATE Queue_Nursing_B
-                    SET duration = ?
-                    WHERE callback_url = ?
-                ''', (duration, callback_url))
-    conn.commit()
-    conn.close()
-
-
-def add_to_queue_er(patient_id, callback_url):
-    """
-    Add a patient to queue er.
-    """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO Queue_ER (patient_id, callback_url, duration) VALUES (?, ?, ?)", (patient_id, callback_url, 0))
-    conn.commit()
-    conn.close()
+    get_backend().delete_from_queue(queue_type, callback_url)
+
+
+def add_to_queue_er(patient_id, callback_url, enqueued_at=0):
+    """
+    Add a patient to queue er at simulation time enqueued_at.
+    """
+    get_backend().add_to_queue_er(patient_id, callback_url, enqueued_at)
+    notify('Queue_ER')
 
 
 def delete_from_queue_er(callback_url):
     """
     Delete a patient from the queue er.
     """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-
-    cursor.execute("DELETE FROM Queue_ER WHERE callback_url = ?", (callback_url,))
-    conn.commit()
-    conn.close()
+    get_backend().delete_from_queue_er(callback_url)
 
 
 def get_queue_er():
     """
     Get the queue er.
     """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT patient_id, callback_url, duration FROM Queue_ER")
-    queue = cursor.fetchall()
-    conn.close()
-    return queue
-    # Close the connection
+    return get_backend().get_queue_er()
 
 
-def update_queue_er(callback_url, duration):
+def get_queue_length_er():
     """
-    Update a patient's record in the Queue_ER table.
+    Count all patients in the queue er.
     """
-    conn = sqlite3.connect('hospital_resources.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-                UPDATE Queue_ER
-                SET duration = ?
-                WHERE callback_url = ?
-            ''', (duration, callback_url))
-    conn.commit()
-    conn.close()
+    return get_backend().get_queue_length_er()
+
+
+def pop_from_queue_er():
+    """
+    Remove and return the first patient of the queue er, or None if the queue is empty.
+    """
+    return get_backend().pop_from_queue_er()
 
 
 if __name__ == '__main__':
+    # Write the initial capacities to the database file
+    configure(os.environ.get('HOSPITAL_DB_BACKEND', 'sqlite'))
     init_db()
-
@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class Delivery:
+    """
+    Outbound HTTP requests (CPEE callbacks and instance creation) delivered in the background.
+    Requests are put into a bounded queue and sent by a pool of workers, each with its own keep-alive session.
+    At most `per_host` requests are in flight per host, failed requests are retried with exponential backoff.
+    """
+
+    def __init__(self, workers=16, max_queue=10000, per_host=8, retries=3, backoff=0.5, timeout=30, transport=None):
+        self.workers = workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # Function sending a request, called with (method, url, **kwargs) and returning a response
+        self.transport = transport
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.host_slots = {}
+        self.lock = threading.Lock()
+        self.started = False
+        self.delivered = 0
+        self.failed = 0
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, method, url, **kwargs):
+        """
+        Queue a request and return immediately. Blocks only while the queue is full.
+        """
+        self.start()
+        self.queue.put((method, url, kwargs))
+
+    def put(self, url, **kwargs):
+        self.submit('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        self.submit('POST', url, **kwargs)
+
+    def join(self):
+        """
+        Wait until all queued requests have been delivered or given up.
+        """
+        self.queue.join()
+
+    def _slot(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
+    def _work(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.per_host)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        while True:
+            method, url, kwargs = self.queue.get()
+            try:
+                self._send(session, method, url, kwargs)
+            finally:
+                self.queue.task_done()
+
+    def _send(self, session, method, url, kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries + 1):
+            try:
+                with self._slot(url):
+                    if self.transport is not None:
+                        response = self.transport(method, url, **kwargs)
+                    else:
+                        response = session.request(method, url, **kwargs)
+                if response.status_code < 500:
+                    with self.lock:
+                        self.delivered += 1
+                    return response
+                error = f"status {response.status_code}"
+            except Exception as e:
+                # Any error is a failed attempt, an exception escaping here would end the worker thread
+                error = str(e) or type(e).__name__
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        with self.lock:
+            self.failed += 1
+        print(f"Delivery of {method} {url} failed: {error}")
+        return None
+
+
+# Shared outbox of the simulator and the instance generator
+outbox = Delivery()
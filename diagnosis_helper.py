@@ -1,13 +1,21 @@
-import random
-import numpy as np
+from variates import RandomStreams, cumulative
+
 
 class DiagnosisHelper:
-    def __init__(self):
+    def __init__(self, streams=None):
+        # Random number streams of the diagnoses and the service times per department
+        self.streams = RandomStreams() if streams is None else streams
+
         self.diagnosis_type_A = ['A1', 'A2', 'A3', 'A4']
         self.probabilities_A = [1 / 2, 1 / 4, 1 / 8, 1 / 8]
 
         self.diagnosis_type_B = ['B1', 'B2', 'B3', 'B4']
         self.probabilities_B = [1 / 2, 1 / 4, 1 / 8, 1 / 8]
+        self.cumulative_A = cumulative(self.probabilities_A)
+        self.cumulative_B = cumulative(self.probabilities_B)
+
+        self.intake_params = (1, 1 / 8)
+        self.er_params = (2, 1 / 2)
 
         self.operation_params = {
             'A2': (1, 1 / 4),
@@ -31,15 +39,13 @@ class DiagnosisHelper:
         """
         Assign patient with diagnosis type according to probabilities
         """
+        if type == 'ER':
+            # ER patients get a type A or B diagnosis with equal probability
+            type = 'A' if self.streams.uniform('diagnosis') < 0.5 else 'B'
         if type == 'A':
-            return random.choices(self.diagnosis_type_A, self.probabilities_A, k=1)[0]
+            return self.streams.choice('diagnosis', self.diagnosis_type_A, self.cumulative_A)
         elif type == 'B':
-            return random.choices(self.diagnosis_type_B, self.probabilities_B, k=1)[0]
-        elif type == 'ER':
-            if random.choice([True, False]):
-                return random.choices(self.diagnosis_type_A, self.probabilities_A, k=1)[0]
-            else:
-                return random.choices(self.diagnosis_type_B, self.probabilities_B, k=1)[0]
+            return self.streams.choice('diagnosis', self.diagnosis_type_B, self.cumulative_B)
         else:
             return None
 
@@ -50,24 +56,51 @@ class DiagnosisHelper:
         non_surgery_diagnoses = {'A1', 'B1', 'B2'}
         return False if diagnosis in non_surgery_diagnoses else True
 
-    def calculate_duration(self, params):
+    def calculate_duration(self, params, department):
         """
-        Choose value from normal distribution
+        Choose value from normal distribution, drawn from the stream of the department
         """
         mean, stddev = params
-        return max(0, np.random.normal(loc=mean, scale=stddev))
+        return max(0, self.streams.normal(department, mean, stddev))
+
+    def intake_time(self):
+        """
+        Get the duration for intake
+        """
+        return self.calculate_duration(self.intake_params, 'Intake')
+
+    def er_treatment_time(self):
+        """
+        Get the duration for ER treatment
+        """
+        return self.calculate_duration(self.er_params, 'ER')
 
     def diagnosis_operation_time(self, diagnosis):
         """
         Get the duration for surgery according to diagnosis type
         """
         params = self.operation_params.get(diagnosis)
-        return self.calculate_duration(params) if params else None
+        return self.calculate_duration(params, 'Surgery') if params else None
 
     def diagnosis_nursing_time(self, diagnosis):
         """
         Get the duration for nursing according to diagnosis type
         """
         params = self.nursing_params.get(diagnosis)
-        return self.calculate_duration(params) if params else None
+        if not params:
+            return None
+        return self.calculate_duration(params, 'Bed_A' if diagnosis.startswith('A') else 'Bed_B')
+
+    def expected_operation_time(self, diagnosis):
+        """
+        Get the mean duration for surgery according to diagnosis type
+        """
+        params = self.operation_params.get(diagnosis)
+        return params[0] if params else None
 
+    def expected_nursing_time(self, diagnosis):
+        """
+        Get the mean duration for nursing according to diagnosis type
+        """
+        params = self.nursing_params.get(diagnosis)
+        return params[0] if params else None
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import gzip
+import heapq
+import json
+import os
+import pickle
+import uuid
+from collections import deque
+
+import db
+import diagnosis_helper as dh
+from capacity_calendar import calendar_for, configure as configure_calendar, parse_holidays
+from eventlog import EventLog
+from instance_generator import generate_arrivals
+from metrics import Metrics
+from planner import admission_status, plan_batch, REPLAN_WINDOW, OccupancyTimeline
+from registry import PatientRegistry
+from time_helper import start_time, end_time
+from variates import RandomStreams
+
+# Version of the checkpoint file layout, checkpoints of other versions are rejected
+CHECKPOINT_VERSION = 5
+
+
+class EventCalendar:
+    """
+    Heap-ordered event calendar with a virtual clock.
+    The clock is measured in simulated hours and jumps straight to the next scheduled event.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.processed = 0
+        self._events = []
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def schedule(self, delay, action, *args):
+        """
+        Schedule an action to be executed after the given delay in hours.
+        """
+        self.schedule_at(self.now + max(0.0, delay), action, *args)
+
+    def schedule_at(self, when, action, *args):
+        """
+        Schedule an action at an absolute simulated time. Events at the same time run in insertion order.
+        """
+        self._sequence += 1
+        heapq.heappush(self._events, (when, self._sequence, action, args))
+
+    def run(self, until=None):
+        """
+        Execute events in time order until the calendar is empty or the clock would pass `until`.
+        """
+        count = 0
+        while self._events:
+            when, _, action, args = self._events[0]
+            if until is not None and when > until:
+                break
+            heapq.heappop(self._events)
+            self.now = when
+            self.processed += 1
+            action(*args)
+            count += 1
+        if until is not None:
+            self.now = max(self.now, until)
+        return count
+
+
+class Department:
+    """
+    Hospital resource with a number of parallel units and a waiting queue.
+    Patients who finished ER treatment are served before all other waiting patients.
+    """
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.busy = 0
+        self.priority_queue = deque()
+        self.queue = deque()
+        self.waiting_time = 0.0
+        self.served = 0
+
+    def available(self):
+        return self.capacity - self.busy
+
+    def queue_length(self):
+        return len(self.priority_queue) + len(self.queue)
+
+    def count_queue(self, status):
+        """
+        Count waiting patients according to given status.
+        """
+        return sum(1 for _, _, queued_status in self.queue if queued_status == status) \
+            + sum(1 for _, _, queued_status in self.priority_queue if queued_status == status)
+
+    def enqueue(self, patient, now, status):
+        if status == 'ER Treatment finished':
+            self.priority_queue.append((patient, now, status))
+        else:
+            self.queue.append((patient, now, status))
+
+    def dequeue(self):
+        if self.priority_queue:
+            return self.priority_queue.popleft()
+        return self.queue.popleft()
+
+
+class HospitalSimulation:
+    """
+    Discrete-event simulation of the hospital process on a virtual clock.
+    Arrivals, admission rules and service durations follow the CPEE driven simulator, but no time is spent
+    waiting for the wall clock, so a full year finishes within seconds.
+    """
+
+    def __init__(self, start=start_time, end=end_time, seed=None, capacities=None, replan=False, off_hours=None,
+                 event_log=None):
+        self.seed = seed
+        # Random number streams of the arrivals, diagnoses and service times, the same seed gives the same values
+        self.streams = RandomStreams(seed)
+        self.start = start
+        self.end = end
+        self.replan = replan
+        self.calendar = EventCalendar()
+        self.diagnosis_helper = dh.DiagnosisHelper(self.streams)
+        # Capacities during the working hours and of the resources reduced outside the working hours
+        self.capacities = dict(db.RESOURCE_CAPACITIES, **(capacities or {}))
+        self.off_hours = dict(db.OFF_HOURS_CAPACITIES, **(off_hours or {}))
+        self.departments = {name: Department(name, count) for name, count in self.capacities.items()}
+        # Shifts of the simulated period with the capacities above, shared with the arrival generator
+        self.capacity_calendar = calendar_for(start, end, self.capacities, self.off_hours)
+        self.arrivals = None
+        self.checkpoint_path = None
+        self.checkpoint_interval = None
+        # Sent-home patients collected for the next batch of the planner
+        self.replan_requests = []
+        # Patient states used by the planner, the registry keeps the occupancy timeline in sync
+        self.resources = PatientRegistry(OccupancyTimeline())
+        self.metrics = Metrics()
+        # Optional eventlog.EventLog receiving the events of every patient
+        self.event_log = event_log
+        self.stats = {
+            'arrived': {'Planned': 0, 'ER': 0},
+            'admitted': 0,
+            'sent_home': 0,
+            'replanned': 0,
+            'replan_failed': 0,
+            'released': 0,
+            'length_of_stay': 0.0,
+        }
+
+    def to_datetime(self, now):
+        return self.start + datetime.timedelta(hours=now)
+
+    def to_hours(self, moment):
+        return (moment - self.start).total_seconds() / 3600
+
+    def run(self, checkpoint_path=None, checkpoint_interval=None):
+        """
+        Run the simulation from start (or from where a resumed checkpoint stopped) to end and return the collected
+        statistics. With checkpoint_path and checkpoint_interval the state is saved every checkpoint_interval
+        simulated hours.
+        """
+        if self.arrivals is None:
+            self.arrivals = generate_arrivals(self.start, self.end, generator=self.streams.generator('arrivals'),
+                                              calendar=self.capacity_calendar)
+            self.calendar.schedule_at(0.0, self.start_shift, self.start)
+            if len(self.arrivals):
+                self.calendar.schedule_at(float(self.arrivals[0]['time']), self.arrive, 0)
+        if checkpoint_path and checkpoint_interval:
+            # a resumed simulation already has its next checkpoint on the calendar
+            if self.checkpoint_interval is None:
+                self.calendar.schedule(checkpoint_interval, self.periodic_checkpoint)
+            self.checkpoint_path, self.checkpoint_interval = checkpoint_path, checkpoint_interval
+        self.calendar.run(until=self.to_hours(self.end))
+        if self.event_log is not None:
+            self.event_log.flush()
+        return self.summary(self.calendar.processed)
+
+    # checkpoints
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # the event log is an open file, a resumed simulation gets a new one
+        state['event_log'] = None
+        return state
+
+    def checkpoint(self, path):
+        """
+        Save the complete state to a compressed pickle: clock, event calendar, queues, busy units, patient registry,
+        metrics and the random number streams with their buffers. The file is replaced atomically.
+        """
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'simulation': self,
+        }
+        temporary = f"{path}.tmp"
+        with gzip.open(temporary, 'wb', compresslevel=6) as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+
+    def periodic_checkpoint(self):
+        if self.checkpoint_path:
+            self.calendar.schedule(self.checkpoint_interval, self.periodic_checkpoint)
+            self.checkpoint(self.checkpoint_path)
+
+    @classmethod
+    def resume(cls, path, end=None, capacities=None, off_hours=None, replan=None, event_log=None):
+        """
+        Restore a simulation from a checkpoint, e.g. to continue an interrupted run or to fork a what-if branch
+        from a warm state with other capacities, replanning or end time. Call run() to continue.
+        """
+        with gzip.open(path, 'rb') as file:
+            state = pickle.load(file)
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version: {state.get('version')}")
+        simulation = state['simulation']
+        simulation.event_log = event_log
+        # periodic checkpoints continue only if run() is given a path again
+        simulation.checkpoint_path = None
+        if replan is not None:
+            simulation.replan = replan
+        if end is not None:
+            if end > simulation.end:
+                # arrivals and shifts were only generated and scheduled until the previous end
+                raise ValueError(f"A resumed simulation cannot run past its original end {simulation.end}")
+            simulation.end = end
+        if capacities or off_hours:
+            simulation.set_capacities(capacities, off_hours)
+        return simulation
+
+    def set_capacities(self, capacities=None, off_hours=None):
+        """
+        Change the capacities during and outside the working hours, effective immediately for the current shift.
+        """
+        self.capacities.update(capacities or {})
+        self.off_hours.update(off_hours or {})
+        moment = self.to_datetime(self.calendar.now)
+        for name, department in self.departments.items():
+            department.capacity = self.capacity_calendar.capacity(name, moment)
+            self.metrics.observe_resource(name, self.calendar.now, department.busy, department.capacity)
+            self.dispatch(department)
+
+    def summary(self, events=0):
+        departments = {
+            name: {
+                'served': department.served,
+                'mean_waiting_time': round(department.waiting_time / department.served, 4) if department.served else 0.0,
+                'queue_length': department.queue_length(),
+            }
+            for name, department in self.departments.items()
+        }
+        stats = dict(self.stats)
+        stats['mean_length_of_stay'] = round(stats.pop('length_of_stay') / stats['released'], 4) if stats['released'] else 0.0
+        stats['events'] = events
+        stats['departments'] = departments
+        stats['metrics'] = self.metrics.snapshot(self.calendar.now)
+        return stats
+
+    def log_event(self, cid, activity, patient_type, diagnosis, department='', value=float('nan')):
+        if self.event_log is not None:
+            self.event_log.log(self.calendar.now, cid, activity, department, patient_type, diagnosis, value)
+
+    # shifts and arrivals
+
+    def start_shift(self, shift_start):
+        """
+        Set the capacities of the resources that change with the shift (the surgery rooms by default) from the
+        capacity calendar and schedule the next transition.
+        """
+        for name, department in self.departments.items():
+            capacity = self.capacity_calendar.capacity(name, shift_start)
+            if capacity != department.capacity:
+                department.capacity = capacity
+                self.metrics.observe_resource(name, self.calendar.now, department.busy, department.capacity)
+                self.dispatch(department)
+        shift_end = self.capacity_calendar.next_transition(shift_start)
+        if shift_end < self.end:
+            self.calendar.schedule_at(self.to_hours(shift_end), self.start_shift, shift_end)
+
+    def arrive(self, index):
+        """
+        Admit the arrival with the given index and schedule the next one, so only one arrival is on the calendar.
+        """
+        arrival = self.arrivals[index]
+        patient_type = 'ER' if arrival['type'] == 'ER' else 'Planned'
+        patient_id = str(uuid.uuid4()) if arrival['has_id'] else ""
+        self.patient_admission(patient_type, patient_id, str(arrival['diagnosis']))
+        if index + 1 < len(self.arrivals):
+            self.calendar.schedule_at(float(self.arrivals[index + 1]['time']), self.arrive, index + 1)
+
+    # process model
+
+    def patient_admission(self, patient_type, patient_id, diagnosis):
+        """
+        Task "Patient Admission"
+        """
+        self.stats['arrived'][patient_type] += 1
+        intake = self.departments['Intake']
+        waiting_in_queue = sum(self.departments[name].count_queue('Intake finished')
+                               for name in ('Surgery', 'Bed_A', 'Bed_B'))
+        status = admission_status(patient_type, patient_id, intake.available(), waiting_in_queue)
+        if not patient_id:
+            patient_id = str(uuid.uuid4())
+
+        self.metrics.count(status)
+        self.log_event(patient_id, 'arrival', patient_type, diagnosis)
+        self.log_event(patient_id, status, patient_type, diagnosis)
+        if status == 'sent home':
+            self.stats['sent_home'] += 1
+            if self.replan:
+                self.replan_patient(patient_id, patient_type, diagnosis)
+            return
+
+        self.stats['admitted'] += 1
+        now = self.calendar.now
+        patient = {'cid': patient_id, 'type': patient_type, 'diagnosis': diagnosis, 'arrival': now}
+        self.resources.add(patient_id, 'Patient Adimission', self.to_datetime(now), diagnosis, False)
+        if patient_type == 'ER':
+            self.request(self.departments['ER'], patient, 'patient admitted')
+        else:
+            # reserve 1 intake personnel
+            intake.busy += 1
+            self.start_service(intake, patient, 0.0)
+
+    def replan_patient(self, patient_id, patient_type, diagnosis):
+        """
+        Task "Replan": the patient is planned with the other patients sent home within the replan window.
+        """
+        if not self.replan_requests:
+            self.calendar.schedule(REPLAN_WINDOW, self.replan_batch)
+        arrival_time = self.to_datetime(self.calendar.now).isoformat()
+        self.replan_requests.append((patient_id, arrival_time, {'diagnosis': diagnosis}, patient_type))
+
+    def replan_batch(self):
+        requests, self.replan_requests = self.replan_requests, []
+        plans = plan_batch([(cid, time, info) for cid, time, info, _ in requests], self.resources, self.capacities)
+        for (patient_id, _, info, patient_type), plan_result in zip(requests, plans):
+            if plan_result:
+                self.stats['replanned'] += 1
+                self.metrics.count('replanned')
+            else:
+                self.stats['replan_failed'] += 1
+                self.metrics.count('replan failed')
+            self.log_event(patient_id, 'replanned' if plan_result else 'replan failed', patient_type,
+                           info['diagnosis'])
+
+    def request(self, department, patient, status):
+        """
+        Serve the patient directly if the department is idle, otherwise add the patient to its queue.
+        """
+        if department.queue_length() == 0 and department.available() > 0:
+            department.busy += 1
+            self.start_service(department, patient, 0.0)
+        else:
+            self.set_task(patient, department, wait=True)
+            department.enqueue(patient, self.calendar.now, status)
+            self.log_event(patient['cid'], 'queue enter', patient['type'], patient['diagnosis'], department.name)
+            self.metrics.observe_queue(department.name, self.calendar.now, department.queue_length())
+
+    def dispatch(self, department):
+        """
+        Start waiting patients as long as units of the department are free.
+        """
+        while department.queue_length() > 0 and department.available() > 0:
+            patient, enqueued_at, _ = department.dequeue()
+            self.metrics.observe_queue(department.name, self.calendar.now, department.queue_length())
+            self.log_event(patient['cid'], 'queue leave', patient['type'], patient['diagnosis'], department.name,
+                           self.calendar.now - enqueued_at)
+            department.busy += 1
+            self.start_service(department, patient, self.calendar.now - enqueued_at)
+
+    def start_service(self, department, patient, waiting_time):
+        # the duration is drawn once and stored on the patient state, the planner predicts the end from it
+        duration = self.service_time(department, patient)
+        self.set_task(patient, department, wait=False, duration=duration)
+        department.waiting_time += waiting_time
+        department.served += 1
+        self.metrics.observe_wait(department.name, waiting_time)
+        self.metrics.observe_service(department.name, duration)
+        self.metrics.observe_resource(department.name, self.calendar.now, department.busy, department.capacity)
+        self.log_event(patient['cid'], 'service start', patient['type'], patient['diagnosis'], department.name, duration)
+        self.calendar.schedule(duration, self.finish_service, department, patient)
+
+    def service_time(self, department, patient):
+        if department.name == 'Intake':
+            return self.diagnosis_helper.intake_time()
+        if department.name == 'ER':
+            return self.diagnosis_helper.er_treatment_time()
+        if department.name == 'Surgery':
+            return self.diagnosis_helper.diagnosis_operation_time(patient['diagnosis'])
+        return self.diagnosis_helper.diagnosis_nursing_time(patient['diagnosis'])
+
+    def finish_service(self, department, patient):
+        self.log_event(patient['cid'], 'service end', patient['type'], patient['diagnosis'], department.name)
+        department.busy -= 1
+        self.metrics.observe_resource(department.name, self.calendar.now, department.busy, department.capacity)
+        self.dispatch(department)
+
+        if department.name == 'Intake':
+            self.next_treatment(patient, 'Intake finished')
+        elif department.name == 'ER':
+            # the diagnosis of ER patients is made during ER treatment
+            if not patient['diagnosis']:
+                patient['diagnosis'] = self.diagnosis_helper.assign_diagnosis('ER')
+            self.next_treatment(patient, 'ER Treatment finished')
+        elif department.name == 'Surgery':
+            self.request(self.nursing_department(patient), patient, 'Surgery finished')
+        else:
+            self.releasing(patient)
+
+    def next_treatment(self, patient, status):
+        if self.diagnosis_helper.requires_surgery(patient['diagnosis']):
+            self.request(self.departments['Surgery'], patient, status)
+        else:
+            self.request(self.nursing_department(patient), patient, status)
+
+    def nursing_department(self, patient):
+        return self.departments['Bed_A' if patient['diagnosis'].startswith('A') else 'Bed_B']
+
+    def set_task(self, patient, department, wait, duration=None):
+        task = {'Intake': 'Intake', 'ER': 'ER Treatment', 'Surgery': 'Surgery'}.get(department.name, 'Nursing')
+        self.resources.update(patient['cid'], task=task, start=self.to_datetime(self.calendar.now), wait=wait,
+                              diagnosis=patient['diagnosis'], duration=duration)
+
+    def releasing(self, patient):
+        """
+        Task "Releasing"
+        """
+        self.resources.remove(patient['cid'])
+        self.stats['released'] += 1
+        self.stats['length_of_stay'] += self.calendar.now - patient['arrival']
+        self.metrics.observe_length_of_stay(self.calendar.now - patient['arrival'])
+        self.log_event(patient['cid'], 'released', patient['type'], patient['diagnosis'],
+                       value=self.calendar.now - patient['arrival'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate the hospital on a virtual clock.')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the random number generators')
+    parser.add_argument('--end', help='end of the simulation (ISO format), defaults to the end time or the end of '
+                                       'the resumed simulation')
+    parser.add_argument('--replan', action='store_true', help='replan patients sent home with the planner')
+    parser.add_argument('--event-log', help='write the patient events to this file (.parquet, .arrow, .csv, .ndjson)')
+    parser.add_argument('--checkpoint', help='save the simulation state to this file periodically')
+    parser.add_argument('--checkpoint-every', type=float, default=24 * 7,
+                        help='simulated hours between two checkpoints (default: one week)')
+    parser.add_argument('--resume', help='continue from this checkpoint file')
+    parser.add_argument('--holidays', type=parse_holidays, default=None,
+                        help='comma-separated days without working shifts, e.g. 2018-12-25,2018-12-26')
+    args = parser.parse_args()
+    if args.holidays is not None:
+        configure_calendar(holidays=args.holidays)
+
+    event_log = EventLog(args.event_log, start_time) if args.event_log else None
+    end = datetime.datetime.fromisoformat(args.end) if args.end else None
+    # use the classes of the engine module, checkpoints of classes defined in __main__ cannot be loaded elsewhere
+    from engine import HospitalSimulation
+    if args.resume:
+        simulation = HospitalSimulation.resume(args.resume, end=end, replan=args.replan or None, event_log=event_log)
+    else:
+        simulation = HospitalSimulation(end=end or end_time, seed=args.seed, replan=args.replan, event_log=event_log)
+    try:
+        print(json.dumps(simulation.run(args.checkpoint, args.checkpoint_every if args.checkpoint else None),
+                         indent=2))
+    finally:
+        if event_log is not None:
+            event_log.close()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import argparse
+import array
+import csv
+import datetime
+import json
+import os
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+# Activities of the patient traces, stored as codes into this tuple
+ACTIVITIES = ('arrival', 'patient admitted', 'sent home', 'queue enter', 'queue leave', 'service start',
+              'service end', 'released', 'replanned', 'replan failed')
+DEPARTMENTS = ('', 'Intake', 'ER', 'Surgery', 'Bed_A', 'Bed_B')
+PATIENT_TYPES = ('Planned', 'ER')
+DIAGNOSES = ('', 'A1', 'A2', 'A3', 'A4', 'B1', 'B2', 'B3', 'B4')
+
+# XES lifecycle transition of the activities, all others are atomic ('complete')
+LIFECYCLE = {'queue enter': 'start', 'queue leave': 'complete', 'service start': 'start', 'service end': 'complete'}
+
+# Columns of the log files: timestamp, case (patient id), activity, department, patient type, diagnosis and
+# value (waiting time for 'queue leave', duration for 'service start', length of stay for 'released', in hours)
+COLUMNS = ('time', 'case', 'activity', 'department', 'patient_type', 'diagnosis', 'value')
+
+FORMATS = ('parquet', 'arrow', 'csv', 'ndjson')
+EXTENSIONS = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow', '.csv': 'csv', '.ndjson': 'ndjson',
+              '.jsonl': 'ndjson'}
+
+
+def log_format(path, format=None):
+    """
+    Format of a log file: the given one, else by extension, else Arrow IPC if pyarrow is installed and CSV otherwise.
+    """
+    if format is None:
+        format = EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'arrow' if pa is not None else 'csv')
+    if format not in FORMATS:
+        raise ValueError(f"Unknown event log format: {format}, expected one of {', '.join(FORMATS)}")
+    if format in ('parquet', 'arrow') and pa is None:
+        raise ValueError(f"The {format} format requires pyarrow, use csv or ndjson instead")
+    return format
+
+
+class EventLog:
+    """
+    Patient events buffered as typed columns and written to a columnar file in batches of batch_size events.
+    Times are simulated hours since `epoch` and are written as timestamps counted from `origin`.
+    Arrow IPC files can be memory-mapped for the analysis, Parquet files are the most compact.
+    """
+
+    def __init__(self, path, origin, epoch=0.0, format=None, batch_size=65536):
+        self.path = path
+        self.format = log_format(path, format)
+        self.origin = np.datetime64(origin, 'us')
+        self.epoch = epoch
+        self.batch_size = batch_size
+        self.activity_codes = {value: code for code, value in enumerate(ACTIVITIES)}
+        self.department_codes = {value: code for code, value in enumerate(DEPARTMENTS)}
+        self.patient_type_codes = {value: code for code, value in enumerate(PATIENT_TYPES)}
+        self.diagnosis_codes = {value: code for code, value in enumerate(DIAGNOSES)}
+        self.writer = None
+        self.file = None
+        self.events = 0
+        self._reset()
+
+    def _reset(self):
+        self.time = array.array('d')
+        self.case = []
+        self.activity = array.array('B')
+        self.department = array.array('B')
+        self.patient_type = array.array('B')
+        self.diagnosis = array.array('B')
+        self.value = array.array('d')
+
+    def __len__(self):
+        return self.events
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def log(self, now, case, activity, department='', patient_type='Planned', diagnosis='', value=float('nan')):
+        """
+        Add an event at the simulated time `now` (hours), flushing the buffer when a batch is full.
+        """
+        self.time.append(now - self.epoch)
+        self.case.append(case)
+        self.activity.append(self.activity_codes[activity])
+        self.department.append(self.department_codes[department])
+        self.patient_type.append(self.patient_type_codes[patient_type])
+        self.diagnosis.append(self.diagnosis_codes[diagnosis or ''])
+        self.value.append(value)
+        self.events += 1
+        if len(self.case) >= self.batch_size:
+            self.flush()
+
+    def anchor(self, now, moment):
+        """
+        Count the times from the datetime `moment` at the simulated time `now`, e.g. the first arrival of a run.
+        """
+        self.origin = np.datetime64(moment, 'us')
+        self.epoch = now
+
+    def timestamps(self):
+        hours = np.frombuffer(self.time, dtype=np.float64)
+        return self.origin + np.round(hours * 3600e6).astype('timedelta64[us]')
+
+    def flush(self):
+        """
+        Write the buffered events as one batch (a row group in Parquet, a record batch in Arrow IPC).
+        """
+        if not self.case:
+            return
+        if self.format in ('parquet', 'arrow'):
+            self._write_arrow()
+        else:
+            self._write_text()
+        self._reset()
+
+    def _write_arrow(self):
+        def dictionary(name, values):
+            codes = pa.array(np.frombuffer(getattr(self, name), dtype=np.uint8))
+            return pa.DictionaryArray.from_arrays(codes, pa.array(values))
+
+        batch = pa.record_batch([
+            pa.array(self.timestamps()),
+            pa.array(self.case, type=pa.string()),
+            dictionary('activity', ACTIVITIES),
+            dictionary('department', DEPARTMENTS),
+            dictionary('patient_type', PATIENT_TYPES),
+            dictionary('diagnosis', DIAGNOSES),
+            pa.array(np.frombuffer(self.value, dtype=np.float64), from_pandas=True),
+        ], names=list(COLUMNS))
+        if self.writer is None:
+            if self.format == 'parquet':
+                self.writer = pa.parquet.ParquetWriter(self.path, batch.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.path, batch.schema)
+        if self.format == 'parquet':
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def _write_text(self):
+        if self.file is None:
+            self.file = open(self.path, 'w', newline='')
+            if self.format == 'csv':
+                self.writer = csv.writer(self.file)
+                self.writer.writerow(COLUMNS)
+        rows = zip(np.datetime_as_string(self.timestamps()).tolist(), self.case,
+                   (ACTIVITIES[code] for code in self.activity), (DEPARTMENTS[code] for code in self.department),
+                   (PATIENT_TYPES[code] for code in self.patient_type), (DIAGNOSES[code] for code in self.diagnosis),
+                   (None if value != value else value for value in self.value))
+        if self.format == 'csv':
+            self.writer.writerows(rows)
+        else:
+            self.file.writelines(json.dumps(dict(zip(COLUMNS, row))) + '\n' for row in rows)
+
+    def close(self):
+        self.flush()
+        if self.format in ('parquet', 'arrow') and self.writer is not None:
+            self.writer.close()
+        if self.file is not None:
+            self.file.close()
+        self.writer = self.file = None
+
+
+def read_events(path, format=None):
+    """
+    Yield the events of a log file as dicts with a datetime 'time' and a float or None 'value'.
+    Arrow IPC files are memory-mapped and read batch by batch.
+    """
+    format = log_format(path, format)
+    if format in ('parquet', 'arrow'):
+        if format == 'parquet':
+            batches = pa.parquet.ParquetFile(path).iter_batches()
+        else:
+            reader = pa.ipc.open_file(pa.memory_map(path))
+            batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+        for batch in batches:
+            yield from batch.to_pylist()
+        return
+    with open(path, newline='') as file:
+        rows = csv.DictReader(file) if format == 'csv' else map(json.loads, file)
+        for row in rows:
+            row['time'] = datetime.datetime.fromisoformat(row['time'])
+            row['value'] = float(row['value']) if row['value'] not in (None, '') else None
+            yield row
+
+
+def export_csv(source, target, format=None):
+    """
+    Write a log as a flat CSV file (case, activity, timestamp, ...) for process-mining tools.
+    """
+    with open(target, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(('case_id', 'activity', 'timestamp', 'lifecycle', 'department', 'patient_type',
+                         'diagnosis', 'value'))
+        for event in read_events(source, format):
+            value = event['value']
+            writer.writerow((event['case'], event['activity'], event['time'].isoformat(),
+                             LIFECYCLE.get(event['activity'], 'complete'), event['department'],
+                             event['patient_type'], event['diagnosis'], '' if value is None or value != value else value))
+
+
+def export_xes(source, target, format=None):
+    """
+    Write a log as an XES file with one trace per patient. The events are grouped by case in memory.
+    """
+    traces = {}
+    for event in read_events(source, format):
+        traces.setdefault(event['case'], []).append(event)
+    with open(target, 'w', encoding='utf-8') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                   '<log xes.version="1.0" xes.features="nested-attributes" xmlns="http://www.xes-standard.org/">\n'
+                   '  <extension name="Concept" prefix="concept" uri="http://www.xes-standard.org/concept.xesext"/>\n'
+                   '  <extension name="Time" prefix="time" uri="http://www.xes-standard.org/time.xesext"/>\n'
+                   '  <extension name="Lifecycle" prefix="lifecycle" uri="http://www.xes-standard.org/lifecycle.xesext"/>\n'
+                   '  <extension name="Organizational" prefix="org" uri="http://www.xes-standard.org/org.xesext"/>\n')
+        for case, events in traces.items():
+            file.write(f'  <trace>\n    <string key="concept:name" value={quoteattr(case)}/>\n'
+                       f'    <string key="patient_type" value={quoteattr(events[0]["patient_type"])}/>\n')
+            for event in events:
+                file.write(f'    <event>\n'
+                           f'      <string key="concept:name" value={quoteattr(event["activity"])}/>\n'
+                           f'      <string key="lifecycle:transition" '
+                           f'value="{LIFECYCLE.get(event["activity"], "complete")}"/>\n'
+                           f'      <date key="time:timestamp" value="{event["time"].isoformat()}"/>\n')
+                if event['department']:
+                    file.write(f'      <string key="org:resource" value={quoteattr(event["department"])}/>\n')
+                if event['diagnosis']:
+                    file.write(f'      <string key="diagnosis" value={quoteattr(event["diagnosis"])}/>\n')
+                if event['value'] is not None and event['value'] == event['value']:
+                    file.write(f'      <float key="hours" value="{event["value"]}"/>\n')
+                file.write('    </event>\n')
+            file.write('  </trace>\n')
+        file.write('</log>\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export an event log of engine.py or simulator.py.')
+    parser.add_argument('log', help='event log file (parquet, arrow, csv or ndjson)')
+    parser.add_argument('--format', choices=FORMATS, help='format of the event log (default: by extension)')
+    parser.add_argument('--xes', help='write the log as XES to this file')
+    parser.add_argument('--csv', help='write the log as flat CSV to this file')
+    args = parser.parse_args()
+    if not args.xes and not args.csv:
+        parser.error('use --xes or --csv')
+
+    if args.xes:
+        export_xes(args.log, args.xes, args.format)
+    if args.csv:
+        export_csv(args.log, args.csv, args.format)
@@ -1,96 +1,129 @@
 #!/usr/bin/env python3
 import datetime
 import json
-import random
 import uuid
-from queue import PriorityQueue
-import requests
+import numpy as np
+from delivery import outbox
 from diagnosis_helper import DiagnosisHelper
+from capacity_calendar import calendar_for
 
 
 diagnosis_helper = DiagnosisHelper()
 
-queue = PriorityQueue()
+# Random number generator used when no seed or generator is given
+rng = np.random.default_rng()
+
+# Arrival record: time in hours since the start of the generated horizon, arrival type ('A', 'B' planned patients
+# or 'ER'), diagnosis (empty for ER patients) and whether the patient has an ID
+ARRIVAL_DTYPE = np.dtype([('time', 'f8'), ('type', 'U2'), ('diagnosis', 'U2'), ('has_id', '?')])
 
 
 def create_patient_instance(patient_type, patient_id, diagnosis, current_time_str):
     """
     Create a new instance.
     """
-    instance_response = requests.post("https://cpee.org/flow/start/url/",
-                                      data={"behavior": "fork_running",
-                                            "url": "https://cpee.org/hub/server/Teaching.dir/Prak.dir/Challengers.dir/Fen_Shi.dir/main.xml",
-                                            "init": json.dumps({
-                                                "patientType": patient_type,
-                                                "patientID": patient_id,
-                                                "diagnosis": diagnosis,
-                                                "arrival_time": current_time_str,
-
-                                            })
-                                            })
+    # delivered in the background, so spawning patients does not wait for the engine
+    outbox.post("https://cpee.org/flow/start/url/",
+                data={"behavior": "fork_running",
+                      "url": "https://cpee.org/hub/server/Teaching.dir/Prak.dir/Challengers.dir/Fen_Shi.dir/main.xml",
+                      "init": json.dumps({
+                          "patientType": patient_type,
+                          "patientID": patient_id,
+                          "diagnosis": diagnosis,
+                          "arrival_time": current_time_str,
+
+                      })
+                      })
 
     return (
-        f"Response content:, {instance_response.text}, Patient Type: {patient_type}, Patient ID: {patient_id}, diagnosis: {diagnosis}")
+        f"Instance creation queued, Patient Type: {patient_type}, Patient ID: {patient_id}, diagnosis: {diagnosis}")
 
 
-def simulate_planned_patients_a(current_time, end_time):
-    """
-    Generate instances of planned patients with diagnosis type A arriving within a specified time window.
-    """
-    count = 0
-    while current_time < end_time:
-        # Randomly assign a patient ID or leave it empty
-        patient_id = random.choice(["", str(uuid.uuid4())])
-        # Assign diagnosis type 'A'
-        diagnosis = diagnosis_helper.assign_diagnosis('A')
-        current_time, create_patient_instance('Planned', patient_id, diagnosis, current_time.isoformat())
-        # Increment the time interval by a uniform random value between 0 and 1 hour
-        time_delta = random.uniform(0, 1)
-        current_time += datetime.timedelta(hours=time_delta)
-        count += 1
-
-    return count
-
-
-def simulate_planned_patients_b(current_time, end_time):
+def arrival_batch(windows, arrival_type, generator=None):
     """
-    Generate instances of planned patients with diagnosis type B arriving within a specified time window.
+    Draw the arrivals of one arrival type for all given (start, end) windows in hours at once.
+    In every window the first patient arrives at its start, planned patients follow every uniform(0, 1) hours
+    and ER patients with exponentially distributed inter-arrival times.
     """
-    count = 0
-    while current_time < end_time:
-        patient_id = random.choice(["", str(uuid.uuid4())])
-        # Assign diagnosis type 'B'
-        diagnosis = diagnosis_helper.assign_diagnosis('B')
-        # Create patient instance and update the current time
-        current_time, create_patient_instance('Planned', patient_id, diagnosis, current_time.isoformat())
-        time_delta = random.uniform(0, 1)
-        current_time += datetime.timedelta(hours=time_delta)
-        count += 1
-
-    return count
+    generator = rng if generator is None else generator
+    windows = np.asarray(windows, dtype=float).reshape(-1, 2)
+    if len(windows) == 0:
+        return np.empty(0, dtype=ARRIVAL_DTYPE)
+    lengths = windows[:, 1] - windows[:, 0]
+    rate = 1 if arrival_type == 'ER' else 2
+    columns = int(rate * lengths.max() * 1.5) + 20
+
+    # Draw enough inter-arrival times to cover the longest window, retry with more if it is not covered
+    while True:
+        if arrival_type == 'ER':
+            gaps = generator.exponential(1, size=(len(windows), columns))
+        else:
+            gaps = generator.uniform(0, 1, size=(len(windows), columns))
+        offsets = np.zeros_like(gaps)
+        np.cumsum(gaps[:, :-1], axis=1, out=offsets[:, 1:])
+        if (offsets[:, -1] >= lengths).all():
+            break
+        columns *= 2
+
+    mask = offsets < lengths[:, None]
+    arrivals = np.empty(np.count_nonzero(mask), dtype=ARRIVAL_DTYPE)
+    arrivals['time'] = (windows[:, :1] + offsets)[mask]
+    arrivals['type'] = arrival_type
+    if arrival_type == 'A':
+        arrivals['diagnosis'] = generator.choice(diagnosis_helper.diagnosis_type_A, size=len(arrivals),
+                                                 p=diagnosis_helper.probabilities_A)
+    elif arrival_type == 'B':
+        arrivals['diagnosis'] = generator.choice(diagnosis_helper.diagnosis_type_B, size=len(arrivals),
+                                                 p=diagnosis_helper.probabilities_B)
+    else:
+        # ER patients do not have a predefined diagnosis
+        arrivals['diagnosis'] = ''
+    # Randomly assign a patient ID or leave it empty
+    arrivals['has_id'] = generator.random(len(arrivals)) < 0.5
+    return arrivals
 
 
-def simulate_er_patients(current_time, end_time):
+def generate_arrivals(start, end, seed=None, generator=None, calendar=None):
     """
-    Generate instances of ER patients arriving based on an exponential inter-arrival time distribution.
+    Generate all patient arrivals between start and end in one batch, sorted by arrival time.
+    Planned patients of type A and B arrive during the working shifts of the capacity calendar, ER patients
+    around the clock. Times are hours since start, the same seed always gives the same arrivals.
     """
-    count = 0
-    while current_time < end_time:
-        patient_id = random.choice(["", str(uuid.uuid4())])
-        # ER patients do not have a predefined diagnosis
-        diagnosis = ""
-        create_patient_instance('ER', patient_id, diagnosis, current_time.isoformat())
-        # Increment the time interval by an exponentially distributed random value
-        time_delta = random.expovariate(1)
-        current_time += datetime.timedelta(hours=time_delta)
-        count+=1
-
-    return count
-
-
-
-
-
-
-
-
+    generator = np.random.default_rng(seed) if generator is None else generator
+    calendar = calendar_for(start, end) if calendar is None else calendar
+    working_windows = []
+    all_windows = []
+    for shift_start, shift_end, working in calendar.shifts(start, end):
+        window = ((shift_start - start).total_seconds() / 3600, (min(shift_end, end) - start).total_seconds() / 3600)
+        all_windows.append(window)
+        if working:
+            working_windows.append(window)
+
+    arrivals = np.concatenate([
+        arrival_batch(working_windows, 'A', generator),
+        arrival_batch(working_windows, 'B', generator),
+        arrival_batch(all_windows, 'ER', generator),
+    ])
+    return arrivals[np.argsort(arrivals['time'], kind='stable')]
+
+
+def arrival_stream(start, end, generator=None, calendar=None):
+    """
+    Yield the patient arrivals between start and end one at a time in time order as
+    (arrival_time, patient_type, patient_id, diagnosis). The arrivals are drawn shift by shift when the stream
+    reaches the shift, so only the arrivals of one shift are held in memory.
+    """
+    generator = rng if generator is None else generator
+    calendar = calendar_for(start, end) if calendar is None else calendar
+    for shift_start, shift_end, working in calendar.shifts(start, end):
+        window = [(0.0, (min(shift_end, end) - shift_start).total_seconds() / 3600)]
+        # type A, type B and ER patients arrive during working hours, only ER patients otherwise
+        batches = [arrival_batch(window, arrival_type, generator) for arrival_type in ('A', 'B') if working]
+        batches.append(arrival_batch(window, 'ER', generator))
+        arrivals = np.concatenate(batches)
+        for arrival in arrivals[np.argsort(arrivals['time'], kind='stable')]:
+            # truncate to microseconds, rounding could move an arrival at the end of its window into the next one
+            arrival_time = shift_start + datetime.timedelta(microseconds=int(float(arrival['time']) * 3600e6))
+            patient_type = 'ER' if arrival['type'] == 'ER' else 'Planned'
+            patient_id = str(uuid.uuid4()) if arrival['has_id'] else ""
+            yield arrival_time, patient_type, patient_id, str(arrival['diagnosis'])
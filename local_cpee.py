@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse
+import contextlib
+import datetime
+import io
+import itertools
+import json
+import os
+import re
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from types import SimpleNamespace
+from urllib.parse import urlencode, urlsplit
+
+import gevent
+import gevent.event
+
+import db
+import simulator
+from delivery import outbox
+from eventlog import EventLog
+from time_helper import start_time
+
+PROPERTIES_NS = '{http://cpee.org/ns/properties/2.0}'
+DESCRIPTION_NS = '{http://cpee.org/ns/description/1.0}'
+
+# Base of the callback URLs handed to the simulator, callbacks are resolved in-process
+CALLBACK_BASE = 'http://local-cpee/callbacks/'
+
+# Manipulate tasks of the process model and the simulator endpoints they correspond to
+MANIPULATE_ENDPOINTS = {'Replan': '/replan', 'Releasing': '/releasing'}
+
+CONDITION = re.compile(r'''data\.(\w+)\s*==\s*["'](.*)["']$''')
+ASSIGN_RESULT = re.compile(r'''data\.(\w+)\s*=\s*result\['(\w+)'\]$''')
+ADD_RESULT = re.compile(r'''data\.(\w+)\s*\+=\s*result\['(\w+)'\]$''')
+APPEND = re.compile(r'''data\.(\w+)\s*<<\s*(.+)$''')
+ASSIGN_LITERAL = re.compile(r'''data\.(\w+)\s*=\s*(".*"|'.*'|\d+)$''')
+
+
+def load_model(path='main.xml'):
+    """
+    Read the endpoints (name -> path on the simulator), the initial data elements and the process description.
+    """
+    root = ET.parse(path).getroot()
+    endpoints = {element.tag.replace(PROPERTIES_NS, ''): urlsplit(element.text or '').path.rsplit('/', 1)[-1]
+                 for element in root.find(f'{PROPERTIES_NS}endpoints')}
+    data = {}
+    for element in root.find(f'{PROPERTIES_NS}dataelements'):
+        try:
+            data[element.tag.replace(PROPERTIES_NS, '')] = json.loads(element.text)
+        except (TypeError, ValueError):
+            data[element.tag.replace(PROPERTIES_NS, '')] = element.text
+    description = root.find(f'{PROPERTIES_NS}description/{DESCRIPTION_NS}description')
+    return endpoints, data, description
+
+
+def tag(element):
+    return element.tag.replace(DESCRIPTION_NS, '')
+
+
+def evaluate(condition, data):
+    """
+    Evaluate a condition of the form data.name=="value", the only form used in main.xml.
+    Ruby nil never equals a string, so missing data elements make the condition false.
+    """
+    match = CONDITION.match(condition.strip())
+    if match is None:
+        raise ValueError(f"Unsupported condition: {condition}")
+    value = data.get(match.group(1))
+    return value is not None and str(value) == match.group(2)
+
+
+def run_script(script, data, result=None):
+    """
+    Apply the data assignments of a finalize or manipulate script to the instance data.
+    Lines other than assignments from the result, literals and appends (e.g. uuid generation) are skipped.
+    """
+    result = result or {}
+    for line in (script or '').splitlines():
+        line = line.strip()
+        if match := ADD_RESULT.match(line):
+            data[match.group(1)] = (data.get(match.group(1)) or 0) + (result.get(match.group(2)) or 0)
+        elif match := ASSIGN_RESULT.match(line):
+            data[match.group(1)] = result.get(match.group(2))
+        elif match := ASSIGN_LITERAL.match(line):
+            data[match.group(1)] = json.loads(match.group(2).replace("'", '"'))
+        elif match := APPEND.match(line):
+            value = match.group(2)
+            item = ASSIGN_RESULT.match(f"data._ = {value}")
+            data.setdefault(match.group(1), []).append(result.get(item.group(2)) if item else value.strip('"\''))
+
+
+def wsgi_request(app, path, form, headers=None):
+    """
+    Send a form POST to the WSGI app in-process and return (status code, headers with lowercase names, body).
+    """
+    body = urlencode({key: '' if value is None else value for key, value in form.items()}).encode()
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'local-cpee',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in (headers or {}).items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    status = {}
+
+    def start_response(status_line, response_headers, exc_info=None):
+        status['code'] = int(status_line.split()[0])
+        status['headers'] = {name.lower(): value for name, value in response_headers}
+
+    content = b''.join(app(environ, start_response))
+    return status['code'], status['headers'], content
+
+
+class LocalCPEE:
+    """
+    In-process stand-in for the CPEE engine executing main.xml against the Bottle app of the simulator.
+    Calls are sent with a CPEE-CALLBACK header, a 202 answer with the CPEE-CALLBACK header suspends the instance
+    until the simulator PUTs the result to the callback URL. Instance creation and callbacks of the simulator
+    reach the engine through the delivery outbox, whose transport is replaced by `deliver`.
+    """
+
+    def __init__(self, app=simulator.app, model_path='main.xml'):
+        self.app = app
+        self.endpoints, self.data, self.description = load_model(model_path)
+        self.callbacks = {}
+        self.tokens = itertools.count()
+        self.instances = []
+        self.active = 0
+        self.peak = 0
+        self.finished = gevent.event.Event()
+        self.finished.set()
+
+    def deliver(self, method, url, **kwargs):
+        """
+        Transport of the delivery outbox: resolve callbacks and start instances for instance creation requests.
+        """
+        if url.startswith(CALLBACK_BASE):
+            waiter = self.callbacks.pop(url, None)
+            if waiter is None:
+                return SimpleNamespace(status_code=404)
+            waiter.set(kwargs.get('json') or {})
+        elif url.rstrip('/').endswith('/flow/start/url'):
+            self.start(json.loads(kwargs['data']['init']))
+        else:
+            return SimpleNamespace(status_code=404)
+        return SimpleNamespace(status_code=200)
+
+    def start(self, init):
+        """
+        Start a process instance with the given initial data.
+        """
+        instance = {'data': dict(self.data, **init), 'started': time.monotonic(), 'ended': None}
+        self.instances.append(instance)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        self.finished.clear()
+        gevent.spawn(self.run_instance, instance)
+        return instance
+
+    def run_instance(self, instance):
+        try:
+            self.execute(self.description, instance['data'])
+        except Exception as e:
+            instance['error'] = str(e)
+            # the instance is dropped, its patient never reaches /releasing
+            simulator.forget_patient(instance['data'].get('patientID'))
+        instance['ended'] = time.monotonic()
+        self.active -= 1
+        if self.active == 0:
+            self.finished.set()
+
+    def execute(self, element, data):
+        for child in element:
+            name = tag(child)
+            if name == 'call':
+                self.call(child, data)
+            elif name == 'manipulate':
+                self.manipulate(child, data)
+            elif name == 'choose':
+                self.choose(child, data)
+            elif name == 'loop':
+                self.loop(child, data)
+
+    def choose(self, element, data):
+        for branch in element:
+            if tag(branch) == 'alternative' and evaluate(branch.get('condition'), data):
+                self.execute(branch, data)
+                return
+            if tag(branch) == 'otherwise':
+                self.execute(branch, data)
+                return
+
+    def loop(self, element, data):
+        if element.get('mode') == 'post_test':
+            self.execute(element, data)
+        while evaluate(element.get('condition'), data):
+            self.execute(element, data)
+
+    def call(self, element, data):
+        """
+        Call an endpoint of the simulator. Besides the arguments of the call, the patientID, diagnosis and the
+        duration of the previous task are sent, as the handlers of the simulator read them.
+        """
+        parameters = element.find(f'{DESCRIPTION_NS}parameters')
+        form = {'patientID': data.get('patientID'), 'diagnosis': data.get('diagnosis'),
+                'duration': data.get('last_duration', 0)}
+        for argument in parameters.find(f'{DESCRIPTION_NS}arguments'):
+            value = argument.text or ''
+            form[tag(argument)] = data.get(value[len('!data.'):]) if value.startswith('!data.') else value
+        result = self.request('/' + self.endpoints[element.get('endpoint')], form)
+        data['last_duration'] = result.get('duration', 0)
+        finalize = element.find(f'{DESCRIPTION_NS}code/{DESCRIPTION_NS}finalize')
+        run_script(finalize.text if finalize is not None else '', data, result)
+
+    def manipulate(self, element, data):
+        if not data.get('patientID'):
+            data['patientID'] = str(uuid.uuid4())
+        run_script(element.text, data)
+        path = MANIPULATE_ENDPOINTS.get(element.get('label'))
+        if path:
+            self.request(path, {key: data.get(key) for key in ('patientID', 'patientType', 'diagnosis', 'arrival_time')})
+
+    def request(self, path, form):
+        """
+        POST to the simulator and return the result, waiting for the callback if the answer is asynchronous.
+        """
+        callback_url = f"{CALLBACK_BASE}{next(self.tokens)}"
+        waiter = gevent.event.AsyncResult()
+        self.callbacks[callback_url] = waiter
+        status, headers, content = wsgi_request(self.app, path, form, {'CPEE-CALLBACK': callback_url})
+        if status == 202 and headers.get('cpee-callback') == 'true':
+            return waiter.get()
+        self.callbacks.pop(callback_url, None)
+        try:
+            return json.loads(content) if content else {}
+        except ValueError:
+            return {}
+
+    def run(self, hours, seconds_per_hour=0.01, timeout=None, event_log_path=None, seed=None):
+        """
+        Run the simulator from its start time for the given number of simulated hours with the CPEE stand-in and
+        return throughput and latency of the instances. The patient events are written to event_log_path if given.
+        A seed replaces the random number streams of the simulator (HOSPITAL_SEED).
+        """
+        simulator.SECONDS_PER_HOUR = seconds_per_hour
+        if seed is not None:
+            simulator.seed_streams(seed)
+        outbox.transport = self.deliver
+        if event_log_path:
+            simulator.event_log = EventLog(event_log_path, start_time, epoch=simulator.clock())
+        end = start_time + datetime.timedelta(hours=hours)
+        began = time.monotonic()
+        workers = [gevent.spawn(worker) for worker in (simulator.process_queue_surgery, simulator.process_queue_nursing_a,
+                                                        simulator.process_queue_nursing_b, simulator.process_queue_er,
+                                                        simulator.process_replan_queue)]
+        simulation = gevent.spawn(simulator.simulation, start_time, end)
+        gevent.joinall([simulation], timeout=timeout)
+        remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - began))
+        # The last admitted patients are still in the hospital when the simulation returns
+        while not (self.finished.wait(remaining) and self.active == 0 and outbox.queue.unfinished_tasks == 0):
+            if timeout is not None and time.monotonic() - began >= timeout:
+                break
+            gevent.sleep(seconds_per_hour)
+        elapsed = time.monotonic() - began
+        gevent.killall(workers + [simulation])
+        if simulator.event_log is not None:
+            simulator.event_log.close()
+        return self.report(elapsed, seconds_per_hour)
+
+    def report(self, elapsed, seconds_per_hour):
+        done = [instance for instance in self.instances if instance['ended'] is not None]
+        latencies = sorted(instance['ended'] - instance['started'] for instance in done)
+        statuses = {}
+        for instance in done:
+            status = instance.get('error') and 'error' or instance['data'].get('status')
+            statuses[status] = statuses.get(status, 0) + 1
+
+        def percentile(q):
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 4) if latencies else 0.0
+
+        return {
+            'instances': len(self.instances),
+            'finished': len(done),
+            'statuses': statuses,
+            'wall_seconds': round(elapsed, 3),
+            'peak_concurrent_instances': self.peak,
+            'throughput_per_second': round(len(done) / elapsed, 2) if elapsed else 0.0,
+            'latency_seconds': {
+                'mean': round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(latencies[-1], 4) if latencies else 0.0,
+            },
+            'seconds_per_hour': seconds_per_hour,
+            'metrics': simulator.metrics.snapshot(simulator.clock()),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the simulator offline against a local CPEE stand-in.')
+    parser.add_argument('--hours', type=float, default=24 * 7, help='simulated hours from the start time')
+    parser.add_argument('--seconds-per-hour', type=float, default=0.01, help='wall-clock seconds per simulated hour')
+    parser.add_argument('--timeout', type=float, default=None, help='stop after this many wall-clock seconds')
+    parser.add_argument('--model', default='main.xml', help='process model to execute')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the simulator')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the arrivals, diagnoses and service times (default: HOSPITAL_SEED)')
+    parser.add_argument('--event-log', help='write the patient events to this file (.parquet, .arrow, .csv, .ndjson)')
+    args = parser.parse_args()
+
+    db.configure()
+    db.init_db()
+    engine = LocalCPEE(model_path=args.model)
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+        result = engine.run(args.hours, args.seconds_per_hour, args.timeout, args.event_log, args.seed)
+    print(json.dumps(result, indent=2))
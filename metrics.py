@@ -0,0 +1,228 @@
+import math
+from bisect import bisect_right
+from collections import Counter
+
+
+class RunningStats:
+    """
+    Count, mean, variance, minimum and maximum of a stream of values (Welford's algorithm).
+    """
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def snapshot(self):
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'mean': self.mean, 'stdev': math.sqrt(self.variance()),
+                'min': self.min, 'max': self.max}
+
+
+class P2Quantile:
+    """
+    Estimate of a quantile of a stream of values with five markers (P-square algorithm by Jain and Chlamtac).
+    """
+    __slots__ = ('p', 'initial', 'heights', 'positions', 'desired', 'increments')
+
+    def __init__(self, p):
+        self.p = p
+        self.initial = []
+        self.heights = None
+        self.positions = None
+        self.desired = None
+        self.increments = (0.0, p / 2, p, (1 + p) / 2, 1.0)
+
+    def add(self, value):
+        q = self.heights
+        if q is None:
+            self.initial.append(value)
+            if len(self.initial) == 5:
+                self.heights = sorted(self.initial)
+                self.positions = [0, 1, 2, 3, 4]
+                self.desired = [0.0, 2 * self.p, 4 * self.p, 2 + 2 * self.p, 4.0]
+            return
+        n, desired, increments = self.positions, self.desired, self.increments
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            # marker cell with q[k] <= value < q[k + 1]
+            k = bisect_right(q, value, 1, 4) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(1, 5):
+            desired[i] += increments[i]
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = desired[i] - n[i]
+            if d >= 1 and n[i + 1] - n[i] > 1:
+                d = 1
+            elif d <= -1 and n[i - 1] - n[i] < -1:
+                d = -1
+            else:
+                continue
+            height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+            if not q[i - 1] < height < q[i + 1]:
+                height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+            q[i] = height
+            n[i] += d
+
+    def value(self):
+        if self.heights is not None:
+            return self.heights[2]
+        if not self.initial:
+            return None
+        values = sorted(self.initial)
+        return values[min(len(values) - 1, int(self.p * len(values)))]
+
+
+class Distribution:
+    """
+    Running statistics and quantile estimates of a stream of values.
+    """
+    __slots__ = ('stats', 'quantiles')
+
+    def __init__(self, quantiles=(0.5, 0.95)):
+        self.stats = RunningStats()
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, value):
+        self.stats.add(value)
+        for quantile in self.quantiles:
+            quantile.add(value)
+
+    def snapshot(self):
+        result = self.stats.snapshot()
+        for quantile in self.quantiles:
+            result[f"p{round(quantile.p * 100):g}"] = quantile.value()
+        return result
+
+
+class TimeWeighted:
+    """
+    Time-weighted average of a value that changes at given points in time, such as a queue length.
+    """
+    __slots__ = ('start', 'last_time', 'value', 'total')
+
+    def __init__(self):
+        self.start = None
+        self.last_time = None
+        self.value = 0.0
+        self.total = 0.0
+
+    def update(self, now, value):
+        if self.last_time is None:
+            self.start = now
+        else:
+            self.total += self.value * (now - self.last_time)
+        self.last_time = now
+        self.value = value
+
+    def area(self, now):
+        """
+        Integral of the value from the first update until now.
+        """
+        if self.last_time is None:
+            return 0.0
+        return self.total + self.value * max(0.0, now - self.last_time)
+
+    def mean(self, now):
+        if self.last_time is None:
+            return 0.0
+        span = now - self.start
+        return self.area(now) / span if span > 0 else self.value
+
+
+class DepartmentMetrics:
+    """
+    Waiting and service times, time-weighted queue length and utilization of a department.
+    """
+
+    def __init__(self, quantiles=(0.5, 0.95)):
+        self.waiting_time = Distribution(quantiles)
+        # service times follow the known duration distributions, mean and variance are enough
+        self.service_time = Distribution(())
+        self.queue_length = TimeWeighted()
+        self.busy = TimeWeighted()
+        self.capacity = TimeWeighted()
+
+    def snapshot(self, now):
+        capacity = self.capacity.area(now)
+        return {
+            'waiting_time': self.waiting_time.snapshot(),
+            'service_time': self.service_time.snapshot(),
+            'queue_length': {'current': self.queue_length.value, 'mean': self.queue_length.mean(now)},
+            'busy': {'current': self.busy.value, 'mean': self.busy.mean(now)},
+            'utilization': self.busy.area(now) / capacity if capacity > 0 else 0.0,
+        }
+
+
+class Metrics:
+    """
+    Streaming KPIs of a simulation run in constant memory, fed from the admission, queue and service hooks.
+    Times are simulated hours.
+    """
+
+    def __init__(self, quantiles=(0.5, 0.95)):
+        self.quantiles = quantiles
+        self.counters = Counter()
+        self.departments = {}
+        self.length_of_stay = Distribution(quantiles)
+
+    def department(self, name):
+        department = self.departments.get(name)
+        if department is None:
+            department = self.departments[name] = DepartmentMetrics(self.quantiles)
+        return department
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe_wait(self, department, waiting_time):
+        self.department(department).waiting_time.add(waiting_time)
+
+    def observe_service(self, department, duration):
+        self.department(department).service_time.add(duration)
+
+    def observe_queue(self, department, now, length):
+        self.department(department).queue_length.update(now, length)
+
+    def observe_resource(self, department, now, busy, capacity):
+        department = self.department(department)
+        department.busy.update(now, busy)
+        department.capacity.update(now, capacity)
+
+    def observe_length_of_stay(self, hours):
+        self.length_of_stay.add(hours)
+
+    def snapshot(self, now):
+        """
+        Current values of all metrics as a JSON serializable dict.
+        """
+        return {
+            'time': now,
+            'counters': dict(self.counters),
+            'length_of_stay': self.length_of_stay.snapshot(),
+            'departments': {name: department.snapshot(now) for name, department in sorted(self.departments.items())},
+        }
@@ -1,157 +1,358 @@
 import datetime
-from constraint import Problem
+import math
+from collections import Counter
 import diagnosis_helper as dh
-from numpy import random
+from capacity_calendar import calendar_for
+from registry import PatientRecord
+from storage import RESOURCE_CAPACITIES
 
-operating_capacity = 5
-INTAKE_RESOURCES = 4
+# Default capacities, planner() takes the capacities of the simulated hospital if they differ
+operating_capacity = RESOURCE_CAPACITIES['Surgery']
+INTAKE_RESOURCES = RESOURCE_CAPACITIES['Intake']
 MAX_PENDING_PATIENTS = 2
-nursing_a_capacity = 30
-nursing_b_capacity = 40
+nursing_a_capacity = RESOURCE_CAPACITIES['Bed_A']
+nursing_b_capacity = RESOURCE_CAPACITIES['Bed_B']
+
+# How the planner predicts the end of ongoing tasks: 'sampled' uses the duration drawn when the patient
+# entered the task and stored on its state, 'expected' uses the mean duration of the diagnosis
+DURATION_MODE = 'sampled'
+
+# Origin of the hour buckets of the occupancy timeline
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+# Entries of the feasibility cache of a timeline before it is cleared
+FEASIBILITY_CACHE_SIZE = 4096
+
+# Simulated hours over which replanning requests are collected and planned together by plan_batch()
+REPLAN_WINDOW = 0.25
 
 
 diagnosis_helper = dh.DiagnosisHelper()
 
+
+def admission_status(patient_type, patient_id, intake_available, waiting_after_intake):
+    """
+    Decide whether a patient is admitted or sent home.
+    ER patients are always admitted, patients without ID are sent home, and planned patients are sent home
+    if no intake resource is free or more than two patients finished intake but have not been processed yet.
+    """
+    if patient_type == "ER":
+        return 'patient admitted'
+    if not patient_id:
+        return 'sent home'
+    if intake_available <= 0 or waiting_after_intake > MAX_PENDING_PATIENTS:
+        return 'sent home'
+    return 'patient admitted'
+
+
 def get_working_hours(start_time, days=7):
     """
     Generate a list of working hours for a given time frame.
-    Working hours are 8 AM to 5 PM, Monday to Friday, for 7 days from the start date.
+    Working hours are the full hours of the working shifts of the capacity calendar (8 AM to 5 PM, Monday to
+    Friday, except holidays), for 7 days from the start date.
     """
     start_time = datetime.datetime.fromisoformat(start_time)
-    working_hours = []
-    end_time = start_time + datetime.timedelta(days=days)
-    current_day = start_time.date()
+    # hours of the days before the day the time frame ends
+    end_time = datetime.datetime.combine((start_time + datetime.timedelta(days=days)).date(), datetime.time())
+    return calendar_for(start_time, end_time).working_hours(start_time, end_time)
 
-    while current_day < end_time.date():
-        for hour in range(8, 17):  # Working hours from 8 AM to 5 PM
-            working_time = datetime.datetime.combine(current_day, datetime.time(hour))
-            if start_time <= working_time < end_time and working_time.weekday() < 5:  # Within the next 7 days and Monday to Friday
-                working_hours.append(working_time)
-        current_day += datetime.timedelta(days=1)
-    return working_hours
 
-def calculate_end_time(start, duration):
+def department_of(task, diagnosis):
     """
-    Calculate the end time based on start time and duration in hours.
+    Department whose capacity a patient in the given task occupies, None for tasks without planner constraints.
     """
-    return start + datetime.timedelta(hours=duration)
+    if task in ('Intake', 'Surgery'):
+        return task
+    if task == 'Nursing':
+        return 'Nursing_A' if diagnosis.startswith('A') else 'Nursing_B'
+    return None
 
-def planner(cid, time, info, resources):
+
+def hour_index(time):
     """
-    Planner function to determine feasible rescheduling time for patients based on hospital constraints.
-    Uses constraint programming to check intake, surgery, and nursing capacities.
+    Number of hours since the epoch, the key of an hour bucket.
+    """
+    return (time - EPOCH).total_seconds() / 3600
+
+
+class OccupancyTimeline:
+    """
+    Occupancy of intake, surgery and nursing as counters per whole hour, maintained incrementally from patient states.
+    A patient in a task occupies its department in every hour bucket between start and predicted end,
+    a patient waiting for a task counts as pending for the department.
     """
-    problem = Problem()
-    current_time = time
-    working_hours = get_working_hours(current_time)
-    diagnosis = info.get('diagnosis', '')
 
-    require_surgery = diagnosis_helper.requires_surgery(diagnosis=diagnosis)
+    def __init__(self, duration_mode=None):
+        self.duration_mode = duration_mode or DURATION_MODE
+        self.patients = {}
+        self.occupancy = {department: Counter() for department in ('Intake', 'Surgery', 'Nursing_A', 'Nursing_B')}
+        self.pending = Counter()
+        # Patients planned by plan_batch() per hour bucket, each occupies an intake unit at its slot until the
+        # patient is admitted again, and the hour bucket of the reservation per cid
+        self.reserved = Counter()
+        self.reservations = {}
+        # Change stamps for the feasibility cache: a counter bumped on every change, the stamp of the last change
+        # per hour bucket and of the pending counts
+        self.version = 0
+        self.hour_versions = {}
+        self.pending_version = 0
+        self.feasibility = {}
 
-    # Add variable 'reschedule_time' with a domain of available working hours
-    problem.addVariable('reschedule_time', working_hours)
+    @classmethod
+    def from_resources(cls, resources, duration_mode=None):
+        """
+        Build a timeline from patient records or patient states in the dict format.
+        """
+        timeline = cls(duration_mode)
+        for resource in resources:
+            timeline.update(resource if isinstance(resource, PatientRecord) else PatientRecord.from_dict(resource))
+        return timeline
 
-    # Constraint for intake resources
-    def intake_resource_constraint(time):
+    def update(self, record):
         """
-        Ensure intake resources do not exceed capacity by checking concurrent intake tasks at the time.
+        Add a patient record or replace the previous state of the patient.
         """
-        ongoing_intake = [state for state in resources if state['task'] == 'Intake' and datetime.datetime.fromisoformat(state['start']) <= time]
-        ongoing_count = sum(1 for state in ongoing_intake if datetime.datetime.fromisoformat(state['start']) <= time < calculate_end_time(datetime.datetime.fromisoformat(state['start']), max(0, random.normal(loc=1, scale=1 / 8))))
-        return ongoing_count < INTAKE_RESOURCES
+        cid = record.cid
+        self.remove(cid)
+        # the patient is back, its own occupancy takes the place of the reservation
+        self.cancel_reservation(cid)
+        diagnosis = record.diagnosis or ''
+        department = department_of(record.task, diagnosis)
+        if department is None:
+            return
+        if record.wait:
+            self.pending[department] += 1
+            self.patients[cid] = (department, None)
+            self.version += 1
+            self.pending_version = self.version
+            return
 
-    problem.addConstraint(intake_resource_constraint, ['reschedule_time'])
+        start = hour_index(record.start)
+        duration = record.duration if self.duration_mode == 'sampled' else None
+        if duration is None:
+            duration = expected_duration(department, diagnosis)
+        end = start + (duration or 0)
+        hours = range(math.ceil(start), math.ceil(end))
+        counter = self.occupancy[department]
+        self.version += 1
+        hour_versions = self.hour_versions
+        for hour in hours:
+            counter[hour] += 1
+            hour_versions[hour] = self.version
+        self.patients[cid] = (department, hours)
 
- 
-    def surgery_capacity_constraint(time):
+    def remove(self, cid):
+        state = self.patients.pop(cid, None)
+        if state is None:
+            return
+        department, hours = state
+        self.version += 1
+        if hours is None:
+            self.pending[department] -= 1
+            self.pending_version = self.version
+            return
+        counter = self.occupancy[department]
+        hour_versions = self.hour_versions
+        for hour in hours:
+            counter[hour] -= 1
+            hour_versions[hour] = self.version
+            if not counter[hour]:
+                del counter[hour]
+
+    def ongoing(self, department, time):
         """
-        Limit the number of pending surgery cases to prevent overload.
+        Number of patients occupying the department at the given whole hour.
         """
-        surgery_pending_patients = sorted([state for state in resources if 
-                                   state['task'] == 'Surgery' and state['wait']], 
-                                  key=lambda x: x['start'])
-        
-        pending_count = len(surgery_pending_patients)
-        if pending_count >=2:
-            ongoing_surgeries = [state for state in resources if state['task'] == 'Surgery' and not state['wait']]
-            ongoing_count = sum(1 for state in ongoing_surgeries if
-                                datetime.datetime.fromisoformat(state['start']) <= time < calculate_end_time(datetime.datetime.fromisoformat(state['start']), diagnosis_helper.diagnosis_operation_time(diagnosis=state['info']['diagnosis'])))
-            if ongoing_count < operating_capacity:
-                pending_count-=1
+        return self.occupancy[department].get(math.ceil(hour_index(time)), 0)
+
+    def pending_count(self, department):
+        return self.pending[department]
 
-        return pending_count
+    def reserved_at(self, time):
+        return self.reserved.get(math.ceil(hour_index(time)), 0)
 
+    def reserve(self, cid, time):
+        """
+        Reserve an intake unit for a planned patient at the whole hour, replacing an earlier reservation of the patient.
+        """
+        self.cancel_reservation(cid)
+        hour = math.ceil(hour_index(time))
+        self.reservations[cid] = hour
+        self.reserved[hour] += 1
+        self.version += 1
+        self.hour_versions[hour] = self.version
 
+    def cancel_reservation(self, cid):
+        """
+        Drop the reservation of a patient who is admitted again or sent home.
+        """
+        hour = self.reservations.pop(cid, None)
+        if hour is None:
+            return
+        self.reserved[hour] -= 1
+        if not self.reserved[hour]:
+            del self.reserved[hour]
+        self.version += 1
+        self.hour_versions[hour] = self.version
 
-    def nursing_a_capacity_constraint(time):
+    def expire_reservations(self, time):
         """
-        Control pending count for nursing type 'A' patients.
+        Drop the reservations of the hours before the given time.
         """
-        nursing_a_pending_patients = sorted([state for state in resources if 
-                                            state['task'] == 'Nursing' and state['wait'] and 
-                                            state['info']['diagnosis'] in ['A1']], 
-                                            key=lambda x: x['start'])
-
-        
-        pending_a_count = len(nursing_a_pending_patients)
-        if pending_a_count > 2:
-            ongoing_a_nursing = [state for state in resources if state['task'] == 'Nursing' and not state['wait'] and 
-                                            state['info']['diagnosis'] in ['A1', 'A2', 'A3', 'A4']]
-            ongoing_a_count = sum(1 for state in ongoing_a_nursing if
-                                datetime.datetime.fromisoformat(state['start']) <= time < calculate_end_time(datetime.datetime.fromisoformat(state['start']), diagnosis_helper.diagnosis_nursing_time(diagnosis=state['info']['diagnosis'])))
-            if ongoing_a_count < nursing_a_capacity:
-                pending_a_count -= 1
-        
-        return pending_a_count
-
-
-
-    def nursing_b_capacity_constraint(time):
+        now = hour_index(time)
+        for cid in [cid for cid, hour in self.reservations.items() if hour < now]:
+            self.cancel_reservation(cid)
+
+    def stamp(self, time):
         """
-        Control pending count for nursing type 'B' patients.
+        Change stamp of everything the feasibility of a slot at the whole hour depends on.
         """
-        nursing_b_pending_patients = sorted([state for state in resources if 
-                                        state['task'] == 'Nursing' and state['wait'] and 
-                                        state['info']['diagnosis'] in ['B1', 'B2']], 
-                                        key=lambda x: x['start'])
-        pending_b_count =  len(nursing_b_pending_patients)
-        if pending_b_count > 2:
-            ongoing_b_nursing = [state for state in resources if state['task'] == 'Nursing' and not state['wait'] and 
-                                            state['info']['diagnosis'] in ['B1', 'B2', 'B3', 'B4']]
-            ongoing_b_count = sum(1 for state in ongoing_b_nursing if
-                                datetime.datetime.fromisoformat(state['start']) <= time < calculate_end_time(datetime.datetime.fromisoformat(state['start']), diagnosis_helper.diagnosis_nursing_time(diagnosis=state['info']['diagnosis'])))
-            if ongoing_b_count < nursing_b_capacity:
-                pending_b_count -= 1   
+        return self.hour_versions.get(math.ceil(hour_index(time)), 0), self.pending_version
 
-        return pending_b_count
 
+def expected_duration(department, diagnosis):
+    """
+    Mean duration of a task, used when no sampled duration is stored on the patient state.
+    """
+    if department == 'Intake':
+        return diagnosis_helper.intake_params[0]
+    if department == 'Surgery':
+        return diagnosis_helper.expected_operation_time(diagnosis)
+    return diagnosis_helper.expected_nursing_time(diagnosis)
 
 
-    def pending_constraint(time):
-        """
-        Constraint that no more than two patients have already finished intake and are waiting
-        """
-        pending_surgery_count = surgery_capacity_constraint(time)
-        pending_nursing_a_count = nursing_a_capacity_constraint(time)
-        pending_nursing_b_count = nursing_b_capacity_constraint(time)
-        return pending_surgery_count + pending_nursing_a_count + pending_nursing_b_count <= 2
+def intake_resource_constraint(timeline, time, limits):
+    """
+    Ensure intake resources do not exceed capacity by checking concurrent intake tasks at the time.
+    """
+    return timeline.ongoing('Intake', time) + timeline.reserved_at(time) < limits['Intake']
+
 
-    problem.addConstraint(pending_constraint, ['reschedule_time'])
+def surgery_capacity_constraint(timeline, time, limits):
+    """
+    Limit the number of pending surgery cases to prevent overload.
+    """
+    pending_count = timeline.pending_count('Surgery')
+    if pending_count >= 2 and timeline.ongoing('Surgery', time) < limits['Surgery']:
+        pending_count -= 1
+    return pending_count
+
+
+def nursing_a_capacity_constraint(timeline, time, limits):
+    """
+    Control pending count for nursing type 'A' patients.
+    """
+    pending_a_count = timeline.pending_count('Nursing_A')
+    if pending_a_count > 2 and timeline.ongoing('Nursing_A', time) < limits['Bed_A']:
+        pending_a_count -= 1
+    return pending_a_count
+
+
+def nursing_b_capacity_constraint(timeline, time, limits):
+    """
+    Control pending count for nursing type 'B' patients.
+    """
+    pending_b_count = timeline.pending_count('Nursing_B')
+    if pending_b_count > 2 and timeline.ongoing('Nursing_B', time) < limits['Bed_B']:
+        pending_b_count -= 1
+    return pending_b_count
+
+
+def pending_constraint(timeline, time, limits):
+    """
+    Constraint that no more than two patients have already finished intake and are waiting
+    """
+    pending_surgery_count = surgery_capacity_constraint(timeline, time, limits)
+    pending_nursing_a_count = nursing_a_capacity_constraint(timeline, time, limits)
+    pending_nursing_b_count = nursing_b_capacity_constraint(timeline, time, limits)
+    return pending_surgery_count + pending_nursing_a_count + pending_nursing_b_count <= MAX_PENDING_PATIENTS
+
+
+CONSTRAINTS = (intake_resource_constraint, pending_constraint)
 
 
-    solutions = problem.getSolutions()
+def feasible(timeline, time, limits, key):
+    """
+    Whether all constraints hold for the slot. The result is cached on the timeline per slot and capacities
+    until the occupancy of the slot's hour or a pending count changes.
+    """
+    stamp = timeline.stamp(time)
+    cached = timeline.feasibility.get((time, key))
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    result = all(constraint(timeline, time, limits) for constraint in CONSTRAINTS)
+    if len(timeline.feasibility) >= FEASIBILITY_CACHE_SIZE:
+        timeline.feasibility.clear()
+    timeline.feasibility[(time, key)] = (stamp, result)
+    return result
+
+
+def timeline_of(resources):
+    if isinstance(resources, OccupancyTimeline):
+        return resources
+    if getattr(resources, 'timeline', None) is not None:
+        return resources.timeline
+    return OccupancyTimeline.from_resources(resources)
+
+
+def capacity_limits(capacities=None):
+    capacities = capacities or {}
+    return {
+        'Intake': capacities.get('Intake', INTAKE_RESOURCES),
+        'Surgery': capacities.get('Surgery', operating_capacity),
+        'Bed_A': capacities.get('Bed_A', nursing_a_capacity),
+        'Bed_B': capacities.get('Bed_B', nursing_b_capacity),
+    }
+
+
+def earliest_slot(timeline, time, limits):
+    """
+    Earliest working hour of the next 7 days that satisfies all constraints, None if there is none.
+    """
+    key = tuple(limits.values())
+    for working_time in get_working_hours(time):
+        if feasible(timeline, working_time, limits, key):
+            return working_time
+    return None
 
-    # Sort solutions by the reschedule_time
-    solutions = sorted(solutions, key=lambda x: x['reschedule_time'])
 
-    # Choose the earliest solution if available
-    if solutions:
-        rescheduled_time = solutions[0]['reschedule_time']
-        return {
-            'cid': cid,
-            'reschedule_time': rescheduled_time.isoformat(),
-            'info': info
-        }
-    else:
+def planner(cid, time, info, resources, capacities=None):
+    """
+    Planner function to determine feasible rescheduling time for patients based on hospital constraints.
+    Checks the intake, surgery and nursing constraints on the working hours of the next 7 days in time order
+    and stops at the earliest feasible slot.
+    `resources` is an OccupancyTimeline or a PatientRegistry with a timeline kept up to date by the caller,
+    or a list of patient states. `capacities` overrides the default capacities per resource name.
+    """
+    working_time = earliest_slot(timeline_of(resources), time, capacity_limits(capacities))
+    if working_time is None:
         return None
+    return {
+        'cid': cid,
+        'reschedule_time': working_time.isoformat(),
+        'info': info
+    }
+
 
+def plan_batch(patients, resources, capacities=None):
+    """
+    Plan several sent-home patients jointly. `patients` are (cid, time, info) tuples, the result has the plan
+    (as returned by planner()) or None of every patient in the same order.
+    The patients are assigned greedily in the order of their time: each one gets the earliest feasible slot with the
+    patients assigned before counted in, so a burst is spread over the slots instead of overloading the first one.
+    The slots stay reserved on the timeline of `resources` until the patient is admitted or sent home again,
+    or their hour has passed.
+    """
+    timeline = timeline_of(resources)
+    limits = capacity_limits(capacities)
+    if patients:
+        timeline.expire_reservations(datetime.datetime.fromisoformat(min(time for _, time, _ in patients)))
+    results = [None] * len(patients)
+    for index in sorted(range(len(patients)), key=lambda index: patients[index][1]):
+        cid, time, info = patients[index]
+        working_time = earliest_slot(timeline, time, limits)
+        if working_time is not None:
+            timeline.reserve(cid, working_time)
+            results[index] = {'cid': cid, 'reschedule_time': working_time.isoformat(), 'info': info}
+    return results
@@ -0,0 +1,136 @@
+import datetime
+
+
+class PatientRecord:
+    """
+    State of a patient in the hospital: current task, when it started, diagnosis, whether the patient
+    waits for the task and the duration sampled for it.
+    """
+    __slots__ = ('cid', 'task', 'start', 'diagnosis', 'wait', 'duration')
+
+    def __init__(self, cid, task, start, diagnosis, wait, duration=None):
+        self.cid = cid
+        self.task = task
+        self.start = start
+        self.diagnosis = diagnosis
+        self.wait = wait
+        self.duration = duration
+
+    @classmethod
+    def from_dict(cls, resource):
+        """
+        Create a record from a patient state in the dict format {"cid", "task", "start", "info", "wait"}.
+        """
+        start = resource['start']
+        if isinstance(start, str):
+            start = datetime.datetime.fromisoformat(start)
+        return cls(resource['cid'], resource['task'], start, resource['info']['diagnosis'], resource['wait'],
+                   resource.get('duration'))
+
+    def as_dict(self):
+        return {
+            "cid": self.cid,
+            "task": self.task,
+            "start": self.start.isoformat(),
+            "info": {"diagnosis": self.diagnosis},
+            "wait": self.wait,
+            "duration": self.duration
+        }
+
+
+class PatientRegistry:
+    """
+    Patients currently in the hospital keyed by cid, with secondary indexes from task to cids and of the waiting cids.
+    Every change is passed on to the occupancy timeline of the planner if one is given.
+    """
+
+    def __init__(self, timeline=None):
+        self.timeline = timeline
+        self.records = {}
+        self.tasks = {}
+        self.waiting_cids = set()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(list(self.records.values()))
+
+    def __contains__(self, cid):
+        return cid in self.records
+
+    def get(self, cid):
+        return self.records.get(cid)
+
+    def add(self, cid, task, start, diagnosis, wait, duration=None):
+        """
+        Add a patient, replacing a previous record with the same cid.
+        """
+        self.remove(cid)
+        record = PatientRecord(cid, task, start, diagnosis, wait, duration)
+        self.records[cid] = record
+        self._index(record)
+        self._sync(record)
+        return record
+
+    def update(self, cid, task=None, start=None, wait=None, diagnosis=None, duration=None):
+        """
+        Update the given fields of a patient. A new task or wait state resets the sampled duration to `duration`.
+        Returns the record, or None if the patient is unknown.
+        """
+        record = self.records.get(cid)
+        if record is None:
+            return None
+        self._unindex(record)
+        if task is not None:
+            record.task = task
+        if start is not None:
+            record.start = start
+        if wait is not None:
+            record.wait = wait
+        if diagnosis is not None:
+            record.diagnosis = diagnosis
+        if task is not None or wait is not None or duration is not None:
+            record.duration = duration
+        self._index(record)
+        self._sync(record)
+        return record
+
+    def remove(self, cid):
+        record = self.records.pop(cid, None)
+        if record is not None:
+            self._unindex(record)
+            if self.timeline is not None:
+                self.timeline.remove(cid)
+        return record
+
+    def with_task(self, task):
+        """
+        Patients in the given task, waiting or not.
+        """
+        return [self.records[cid] for cid in self.tasks.get(task, ())]
+
+    def waiting(self, task=None):
+        """
+        Patients waiting for the given task, or for any task.
+        """
+        if task is None:
+            return [self.records[cid] for cid in self.waiting_cids]
+        return [self.records[cid] for cid in self.tasks.get(task, ()) if cid in self.waiting_cids]
+
+    def _index(self, record):
+        self.tasks.setdefault(record.task, set()).add(record.cid)
+        if record.wait:
+            self.waiting_cids.add(record.cid)
+
+    def _unindex(self, record):
+        cids = self.tasks.get(record.task)
+        if cids is not None:
+            cids.discard(record.cid)
+            if not cids:
+                del self.tasks[record.task]
+        self.waiting_cids.discard(record.cid)
+
+    def _sync(self, record):
+        if self.timeline is not None:
+            self.timeline.update(record)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import json
+import math
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from engine import HospitalSimulation
+from time_helper import start_time, end_time
+
+# Two-sided 95% quantiles of Student's t distribution by degrees of freedom, the normal quantile above 30
+T_QUANTILES = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+    11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093, 20: 2.086,
+    21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060, 26: 2.056, 27: 2.052, 28: 2.048, 29: 2.045, 30: 2.042,
+}
+NORMAL_QUANTILE = 1.960
+
+
+def kpis(summary):
+    """
+    Key performance indicators of one simulation run.
+    """
+    arrived = summary['arrived']['Planned'] + summary['arrived']['ER']
+    replans = summary['replanned'] + summary['replan_failed']
+    values = {
+        'sent_home_rate': summary['sent_home'] / arrived if arrived else 0.0,
+        'replan_success_rate': summary['replanned'] / replans if replans else None,
+        'mean_length_of_stay': summary['mean_length_of_stay'],
+        'admitted': summary['admitted'],
+        'released': summary['released'],
+    }
+    for name, department in summary['departments'].items():
+        values[f'waiting_time.{name}'] = department['mean_waiting_time']
+    return values
+
+
+def run_replication(seed, capacities=None, replan=False, start=start_time, end=end_time, off_hours=None):
+    """
+    Run one isolated simulation and return its seed and KPIs. Executed in a worker process,
+    every run has its own random state, resources and queues in memory.
+    """
+    simulation = HospitalSimulation(start=start, end=end, seed=seed, capacities=capacities, replan=replan,
+                                    off_hours=off_hours)
+    return {'seed': seed, 'kpis': kpis(simulation.run())}
+
+
+def confidence_interval(values):
+    """
+    Mean and 95% confidence interval of the mean of independent replications.
+    """
+    n = len(values)
+    mean = statistics.fmean(values)
+    if n < 2:
+        return {'n': n, 'mean': mean, 'stdev': 0.0, 'half_width': None, 'low': None, 'high': None}
+    stdev = statistics.stdev(values)
+    half_width = T_QUANTILES.get(n - 1, NORMAL_QUANTILE) * stdev / math.sqrt(n)
+    return {'n': n, 'mean': mean, 'stdev': stdev, 'half_width': half_width,
+            'low': mean - half_width, 'high': mean + half_width}
+
+
+def aggregate(runs):
+    """
+    Confidence interval of every KPI over the replications, KPIs without a value in a run are left out.
+    """
+    names = sorted({name for run in runs for name in run['kpis']})
+    result = {}
+    for name in names:
+        values = [run['kpis'][name] for run in runs if run['kpis'].get(name) is not None]
+        if values:
+            result[name] = {key: round(value, 6) if isinstance(value, float) else value
+                            for key, value in confidence_interval(values).items()}
+    return result
+
+
+def run_replications(replications, base_seed=0, capacities=None, replan=False, start=start_time, end=end_time,
+                     workers=None):
+    """
+    Run independent replications with the seeds base_seed, base_seed + 1, ... in a process pool
+    and aggregate their KPIs.
+    """
+    seeds = [base_seed + index for index in range(replications)]
+    workers = workers or os.cpu_count()
+    began = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        runs = list(executor.map(run_replication, seeds, [capacities] * replications, [replan] * replications,
+                                 [start] * replications, [end] * replications))
+    elapsed = time.perf_counter() - began
+    return {
+        'capacities': capacities or {},
+        'replan': replan,
+        'replications': replications,
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'runs_per_second': round(replications / elapsed, 3),
+        'kpis': aggregate(runs),
+        'runs': runs,
+    }
+
+
+def parse_capacity(value):
+    name, _, count = value.partition('=')
+    if not count.isdigit():
+        raise argparse.ArgumentTypeError(f"Expected RESOURCE=COUNT, got {value}")
+    return name, int(count)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run independent replications of the hospital simulation.')
+    parser.add_argument('-n', '--replications', type=int, default=10, help='number of replications')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first replication')
+    parser.add_argument('--capacity', type=parse_capacity, action='append', default=[],
+                        help='resource capacity, e.g. Bed_A=35 (repeatable)')
+    parser.add_argument('--replan', action='store_true', help='replan patients sent home with the planner')
+    parser.add_argument('--end', default=end_time.isoformat(), help='end of the simulation (ISO format)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPU count)')
+    parser.add_argument('--runs', action='store_true', help='include the KPIs of every replication')
+    args = parser.parse_args()
+
+    result = run_replications(args.replications, args.seed, dict(args.capacity) or None, args.replan,
+                              end=datetime.datetime.fromisoformat(args.end), workers=args.workers)
+    if not args.runs:
+        del result['runs']
+    print(json.dumps(result, indent=2))
@@ -1,105 +1,238 @@
 #!/usr/bin/env python3
 import datetime
-import threading
+import heapq
+import itertools
+import math
+import os
 import time
 import uuid
-from concurrent.futures import ThreadPoolExecutor
-from queue import PriorityQueue
+from collections import deque
 from gevent import monkey
 
 monkey.patch_all()
 
 import json
 import gevent
+import gevent.event
 from gevent.pywsgi import WSGIServer
 from gevent.lock import Semaphore
 from bottle import Bottle, request, response, HTTPResponse
-from numpy import random
-import requests
 import db
+from delivery import outbox
 import diagnosis_helper as dh
-from planner import planner
-from instance_generator import simulate_er_patients, simulate_planned_patients_a, simulate_planned_patients_b
-from time_helper import start_time, end_time, is_not_working_hour, next_working_hour, next_non_working_hour
+from planner import admission_status, plan_batch, OccupancyTimeline, MAX_PENDING_PATIENTS, REPLAN_WINDOW
+from registry import PatientRegistry
+from capacity_calendar import calendar_for
+from eventlog import EventLog
+from metrics import Metrics
+from instance_generator import arrival_stream, create_patient_instance
+from time_helper import start_time, end_time
+from variates import RandomStreams
 
 app = Bottle()
-diagnosis_helper = dh.DiagnosisHelper()
-resources = []
-
-def add_resources(cid, task, start_time, diagnosis, wait):
-    resource = {
-        "cid": cid,
-        "task": task,
-        "start": start_time.isoformat(),
-        "info": {"diagnosis": diagnosis},
-        "wait": wait
-    }
-    resources.append(resource)
-    print(json.dumps(resource))
-
-
-def update_resource(cid, new_task=None, new_start=None, new_wait=None, new_diagnosis=None):
-    for resource in resources:
-        if resource["cid"] == cid:
-            if new_task is not None:
-                resource["task"] = new_task
-            if new_start is not None:
-                current_start = datetime.datetime.fromisoformat(resource["start"])
-                updated_start = current_start + datetime.timedelta(hours=float(new_start))
-                resource["start"] = updated_start.isoformat()
-            if new_wait is not None:
-                resource["wait"] = new_wait
-            if new_diagnosis is not None:
-                resource["info"]["diagnosis"] = new_diagnosis
-            print(json.dumps(resource))
-            break
+# Seed of the arrivals, diagnoses and service times, HOSPITAL_SEED makes a run reproducible
+SEED = int(os.environ['HOSPITAL_SEED']) if os.environ.get('HOSPITAL_SEED') else None
+streams = RandomStreams(SEED)
+diagnosis_helper = dh.DiagnosisHelper(streams)
+# Patients in the hospital keyed by cid, the registry keeps the occupancy timeline of the planner in sync
+resources = PatientRegistry(OccupancyTimeline())
+# Streaming KPIs of the run, served on GET /metrics
+metrics = Metrics()
+# Clock time of the admission of every patient in the hospital, for the length of stay
+admitted_at = {}
+# Patient events are written to this file if set, in the format given by its extension
+EVENT_LOG_PATH = os.environ.get('HOSPITAL_EVENT_LOG')
+event_log = None
+patient_types = {}
+# Print every patient state change, off by default as it floods stdout during long runs
+LOG_STATE_CHANGES = os.environ.get('HOSPITAL_LOG_STATE_CHANGES') == '1'
+
+
+def seed_streams(seed):
+    """
+    Draw the arrivals, diagnoses and service times of the next simulation from new streams of the given seed.
+    """
+    global streams, diagnosis_helper
+    streams = RandomStreams(seed)
+    diagnosis_helper = dh.DiagnosisHelper(streams)
+
+
+def add_resources(cid, task, start_time, diagnosis, wait, duration=None):
+    record = resources.add(cid, task, start_time, diagnosis, wait, duration)
+    if LOG_STATE_CHANGES:
+        print(json.dumps(record.as_dict()))
+
+
+def update_resource(cid, new_task=None, new_start=None, new_wait=None, new_diagnosis=None, new_duration=None):
+    """
+    Update the state of a patient. new_start is the number of hours the task starts after the previous one,
+    new_duration the duration sampled for the task the patient starts, the planner predicts the end of the task from it.
+    """
+    record = resources.get(cid)
+    if record is None:
+        return
+    updated_start = None
+    if new_start is not None:
+        updated_start = record.start + datetime.timedelta(hours=float(new_start))
+    resources.update(cid, task=new_task, start=updated_start, wait=new_wait, diagnosis=new_diagnosis,
+                     duration=new_duration)
+    if LOG_STATE_CHANGES:
+        print(json.dumps(record.as_dict()))
+
+
+def forget_patient(cid):
+    """
+    Drop all state kept for a patient: the registry record, the admission time and the patient type.
+    Called on every path a patient leaves by, so the state stays bounded by the patients in the hospital.
+    Returns the admission time, or None if the patient was not admitted.
+    """
+    resources.remove(cid)
+    patient_types.pop(cid, None)
+    return admitted_at.pop(cid, None)
 
 
 def remove_resource(cid):
-    global resources
-    resources = [resource for resource in resources if resource["cid"] != cid]
-    print(f"Patient {cid} has been released.")
+    admitted = forget_patient(cid)
+    if admitted is not None:
+        metrics.count('released')
+        length_of_stay = clock() - admitted
+        metrics.observe_length_of_stay(length_of_stay)
+        log_event(cid, 'released', value=length_of_stay)
+    if LOG_STATE_CHANGES:
+        print(f"Patient {cid} has been released.")
+
 
+# Sent-home patients waiting for the next batch of the planner
+replan_requests = []
+replan_requested = gevent.event.Event()
 
-# Semaphores for hospital resource management
+# Semaphores guarding the hand-over of the next queued patient to a free resource unit
 surgery_semaphore = Semaphore()
 bed_a_semaphore = Semaphore()
 bed_b_semaphore = Semaphore()
 er_semaphore = Semaphore()
 
-# Priority queues for simulation
-patient_queue_non_working_hour = PriorityQueue()
-patient_queue_working_hour = PriorityQueue()
+# Instances are created from the arrival stream ahead of their admission, by at most ARRIVAL_LOOKAHEAD simulated
+# hours and ARRIVAL_BUFFER instances (backpressure), so the waiting instances do not grow with the length of a shift
+ARRIVAL_LOOKAHEAD = float(os.environ.get('HOSPITAL_ARRIVAL_LOOKAHEAD', 2))
+ARRIVAL_BUFFER = int(os.environ.get('HOSPITAL_ARRIVAL_BUFFER', 64))
+# Simulated hours a due arrival waits for its instance to call /patient_init before it is given up, e.g. when the
+# instance could not be created or the engine dropped it
+ARRIVAL_TIMEOUT = float(os.environ.get('HOSPITAL_ARRIVAL_TIMEOUT', 1))
+
+# Arrival times of the created instances waiting for their admission, in time order
+expected_arrivals = deque()
+# Instances that called /patient_init, a heap of
+# (arrival_time, sequence, arrival_time_str, callback_url, patient_id, patient_type, diagnosis)
+initialized_patients = []
+init_sequence = itertools.count()
+patient_initialized = gevent.event.Event()
+
+
+# Events waking up the queue workers when a patient is enqueued or a resource unit is released
+queue_events = {
+    'Queue_ER': gevent.event.Event(),
+    'Queue_Surgery': gevent.event.Event(),
+    'Queue_Nursing_A': gevent.event.Event(),
+    'Queue_Nursing_B': gevent.event.Event(),
+}
+queue_of_resource = {'ER': 'Queue_ER', 'Surgery': 'Queue_Surgery', 'Bed_A': 'Queue_Nursing_A', 'Bed_B': 'Queue_Nursing_B'}
+
+
+def wake_queue_worker(name):
+    """
+    Wake up the worker of the queue that is affected by a change of the given queue or resource.
+    """
+    event = queue_events.get(queue_of_resource.get(name, name))
+    if event is not None:
+        event.set()
 
-# Counters for tracking spawned instances and deciding time to start simulation
-patients_count_non_working_hour = 0
-patients_added_non_working_hour = 0
-patients_count_working_hour = 0
-patients_added_working_hour = 0
 
-# Events to signal when the instances queues are ready
-patient_queue_ready_event_working_hour = threading.Event()
-patient_queue_ready_event_non_working_hour = threading.Event()
+def wait_for_work(queue_type):
+    """
+    Block the queue worker until a patient is enqueued or a resource unit is released.
+    """
+    event = queue_events[queue_type]
+    event.wait()
+    event.clear()
 
 
-# Function to signal when the instances queues are ready
-def set_patient_queue_ready_non_working_hour():
-    patient_queue_ready_event_non_working_hour.set()
+db.subscribe(wake_queue_worker)
 
+# Units of every resource in the current shift, reduced outside the working hours
+shift_capacities = dict(db.RESOURCE_CAPACITIES)
+resource_of_queue = {queue_type: resource for resource, queue_type in queue_of_resource.items()}
 
-def set_patient_queue_ready_working_hour():
-    patient_queue_ready_event_working_hour.set()
+
+def observe_state(name):
+    """
+    Feed the busy units of a resource or the length of a queue to the metrics whenever it changes.
+    """
+    now = clock()
+    if name in shift_capacities:
+        capacity = shift_capacities[name]
+        metrics.observe_resource(name, now, capacity - db.get_resource(name), capacity)
+    elif name == 'Queue_ER':
+        metrics.observe_queue('ER', now, db.get_queue_length_er())
+    elif name in resource_of_queue:
+        metrics.observe_queue(resource_of_queue[name], now, db.get_queue_length(name))
+
+
+db.subscribe(observe_state)
+
+
+def log_event(cid, activity, department='', diagnosis='', value=float('nan'), patient_type=None):
+    if event_log is not None:
+        event_log.log(clock(), cid, activity, department, patient_type or patient_types.get(cid, 'Planned'),
+                      diagnosis, value)
+
+
+def start_treatment(resource, patient_id, diagnosis, duration, waiting_duration=None):
+    """
+    Record the start of a treatment, waiting_duration is given for patients taken from a queue.
+    """
+    if waiting_duration is not None:
+        log_event(patient_id, 'queue leave', resource, diagnosis, waiting_duration)
+    metrics.observe_wait(resource, waiting_duration or 0.0)
+    metrics.observe_service(resource, duration)
+    log_event(patient_id, 'service start', resource, diagnosis, duration)
+
+
+def finish_treatment(resource, patient_id, diagnosis):
+    """
+    Release the unit of the resource occupied by the patient.
+    """
+    db.release(resource)
+    log_event(patient_id, 'service end', resource, diagnosis)
+
+
+# Wall-clock seconds per simulated hour, lower values run the simulation faster (e.g. with local_cpee.py)
+SECONDS_PER_HOUR = float(os.environ.get('HOSPITAL_SECONDS_PER_HOUR', 1))
+
+
+def clock():
+    """
+    Simulation time in hours, one hour passes per SECONDS_PER_HOUR of wall-clock time.
+    """
+    return time.monotonic() / SECONDS_PER_HOUR
+
+
+def sleep(hours):
+    """
+    Let the given number of simulated hours pass.
+    """
+    gevent.sleep(hours * SECONDS_PER_HOUR)
 
 
 def callback(callback_response, callback_url):
     """
-    Callback the instance.
+    Callback the instance. The request is queued in the outbox and sent in the background.
     """
     headers = {
         'content-type': 'application/json',
         'CPEE-CALLBACK': 'true'
     }
-    requests.put(callback_url, headers=headers, json=callback_response)
+    outbox.put(callback_url, headers=headers, json=callback_response)
 
 
 def callback_http_response():
@@ -115,147 +248,151 @@ def callback_http_response():
 
 def process_queue_er():
     """
-    Process ER Queue: This function continuously monitors and processes the ER queue.
-    It checks if there are any patients in the ER queue and if there are available ER personnel to attend to them.
-    If both conditions are met, it processes the first patient in the queue.
+    Process ER Queue: This function processes the ER queue whenever a patient is enqueued or ER personnel is released.
+    As long as there are patients in the ER queue and available ER personnel, it starts the treatment of the
+    first patient in the queue, so up to the number of ER personnel are treated in parallel.
     """
     while True:
-        # Get the current ER queue and the count of available ER personnel
-        queue_er = db.get_queue_er()
-        er_count = db.get_resource('ER')
-
-        # Check if there are patients in the queue and available ER personnel
-        if len(queue_er) > 0 and er_count > 0:
-            # Use the semaphore to control access to the ER resource
-            with er_semaphore:
-                # Occupy 1 ER personnel for the first patient in the queue
-                db.update_resource('ER', er_count - 1)
-                patient_id, callback_url, waiting_duration = db.get_queue_er()[0]
-                update_resource(patient_id, new_wait=False)
-                # Remove the patient from the queue after treatment
-                db.delete_from_queue_er(callback_url)
-
+        # Use the semaphore so only one worker takes the next patient and the ER personnel at a time
+        with er_semaphore:
+            # Check if there are patients in the queue and occupy 1 ER personnel if one is available
+            if db.get_queue_length_er() > 0 and db.try_acquire('ER'):
+                # Remove the first patient from the queue
+                patient_id, callback_url, enqueued_at = db.pop_from_queue_er()
+                observe_state('Queue_ER')
+                waiting_duration = clock() - enqueued_at
                 # Simulate the duration of ER treatment using a normal distribution
-                duration = max(0, random.normal(loc=2, scale=1 / 2, size=None))
-                gevent.sleep(duration)
-
-                # add the duration to the waiting time of instances in the queue
-                queue = db.get_queue_er()
-                for instance in queue:
-                    callback_url, waiting_time = instance
-                    db.update_queue_er(callback_url, waiting_time + duration)
+                duration = diagnosis_helper.er_treatment_time()
+                diagnosis = diagnosis_helper.assign_diagnosis('ER')
+                start_treatment('ER', patient_id, diagnosis, duration, waiting_duration)
+                update_resource(patient_id, new_wait=False, new_diagnosis=diagnosis, new_duration=duration)
+                gevent.spawn(treat_er_patient, patient_id, callback_url, waiting_duration, duration, diagnosis)
+                continue
+        wait_for_work('Queue_ER')
 
-                # Release the occupied ER personnel after treatment
-                db.update_resource('ER', db.get_resource('ER') + 1)
 
-                callback_response = {'status': 'ER Treatment finished', 'duration': round(waiting_duration+duration, 2)}
+def treat_er_patient(patient_id, callback_url, waiting_duration, duration, diagnosis):
+    """
+    ER treatment of a patient taken from the ER queue.
+    """
+    sleep(duration)
 
-                callback(callback_response, callback_url)
+    # Release the occupied ER personnel after treatment
+    finish_treatment('ER', patient_id, diagnosis)
 
-        gevent.sleep(0.01)
+    callback_response = er_treatment_response(waiting_duration + duration, diagnosis)
+    callback(callback_response, callback_url)
 
 
 def process_queue_surgery():
     """
-    Process Surgery Queue: This function continuously monitors and processes the Surgery queue.
-    It checks if there are any patients in the Surgery queue and if there are available surgery rooms.
-    If both conditions are met, it processes the first patient in the queue.
+    Process Surgery Queue: This function processes the Surgery queue whenever a patient is enqueued or a room is released.
+    As long as there are patients in the Surgery queue and available surgery rooms, it starts the surgery of the
+    first patient in the queue, so every available room operates in parallel.
     """
     while True:
-        queue_surgery = db.get_queue('Queue_Surgery')
-        surgery_room_count = db.get_resource('Surgery')
-        if len(queue_surgery) > 0 and surgery_room_count > 0:
-            with surgery_semaphore:
-                db.update_resource('Surgery', surgery_room_count - 1)
-                patient_id, diagnosis, status, callback_url, waiting_duration = db.get_queue('Queue_Surgery')[0]
-                update_resource(patient_id, new_wait=False)
-                db.delete_from_queue('Queue_Surgery', callback_url)
-
+        with surgery_semaphore:
+            if db.get_queue_length('Queue_Surgery') > 0 and db.try_acquire('Surgery'):
+                patient_id, diagnosis, status, callback_url, enqueued_at = db.pop_from_queue('Queue_Surgery')
+                observe_state('Queue_Surgery')
+                waiting_duration = clock() - enqueued_at
                 duration = diagnosis_helper.diagnosis_operation_time(diagnosis)
-                gevent.sleep(duration)
+                start_treatment('Surgery', patient_id, diagnosis, duration, waiting_duration)
+                update_resource(patient_id, new_wait=False, new_duration=duration)
+                gevent.spawn(operate_patient, patient_id, diagnosis, callback_url, waiting_duration, duration)
+                continue
+        wait_for_work('Queue_Surgery')
 
-                queue = db.get_queue('Queue_Surgery')
-                for instance in queue:
-                    patient_id, diagnosis, status, callback_url, waiting_time = instance
-                    db.update_queue('Queue_Surgery', callback_url, waiting_time + duration)
 
-                db.update_resource('Surgery', db.get_resource('Surgery') + 1)
+def er_treatment_response(duration, diagnosis):
+    """
+    Result of the ER treatment: the diagnosis made during the treatment and whether the patient needs surgery.
+    """
+    return {
+        'status': 'ER Treatment finished',
+        'duration': round(duration, 2),
+        'diagnosis': diagnosis,
+        'require_surgery': surgery_flag(diagnosis)
+    }
 
-                callback_response = {
-                    'status': 'Surgery finished',
-                    'duration': round(waiting_duration + duration, 2)
-                }
 
-                callback(callback_response, callback_url)
-        gevent.sleep(0.01)
+def surgery_flag(diagnosis):
+    """
+    Whether the patient needs surgery, as the 'true'/'false' string the process model compares with.
+    """
+    return 'true' if diagnosis_helper.requires_surgery(diagnosis) else 'false'
 
 
-def process_queue_nursing_a():
+def operate_patient(patient_id, diagnosis, callback_url, waiting_duration, duration):
     """
-    Process Queue for Nursing Bed A: This function continuously monitors and processes the Nursing Bed A queue.
-    It checks if there are any patients in the Nursing Bed A queue and if there are available bed A.
-    If both conditions are met, it processes the first patient in the queue.
+    Surgery of a patient taken from the Surgery queue.
     """
-    while True:
-        queue_nursing_a = db.get_queue('Queue_Nursing_A')
-        bed_a_count = db.get_resource('Bed_A')
-        if len(queue_nursing_a) > 0 and bed_a_count > 0:
-            with bed_a_semaphore:
-                db.update_resource('Bed_A', bed_a_count - 1)
-                patient_id, diagnosis, status, callback_url, waiting_duration = db.get_queue('Queue_Nursing_A')[0]
-                update_resource(patient_id, new_wait=False)
-                db.delete_from_queue('Queue_Nursing_A', callback_url)
+    sleep(duration)
 
-                duration = diagnosis_helper.diagnosis_nursing_time(diagnosis)
-                gevent.sleep(duration)
+    finish_treatment('Surgery', patient_id, diagnosis)
 
-                queue = db.get_queue('Queue_Nursing_A')
-                for instance in queue:
-                    patient_id, diagnosis, status, callback_url, waiting_time = instance
-                    db.update_queue('Queue_Nursing_A', callback_url, waiting_time + duration)
+    callback_response = {
+        'status': 'Surgery finished',
+        'duration': round(waiting_duration + duration, 2)
+    }
+    callback(callback_response, callback_url)
 
-                db.update_resource('Bed_A', db.get_resource('Bed_A') + 1)
 
-                callback_response = {
-                    'status': 'Nursing finished',
-                    'duration': round(waiting_duration+duration, 2)
-                }
-                callback(callback_response, callback_url)
-        gevent.sleep(0.01)
+def process_queue_nursing_a():
+    """
+    Process Queue for Nursing Bed A: This function processes the Nursing Bed A queue whenever a patient is enqueued
+    or a bed A is released.
+    As long as there are patients in the Nursing Bed A queue and available bed A, it starts the nursing of the
+    first patient in the queue, so every available bed A is used in parallel.
+    """
+    while True:
+        with bed_a_semaphore:
+            if db.get_queue_length('Queue_Nursing_A') > 0 and db.try_acquire('Bed_A'):
+                patient_id, diagnosis, status, callback_url, enqueued_at = db.pop_from_queue('Queue_Nursing_A')
+                observe_state('Queue_Nursing_A')
+                waiting_duration = clock() - enqueued_at
+                duration = diagnosis_helper.diagnosis_nursing_time(diagnosis)
+                start_treatment('Bed_A', patient_id, diagnosis, duration, waiting_duration)
+                update_resource(patient_id, new_wait=False, new_duration=duration)
+                gevent.spawn(nurse_patient, 'Bed_A', patient_id, diagnosis, callback_url, waiting_duration, duration)
+                continue
+        wait_for_work('Queue_Nursing_A')
 
 
 def process_queue_nursing_b():
     """
-    Process Queue for Nursing Bed B: This function continuously monitors and processes the Nursing Bed B queue.
-    It checks if there are any patients in the Nursing Bed B queue and if there are available bed B.
-    If both conditions are met, it processes the first patient in the queue.
+    Process Queue for Nursing Bed B: This function processes the Nursing Bed B queue whenever a patient is enqueued
+    or a bed B is released.
+    As long as there are patients in the Nursing Bed B queue and available bed B, it starts the nursing of the
+    first patient in the queue, so every available bed B is used in parallel.
     """
     while True:
-        queue_nursing_b = db.get_queue('Queue_Nursing_B')
-        bed_b_count = db.get_resource('Bed_B')
-        if len(queue_nursing_b) > 0 and bed_b_count > 0:
-            with bed_b_semaphore:
-                db.update_resource('Bed_B', bed_b_count - 1)
-                patient_id, diagnosis, status, callback_url, waiting_duration = db.get_queue('Queue_Nursing_B')[0]
-                update_resource(patient_id, new_wait=False)
-                db.delete_from_queue('Queue_Nursing_B', callback_url)
-
+        with bed_b_semaphore:
+            if db.get_queue_length('Queue_Nursing_B') > 0 and db.try_acquire('Bed_B'):
+                patient_id, diagnosis, status, callback_url, enqueued_at = db.pop_from_queue('Queue_Nursing_B')
+                observe_state('Queue_Nursing_B')
+                waiting_duration = clock() - enqueued_at
                 duration = diagnosis_helper.diagnosis_nursing_time(diagnosis)
-                gevent.sleep(duration)
+                start_treatment('Bed_B', patient_id, diagnosis, duration, waiting_duration)
+                update_resource(patient_id, new_wait=False, new_duration=duration)
+                gevent.spawn(nurse_patient, 'Bed_B', patient_id, diagnosis, callback_url, waiting_duration, duration)
+                continue
+        wait_for_work('Queue_Nursing_B')
 
-                queue = db.get_queue('Queue_Nursing_B')
-                for instance in queue:
-                    patient_id, diagnosis, status, callback_url, waiting_time = instance
-                    db.update_queue('Queue_Nursing_B', callback_url, waiting_time + duration)
 
-                db.update_resource('Bed_B', db.get_resource('Bed_B') + 1)
+def nurse_patient(bed, patient_id, diagnosis, callback_url, waiting_duration, duration):
+    """
+    Nursing of a patient taken from a nursing queue.
+    """
+    sleep(duration)
 
-                callback_response = {
-                    'status': 'Nursing finished',
-                    'duration': round(waiting_duration+duration, 2)
-                }
-                callback(callback_response, callback_url)
-        gevent.sleep(0.01)
+    finish_treatment(bed, patient_id, diagnosis)
+
+    callback_response = {
+        'status': 'Nursing finished',
+        'duration': round(waiting_duration + duration, 2)
+    }
+    callback(callback_response, callback_url)
 
 
 # start of the process
@@ -263,32 +400,18 @@ def process_queue_nursing_b():
 def patient_init():
     """
     Initialize the patient instance, waiting for callback while patient arrives.
-    This endpoint handles the initialization of patient instances, placing them in the appropriate queue based on their arrival time.
+    This endpoint handles the initialization of patient instances, which wait for their admission ordered by arrival time.
     """
-    global patients_added_non_working_hour
-    global patients_added_working_hour
     patient_id = request.forms.get('patientID')
     patient_type = request.forms.get('patientType')
     arrival_time_str = request.forms.get('arrival_time')
     callback_url = request.headers['CPEE-CALLBACK']
     diagnosis = request.forms.get('diagnosis')
 
-    if is_not_working_hour(datetime.datetime.fromisoformat(arrival_time_str)):
-        # Add the patient to the non-working hour queue
-        patient_queue_non_working_hour.put((arrival_time_str, callback_url, patient_id, patient_type, diagnosis))
-        patients_added_non_working_hour += 1
-    else:
-        # Add the patient to the working hour queue
-        patient_queue_working_hour.put((arrival_time_str, callback_url, patient_id, patient_type, diagnosis))
-        patients_added_working_hour += 1
-
-    # Check if all non-working hour patients have been added
-    if patients_added_non_working_hour == patients_count_non_working_hour and patients_added_non_working_hour != 0 and patients_added_non_working_hour != 0:
-        set_patient_queue_ready_non_working_hour()
-
-    # Check if all working hour patients have been added
-    if patients_added_working_hour == patients_count_working_hour and patients_added_working_hour != 0 and patients_count_working_hour != 0:
-        set_patient_queue_ready_working_hour()
+    # The simulation admits the patient at the arrival time
+    heapq.heappush(initialized_patients, (datetime.datetime.fromisoformat(arrival_time_str), next(init_sequence),
+                                          arrival_time_str, callback_url, patient_id, patient_type, diagnosis))
+    patient_initialized.set()
     return callback_http_response()
 
 
@@ -298,33 +421,32 @@ def patient_admission(callback_url, patient_id, patient_type, arrival_time_str,
     This function handles the admission process for a patient based on their type and available resources.
     """
     
-    if patient_type == "ER":
-        # Directly admit the patient if they are an ER patient
-        status = 'patient admitted'
-        if not patient_id:
-            patient_id = str(uuid.uuid4())
-    elif not patient_id:
-        # Send the patient home if no patient ID is provided
-        status = 'sent home'
-        patient_id = str(uuid.uuid4())
+    if patient_type == "ER" or not patient_id:
+        intake_reserved = waiting_in_queue = 0
     else:
-        # Get the count of available intake personnel
-        intake_personnel_count = db.get_resource('Intake')
         # Calculate the number of patients finished Intake but not proceeded to next step yet.
         waiting_in_queue = db.get_count_queue('Queue_Surgery', 'Intake finished') \
                            + db.get_count_queue('Queue_Nursing_A', 'Intake finished') \
                            + db.get_count_queue('Queue_Nursing_B', 'Intake finished')
-
-        # no intake resources available or more than 2 patients finished intake but not processed with next step yet.
-        if intake_personnel_count <= 0 or waiting_in_queue > 2:
-            status = 'sent home'
-        else:
-            # Admit the patient and reserve 1 intake personnel
-            db.update_resource('Intake', intake_personnel_count - 1)
-            status = 'patient admitted'
-    
-    if status == 'patient admitted':
+        # Reserve 1 intake personnel in one step if the patient can be admitted, so no two admissions get the last one
+        intake_reserved = int(waiting_in_queue <= MAX_PENDING_PATIENTS and db.try_acquire('Intake'))
+
+    # ER patients are admitted directly, patients without ID are sent home,
+    # others depend on intake resources and patients waiting after intake
+    status = admission_status(patient_type, patient_id, intake_reserved, waiting_in_queue)
+    metrics.count(status)
+    if not patient_id:
+        patient_id = str(uuid.uuid4())
+    log_event(patient_id, 'arrival', diagnosis=diagnosis, patient_type=patient_type)
+    log_event(patient_id, status, diagnosis=diagnosis, patient_type=patient_type)
+    if status == 'sent home':
+        # A planned patient sent home again gives up the slot, /replan reserves a new one
+        resources.timeline.cancel_reservation(patient_id)
+        forget_patient(patient_id)
+    else:
         print(callback_url)
+        admitted_at[patient_id] = clock()
+        patient_types[patient_id] = patient_type
         add_resources(patient_id, 'Patient Adimission', datetime.datetime.fromisoformat(arrival_time_str), diagnosis, False)
     callback_response = {'patient_id': patient_id, 'status': status, 'arrival_time': arrival_time_str}
     callback(callback_response, callback_url)
@@ -337,18 +459,19 @@ def intake():
     """
     try:
         patient_id = request.forms.get('patientID')
-
-        update_resource(patient_id, new_task='Intake')
+        diagnosis = request.forms.get('diagnosis')
 
         # Simulate the duration of the intake process using a normal distribution
-        duration = max(0, random.normal(loc=1, scale=1 / 8, size=None))
-        gevent.sleep(duration)
+        duration = diagnosis_helper.intake_time()
+        start_treatment('Intake', patient_id, diagnosis, duration)
+        update_resource(patient_id, new_task='Intake', new_duration=duration)
+        sleep(duration)
 
         # Release the occupied intake resource
-        db.update_resource('Intake', db.get_resource('Intake') + 1)
+        finish_treatment('Intake', patient_id, diagnosis)
 
         response.content_type = 'application/json'
-        data = {'status': 'Intake finished', 'duration': round(duration, 2)}
+        data = {'status': 'Intake finished', 'duration': round(duration, 2), 'require_surgery': surgery_flag(diagnosis)}
         return json.dumps(data)
 
     except Exception as e:
@@ -364,25 +487,26 @@ def handle_er_resource():
     try:
         callback_url = request.headers['CPEE-CALLBACK']
         patient_id = request.forms.get('patientID')
-        er_personnel_count = db.get_resource('ER')
-
-        # Check if there are already patients in the ER queue or if no ER personnel are available
-        if len(db.get_queue_er()) > 0 or er_personnel_count <= 0:
+        # Check if there are already patients in the ER queue, otherwise occupy 1 ER personnel if one is available
+        if db.get_queue_length_er() > 0 or not db.try_acquire('ER'):
             # Add the patient to the ER queue if the ER is busy or no personnel are available
             update_resource(patient_id, new_task='ER Treatment', new_wait=True)
-            db.add_to_queue_er(patient_id, callback_url)
+            db.add_to_queue_er(patient_id, callback_url, clock())
+            log_event(patient_id, 'queue enter', 'ER')
             print('ER is busy, Patient ', patient_id, ' is added to ER queue')
             return callback_http_response()
 
         else:
-            update_resource(patient_id, new_task='ER Treatment', new_wait=False)
-            db.update_resource('ER', er_personnel_count - 1)
-            duration = max(0, random.normal(loc=2, scale=1 / 2, size=None))
+            duration = diagnosis_helper.er_treatment_time()
+            diagnosis = diagnosis_helper.assign_diagnosis('ER')
+            start_treatment('ER', patient_id, diagnosis, duration)
+            update_resource(patient_id, new_task='ER Treatment', new_wait=False, new_diagnosis=diagnosis,
+                            new_duration=duration)
 
-            gevent.sleep(duration)
-            db.update_resource('ER', db.get_resource('ER') + 1)
+            sleep(duration)
+            finish_treatment('ER', patient_id, diagnosis)
 
-            data = {'status': 'ER Treatment finished', 'duration': round(duration, 2)}
+            data = er_treatment_response(duration, diagnosis)
             response.content_type = 'application/json'
             return json.dumps(data)
 
@@ -403,20 +527,22 @@ def surgery():
     duration = request.forms.get('duration')
 
 
-    surgery_room_count = db.get_resource('Surgery')
-    # Check if there are already patients in the Surgery queue or if no Surgery room are available
-    if len(db.get_queue('Queue_Surgery')) > 0 or surgery_room_count <= 0:
+    # Check if there are already patients in the Surgery queue, otherwise occupy a Surgery room if one is available
+    if db.get_queue_length('Queue_Surgery') > 0 or not db.try_acquire('Surgery'):
         # Add the patient to the Surgery queue if it is busy
         update_resource(patient_id, new_start=duration, new_task='Surgery', new_wait=True, new_diagnosis=diagnosis)
-        db.add_to_queue('Queue_Surgery', patient_id, diagnosis, status, callback_url)
+        db.add_to_queue('Queue_Surgery', patient_id, diagnosis, status, callback_url, clock())
+        log_event(patient_id, 'queue enter', 'Surgery', diagnosis)
         print('Surgery room not available, patient ', patient_id, ' is added to surgery queue')
         return callback_http_response()
     else:
-        update_resource(patient_id, new_start=duration, new_task='Surgery', new_wait=False, new_diagnosis=diagnosis)
-        db.update_resource('Surgery', surgery_room_count - 1)
-        duration = diagnosis_helper.diagnosis_operation_time(diagnosis)
-        gevent.sleep(duration)
-        db.update_resource('Surgery', db.get_resource('Surgery') + 1)
+        operation_duration = diagnosis_helper.diagnosis_operation_time(diagnosis)
+        start_treatment('Surgery', patient_id, diagnosis, operation_duration)
+        update_resource(patient_id, new_start=duration, new_task='Surgery', new_wait=False, new_diagnosis=diagnosis,
+                        new_duration=operation_duration)
+        duration = operation_duration
+        sleep(duration)
+        finish_treatment('Surgery', patient_id, diagnosis)
 
         data = {'status': 'Surgery finished', 'duration': round(duration, 2)}
         response.content_type = 'application/json'
@@ -436,37 +562,41 @@ def nursing():
 
 
     if diagnosis.startswith('A'):
-        Bed_A_count = db.get_resource('Bed_A')
-        # Check if there are already patients in the nursing bed A queue or if no bed A are available
-        if len(db.get_queue('Queue_Nursing_A')) > 0 or Bed_A_count <= 0:
+        # Check if there are already patients in the nursing bed A queue, otherwise occupy a bed A if one is available
+        if db.get_queue_length('Queue_Nursing_A') > 0 or not db.try_acquire('Bed_A'):
             # Add the patient to the nursing bed A queue if it is busy
             update_resource(patient_id, new_start=duration, new_task='Nursing', new_wait=True, new_diagnosis=diagnosis)
-            db.add_to_queue('Queue_Nursing_A', patient_id, diagnosis, status, callback_url)
+            db.add_to_queue('Queue_Nursing_A', patient_id, diagnosis, status, callback_url, clock())
+            log_event(patient_id, 'queue enter', 'Bed_A', diagnosis)
             return callback_http_response()
         else:
-            update_resource(patient_id, new_start=duration, new_task='Nursing', new_wait=False, new_diagnosis=diagnosis)
-            db.update_resource('Bed_A', Bed_A_count - 1)
-            duration = diagnosis_helper.diagnosis_nursing_time(diagnosis)
-            gevent.sleep(duration)
-            db.update_resource('Bed_A', db.get_resource('Bed_A') + 1)
+            nursing_duration = diagnosis_helper.diagnosis_nursing_time(diagnosis)
+            start_treatment('Bed_A', patient_id, diagnosis, nursing_duration)
+            update_resource(patient_id, new_start=duration, new_task='Nursing', new_wait=False, new_diagnosis=diagnosis,
+                            new_duration=nursing_duration)
+            duration = nursing_duration
+            sleep(duration)
+            finish_treatment('Bed_A', patient_id, diagnosis)
 
             data = {'status': 'Nursing finished', 'duration': round(duration, 2)}
             response.content_type = 'application/json'
             return json.dumps(data)
     else:
-        Bed_B_count = db.get_resource('Bed_B')
-        # Check if there are already patients in the nursing bed B queue or if no bed B are available
-        if len(db.get_queue('Queue_Nursing_B')) > 0 or Bed_B_count <= 0:
+        # Check if there are already patients in the nursing bed B queue, otherwise occupy a bed B if one is available
+        if db.get_queue_length('Queue_Nursing_B') > 0 or not db.try_acquire('Bed_B'):
             # Add the patient to the nursing bed B queue if it is busy
             update_resource(patient_id, new_start=duration, new_task='Nursing', new_wait=True, new_diagnosis=diagnosis)
-            db.add_to_queue('Queue_Nursing_B', patient_id, diagnosis, status, callback_url)
+            db.add_to_queue('Queue_Nursing_B', patient_id, diagnosis, status, callback_url, clock())
+            log_event(patient_id, 'queue enter', 'Bed_B', diagnosis)
             return callback_http_response()
         else:
-            update_resource(patient_id, new_start=duration, new_task='Nursing', new_wait=False, new_diagnosis=diagnosis)
-            db.update_resource('Bed_B', Bed_B_count - 1)
-            duration = diagnosis_helper.diagnosis_nursing_time(diagnosis)
-            gevent.sleep(duration)
-            db.update_resource('Bed_B', db.get_resource('Bed_B') + 1)
+            nursing_duration = diagnosis_helper.diagnosis_nursing_time(diagnosis)
+            start_treatment('Bed_B', patient_id, diagnosis, nursing_duration)
+            update_resource(patient_id, new_start=duration, new_task='Nursing', new_wait=False, new_diagnosis=diagnosis,
+                            new_duration=nursing_duration)
+            duration = nursing_duration
+            sleep(duration)
+            finish_treatment('Bed_B', patient_id, diagnosis)
 
             data = {'status': 'Nursing finished', 'duration': round(duration, 2)}
             response.content_type = 'application/json'
@@ -487,162 +617,167 @@ def releasing():
 @app.post('/replan')
 def replan():
     """
-    Task "Releasing"
+    Task "Replan": the patient is planned with the other patients sent home within the replan window.
     """
-
     patient_type = request.forms.get('patientType')
     patient_id = request.forms.get('patientID')
     diagnosis = request.forms.get('diagnosis')
     arrival_time = request.forms.get('arrival_time')
-    
-    plan_result = planner(patient_id, arrival_time, {'diagnosis': diagnosis}, resources)
-    
-    if plan_result:
-        reschedule_time = plan_result['reschedule_time']
-    else:
-        # Handle the case where no reschedule time is found (optional)
-        print("No reschedule time within 7 days found")
-        reschedule_time = arrival_time
 
-    print (
-        f"replanned: Patient ID: {patient_id}, diagnosis: {diagnosis}, arrival_time: {reschedule_time}")
+    replan_requests.append((patient_id, arrival_time, {'diagnosis': diagnosis}, patient_type))
+    replan_requested.set()
 
-    
-
-# end of the process
 
+@app.post('/replan_batch')
+def replan_batch():
+    """
+    Plan a list of sent-home patients jointly, {"patients": [{"patientID", "arrival_time", "diagnosis"}, ...]},
+    and return their reschedule times (null if no slot within 7 days is feasible).
+    """
+    patients = [(patient['patientID'], patient['arrival_time'], {'diagnosis': patient.get('diagnosis')})
+                for patient in request.json['patients']]
+    plans = plan_batch(patients, resources)
+    response.content_type = 'application/json'
+    return json.dumps([{'patientID': cid, 'reschedule_time': plan and plan['reschedule_time']}
+                       for (cid, _, _), plan in zip(patients, plans)])
 
-# simulation
-def process_patient_queue_non_working_hour():
-    """
-    Spawned patient instances arrive during non-working hours, start the process.
-    This function processes the queue of patient instances that arrive during non-working hours.
-    """
-    previous_time = None
-    while not patient_queue_non_working_hour.empty():
-        # Get the next patient instance from the queue
-        arrival_time_str, callback_url, patient_id, patient_type, diagnosis = patient_queue_non_working_hour.get()
-        arrival_time = datetime.datetime.fromisoformat(arrival_time_str)
-        # If not the first instance
-        if previous_time is not None:
-            time_difference = round((arrival_time - previous_time).total_seconds() / 3600, 2)
-            # Sleep for the time difference to simulate the actual arrival time of patients
-            time.sleep(time_difference)
-        previous_time = arrival_time
-        patient_admission(callback_url, patient_id, patient_type, arrival_time_str, diagnosis)
-
-
-def process_patient_queue_working_hour():
-    """
-    Spawned patient instances arrive during working hours, start the process.
-    This function processes the queue of patient instances that arrive during working hours.
-    """
-    previous_time = None
-    while not patient_queue_working_hour.empty():
-        arrival_time_str, callback_url, patient_id, patient_type, diagnosis = patient_queue_working_hour.get()
-        arrival_time = datetime.datetime.fromisoformat(arrival_time_str)
-        # If there was a previous patient, calculate the time difference between arrivals
-        if previous_time is not None:
-            time_difference = round((arrival_time - previous_time).total_seconds() / 3600, 2)
-            # Simulate real-time by sleeping for the time difference
-            time.sleep(time_difference)
-        previous_time = arrival_time
-        patient_admission(callback_url, patient_id, patient_type, arrival_time_str, diagnosis)
-
-
-def spawn_instances_non_working_hour():
-    """
-    Spawn patient instances for non-working hours.
-    This function schedules the arrival of patient instances during non-working hours.
-    """
-    global patients_count_non_working_hour
-    # start time is 00:00 01.01.2018
-    current_time = start_time
-    while current_time < end_time:
-        # Wait until patient instances in the last round processed and cleared
-        while patients_count_non_working_hour == 0 and patients_added_non_working_hour == 0:
-            if is_not_working_hour(current_time):
-                next_timestamp = next_working_hour(current_time)
-                # only ER patients arrived during non_working hours
-                patients_count_non_working_hour += simulate_er_patients(current_time, next_timestamp)
-                current_time = next_timestamp
-
-            else:  # is working hour
-                next_timestamp = next_non_working_hour(current_time)
-                current_time = next_timestamp
-        time.sleep(1)
-
-
-def spawn_instances_working_hour():
-    """
-    Spawn patient instances for working hours.
-    This function schedules the arrival of patient instances during working hours.
-    """
-    global patients_count_working_hour
-    current_time = start_time
-    while current_time < end_time:
-        # Wait until patient instances in the last round processed and cleared
-        while patients_count_working_hour == 0 and patients_added_working_hour == 0:
-            if is_not_working_hour(current_time):
-                current_time = next_working_hour(current_time)
 
+def process_replan_queue():
+    """
+    Collect the /replan requests of a window of REPLAN_WINDOW hours and plan them together,
+    so a burst of sent-home patients is spread over the free slots.
+    """
+    while True:
+        replan_requested.wait()
+        sleep(REPLAN_WINDOW)
+        replan_requested.clear()
+        requests = replan_requests[:]
+        del replan_requests[:]
+        plans = plan_batch([(cid, time, info) for cid, time, info, _ in requests], resources)
+        for (patient_id, arrival_time, info, patient_type), plan_result in zip(requests, plans):
+            metrics.count('replanned' if plan_result else 'replan failed')
+            log_event(patient_id, 'replanned' if plan_result else 'replan failed', diagnosis=info['diagnosis'],
+                      patient_type=patient_type)
+            if plan_result:
+                reschedule_time = plan_result['reschedule_time']
             else:
-                next_timestamp = next_non_working_hour(current_time)
-                # type A, type B, ER patients arrive during working hours
-                with ThreadPoolExecutor() as executor:
-                    future_a = executor.submit(simulate_planned_patients_a, current_time, next_timestamp)
-                    future_b = executor.submit(simulate_planned_patients_b, current_time, next_timestamp)
-                    future_er = executor.submit(simulate_er_patients, current_time, next_timestamp)
+                print("No reschedule time within 7 days found")
+                reschedule_time = arrival_time
+            print(f"replanned: Patient ID: {patient_id}, diagnosis: {info['diagnosis']}, arrival_time: {reschedule_time}")
 
-                    planned_a_count = future_a.result()
-                    planned_b_count = future_b.result()
-                    er_count = future_er.result()
 
-                patients_count_working_hour += planned_a_count + planned_b_count + er_count
-                current_time = next_timestamp
-        time.sleep(1)
+# end of the process
 
 
-def simulation():
+@app.get('/metrics')
+def get_metrics():
     """
-    Simulate from 00:00 01.01.2018
+    Streaming KPIs of the run: counters, waiting and service times, queue lengths and utilization per department.
     """
-    global patients_count_non_working_hour
-    global patients_added_non_working_hour
-    global patients_count_working_hour
-    global patients_added_working_hour
-    while True:
-        # Non-working hours
-        # Wait for the patient queue to be ready for non-working hours
-        patient_queue_ready_event_non_working_hour.wait()
-        # Update the Surgery resource to reflect non-working hour availability (1 Surgery room available)
-        db.update_resource('Surgery', db.get_resource('Surgery') - 4)
-        print('non-working hour started, surgery room up to 1 available, currently available:', db.get_resource('Surgery'))
-        process_patient_queue_non_working_hour()
-        patients_count_non_working_hour = 0
-        patients_added_non_working_hour = 0
-        patient_queue_ready_event_non_working_hour.clear()  # Clear the event to reset to not ready state
-
-        # Working hours
-        # Wait for the patient queue to be ready for working hours
-        patient_queue_ready_event_working_hour.wait()
-        # Update the Surgery resource to reflect non-working hour availability (5 Surgery rooms available)
-        db.update_resource('Surgery', db.get_resource('Surgery') + 4)
-        print('working hour started, surgery room up to 5 available, currently available:', db.get_resource('Surgery'))
-        process_patient_queue_working_hour()
-        patients_count_working_hour = 0
-        patients_added_working_hour = 0
-        patient_queue_ready_event_working_hour.clear()
+    response.content_type = 'application/json'
+    return json.dumps(metrics.snapshot(clock()))
+
+
+# simulation
+def switch_shift_capacities(moment):
+    """
+    Set every resource to its capacity in the shift starting at the given time (capacity calendar),
+    adding or withdrawing the units that differ from the previous shift.
+    """
+    for resource, capacity in calendar_for(moment, moment).capacities_at(moment).items():
+        difference = capacity - shift_capacities[resource]
+        if not difference:
+            continue
+        shift_capacities[resource] = capacity
+        # withdrawn units may still be busy, the count then stays below zero until they are released
+        db.release(resource, difference)
+        print('shift started at', moment.isoformat(), resource, 'up to', capacity, 'available, currently available:',
+              db.get_resource(resource))
+
+
+def admit_next_patient():
+    """
+    Admit the initialized patient with the earliest arrival time.
+    """
+    arrival_time, _, arrival_time_str, callback_url, patient_id, patient_type, diagnosis = \
+        heapq.heappop(initialized_patients)
+    # instances of given up arrivals and of an earlier run are no longer expected
+    if expected_arrivals and arrival_time == expected_arrivals[0]:
+        expected_arrivals.popleft()
+    patient_admission(callback_url, patient_id, patient_type, arrival_time_str, diagnosis)
+
+
+def simulation(start=start_time, end=end_time):
+    """
+    Simulate from start (00:00 01.01.2018) until end, starting at the current clock time.
+    Handles three kinds of events in time order until every arrival is admitted or given up:
+    - the shift transitions of the capacity calendar switch the capacities,
+    - the instance of the next arrival is created ARRIVAL_LOOKAHEAD hours ahead while fewer than ARRIVAL_BUFFER
+      instances wait for their admission,
+    - the next arrival is admitted at its arrival time once its instance has called /patient_init, or given up
+      if its instance has not called within ARRIVAL_TIMEOUT hours after the arrival time.
+    """
+    # clock time of the start, at() maps a datetime of the simulated period to the clock
+    origin = clock()
+
+    def at(moment):
+        return origin + (moment - start).total_seconds() / 3600
+
+    if event_log is not None and not event_log.events:
+        event_log.anchor(origin, start)
+    calendar = calendar_for(start, end)
+    arrivals = arrival_stream(start, end, generator=streams.generator('arrivals'), calendar=calendar)
+    shifts = calendar.shifts(start, end)
+    next_arrival = next(arrivals, None)
+    next_shift = next(shifts, None)
+    while next_arrival is not None or next_shift is not None or expected_arrivals:
+        shift_at = at(next_shift[0]) if next_shift is not None else math.inf
+        create_at = math.inf
+        if next_arrival is not None and len(expected_arrivals) < ARRIVAL_BUFFER:
+            create_at = at(next_arrival[0]) - ARRIVAL_LOOKAHEAD
+        admit_at = at(expected_arrivals[0]) if expected_arrivals else math.inf
+        now = clock()
+        if shift_at <= now:
+            switch_shift_capacities(next_shift[0])
+            next_shift = next(shifts, None)
+        elif create_at <= now:
+            arrival_time, patient_type, patient_id, diagnosis = next_arrival
+            expected_arrivals.append(arrival_time)
+            create_patient_instance(patient_type, patient_id, diagnosis, arrival_time.isoformat())
+            next_arrival = next(arrivals, None)
+        elif initialized_patients and (not expected_arrivals or initialized_patients[0][0] < expected_arrivals[0]):
+            # the instance of an arrival that was given up (or of an earlier run) called late, admit it right away
+            admit_next_patient()
+        elif admit_at <= now and initialized_patients and initialized_patients[0][0] == expected_arrivals[0]:
+            # A late admission (slow instance or overloaded simulator) shifts the rest of the schedule by its delay,
+            # so the time between two arrivals is kept instead of admitting the following ones in a burst
+            origin += now - admit_at
+            admit_next_patient()
+        elif admit_at + ARRIVAL_TIMEOUT <= now:
+            # The instance never called /patient_init, the following arrivals must not wait for it
+            arrival_time = expected_arrivals.popleft()
+            metrics.count('arrival lost')
+            print('no instance for the arrival at', arrival_time.isoformat(), 'after', ARRIVAL_TIMEOUT, 'hours')
+            origin += now - admit_at
+        else:
+            # Wait for the next event, a due admission waits up to ARRIVAL_TIMEOUT for its instance to call
+            wake_at = min(shift_at, create_at, admit_at if admit_at > now else admit_at + ARRIVAL_TIMEOUT)
+            patient_initialized.clear()
+            patient_initialized.wait(None if wake_at == math.inf else (wake_at - now) * SECONDS_PER_HOUR)
 
 
 if __name__ == '__main__':
+    # Keep resources and queues in memory by default, HOSPITAL_DB_SNAPSHOT enables a write-behind copy on disk
+    db.configure(snapshot_path=os.environ.get('HOSPITAL_DB_SNAPSHOT'))
+    if EVENT_LOG_PATH:
+        event_log = EventLog(EVENT_LOG_PATH, start_time, epoch=clock())
+
     gevent.spawn(process_queue_surgery)
     gevent.spawn(process_queue_nursing_a)
     gevent.spawn(process_queue_nursing_b)
     gevent.spawn(process_queue_er)
+    gevent.spawn(process_replan_queue)
 
-    gevent.spawn(spawn_instances_non_working_hour)
-    gevent.spawn(spawn_instances_working_hour)
     gevent.spawn(simulation)
 
     try:
@@ -652,4 +787,9 @@ if __name__ == '__main__':
         print(f"Error: {e}")
         if "Address already in use" in str(e):
             print("Address already in use. Please free the port or use a different one.")
+    finally:
+        # Snapshot of the metrics at the end of the run
+        print(json.dumps(metrics.snapshot(clock())))
+        if event_log is not None:
+            event_log.close()
 
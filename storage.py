@@ -0,0 +1,601 @@
+import atexit
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# Initial number of available units per hospital resource
+RESOURCE_CAPACITIES = {'Intake': 4, 'Surgery': 5, 'Bed_A': 30, 'Bed_B': 40, 'ER': 9}
+
+# Units available outside the working hours, resources not listed keep their capacity around the clock
+OFF_HOURS_CAPACITIES = {'Surgery': 1}
+
+RESOURCE_NAMES = ('Intake', 'Surgery', 'Bed_A', 'Bed_B', 'ER')
+QUEUE_TABLES = ('Queue_Surgery', 'Queue_Nursing_A', 'Queue_Nursing_B')
+
+# Priority classes of the queues, patients who finished ER treatment are served first
+ER_PRIORITY = 0
+DEFAULT_PRIORITY = 1
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS Resources (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        Intake INTEGER,
+        Surgery INTEGER,
+        Bed_A INTEGER,
+        Bed_B INTEGER,
+        ER INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS Queue_Surgery (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        diagnosis TEXT,
+        status TEXT,
+        callback_url TEXT,
+        enqueued_at REAL,
+        priority INTEGER DEFAULT 1
+    );
+    CREATE TABLE IF NOT EXISTS Queue_Nursing_A (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        diagnosis TEXT,
+        status TEXT,
+        callback_url TEXT,
+        enqueued_at REAL,
+        priority INTEGER DEFAULT 1
+    );
+    CREATE TABLE IF NOT EXISTS Queue_Nursing_B (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        diagnosis TEXT,
+        status TEXT,
+        callback_url TEXT,
+        enqueued_at REAL,
+        priority INTEGER DEFAULT 1
+    );
+    CREATE TABLE IF NOT EXISTS Queue_ER (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        callback_url TEXT,
+        enqueued_at REAL
+    );
+'''
+
+
+# Schema of the durable backend: resource counts by name and one queue table for all departments
+DURABLE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS Resource_Counts (
+        name TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS Queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        department TEXT NOT NULL,
+        priority INTEGER NOT NULL,
+        patient_id TEXT,
+        diagnosis TEXT,
+        status TEXT,
+        callback_url TEXT,
+        enqueued_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS Queue_order ON Queue (department, priority, id);
+    CREATE INDEX IF NOT EXISTS Queue_callback_url ON Queue (department, callback_url);
+    CREATE INDEX IF NOT EXISTS Queue_status ON Queue (department, status, id);
+'''
+
+
+def queue_priority(status):
+    """
+    Priority class of a patient joining a queue with the given status.
+    """
+    return ER_PRIORITY if status == 'ER Treatment finished' else DEFAULT_PRIORITY
+
+
+def migrate(conn):
+    """
+    Create missing tables and add the enqueued_at and priority columns and the priority index to queue tables
+    of older database files.
+    """
+    conn.executescript(SCHEMA)
+    for queue_type in QUEUE_TABLES + ('Queue_ER',):
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({queue_type})")]
+        if 'enqueued_at' not in columns:
+            conn.execute(f"ALTER TABLE {queue_type} ADD COLUMN enqueued_at REAL DEFAULT 0")
+    for queue_type in QUEUE_TABLES:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({queue_type})")]
+        if 'priority' not in columns:
+            conn.execute(f"ALTER TABLE {queue_type} ADD COLUMN priority INTEGER DEFAULT {DEFAULT_PRIORITY}")
+            conn.execute(f"UPDATE {queue_type} SET priority = {ER_PRIORITY} WHERE status = 'ER Treatment finished'")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {queue_type}_priority ON {queue_type} (priority, id)")
+    conn.commit()
+
+
+def check_resource(resource):
+    if resource not in RESOURCE_NAMES:
+        raise ValueError(f"Unknown resource: {resource}")
+
+
+def check_queue(queue_type):
+    if queue_type not in QUEUE_TABLES:
+        raise ValueError(f"Unknown queue: {queue_type}")
+
+
+class SQLiteStore:
+    """
+    Storage backend keeping resources and queues in a SQLite file, one connection per operation.
+    """
+
+    def __init__(self, path='hospital_resources.db'):
+        self.path = path
+        self.migrated = False
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        if not self.migrated:
+            migrate(conn)
+            self.migrated = True
+        return conn
+
+    def close(self):
+        """
+        Nothing to close, every operation opens its own connection.
+        """
+
+    def init_db(self, capacities=None):
+        capacities = dict(RESOURCE_CAPACITIES, **(capacities or {}))
+        conn = self.connect()
+        conn.execute("INSERT INTO Resources (Intake, Surgery, Bed_A, Bed_B, ER) VALUES (?, ?, ?, ?, ?)",
+                     tuple(capacities[name] for name in RESOURCE_NAMES))
+        conn.commit()
+        conn.close()
+
+    def update_resource(self, resource, count):
+        check_resource(resource)
+        conn = self.connect()
+        conn.execute(f"UPDATE Resources SET {resource} = ? WHERE id = 1", (count,))
+        conn.commit()
+        conn.close()
+
+    def get_resource(self, resource):
+        check_resource(resource)
+        conn = self.connect()
+        result = conn.execute(f"SELECT {resource} FROM Resources WHERE id = 1").fetchone()[0]
+        conn.close()
+        return result
+
+    def try_acquire(self, resource, n=1):
+        check_resource(resource)
+        conn = self.connect()
+        acquired = conn.execute(f"UPDATE Resources SET {resource} = {resource} - ? WHERE id = 1 AND {resource} >= ?",
+                                (n, n)).rowcount == 1
+        conn.commit()
+        conn.close()
+        return acquired
+
+    def release(self, resource, n=1):
+        check_resource(resource)
+        conn = self.connect()
+        conn.execute(f"UPDATE Resources SET {resource} = {resource} + ? WHERE id = 1", (n,))
+        conn.commit()
+        conn.close()
+
+    def add_to_queue(self, queue_type, patient_id, diagnosis, status, callback_url, enqueued_at=0):
+        check_queue(queue_type)
+        conn = self.connect()
+        # a patient queued again replaces its entry, as in the other backends
+        conn.execute(f"DELETE FROM {queue_type} WHERE callback_url = ?", (callback_url,))
+        conn.execute(
+            f"INSERT INTO {queue_type} (patient_id, diagnosis, status, callback_url, enqueued_at, priority) "
+            f"VALUES (?, ?, ?, ?, ?, ?)",
+            (patient_id, diagnosis, status, callback_url, enqueued_at, queue_priority(status)))
+        conn.commit()
+        conn.close()
+
+    def get_count_queue(self, queue_type, status):
+        check_queue(queue_type)
+        conn = self.connect()
+        count = conn.execute(f"SELECT COUNT(*) FROM {queue_type} WHERE status = ?", (status,)).fetchone()[0]
+        conn.close()
+        return count
+
+    def get_queue(self, queue_type):
+        check_queue(queue_type)
+        conn = self.connect()
+        queue = conn.execute(f"SELECT patient_id, diagnosis, status, callback_url, enqueued_at FROM {queue_type} "
+                             f"ORDER BY priority, id").fetchall()
+        conn.close()
+        return queue
+
+    def get_queue_length(self, queue_type):
+        check_queue(queue_type)
+        conn = self.connect()
+        count = conn.execute(f"SELECT COUNT(*) FROM {queue_type}").fetchone()[0]
+        conn.close()
+        return count
+
+    def pop_from_queue(self, queue_type):
+        check_queue(queue_type)
+        conn = self.connect()
+        with conn:
+            row = conn.execute(f"SELECT id, patient_id, diagnosis, status, callback_url, enqueued_at FROM {queue_type} "
+                               f"ORDER BY priority, id LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute(f"DELETE FROM {queue_type} WHERE id = ?", (row[0],))
+        conn.close()
+        return row[1:] if row is not None else None
+
+    def delete_from_queue(self, queue_type, callback_url):
+        check_queue(queue_type)
+        conn = self.connect()
+        conn.execute(f"DELETE FROM {queue_type} WHERE callback_url = ?", (callback_url,))
+        conn.commit()
+        conn.close()
+
+    def add_to_queue_er(self, patient_id, callback_url, enqueued_at=0):
+        conn = self.connect()
+        # a patient queued again keeps its place in the ER queue
+        updated = conn.execute("UPDATE Queue_ER SET patient_id = ?, enqueued_at = ? WHERE callback_url = ?",
+                               (patient_id, enqueued_at, callback_url)).rowcount
+        if not updated:
+            conn.execute("INSERT INTO Queue_ER (patient_id, callback_url, enqueued_at) VALUES (?, ?, ?)",
+                         (patient_id, callback_url, enqueued_at))
+        conn.commit()
+        conn.close()
+
+    def delete_from_queue_er(self, callback_url):
+        conn = self.connect()
+        conn.execute("DELETE FROM Queue_ER WHERE callback_url = ?", (callback_url,))
+        conn.commit()
+        conn.close()
+
+    def get_queue_er(self):
+        conn = self.connect()
+        queue = conn.execute("SELECT patient_id, callback_url, enqueued_at FROM Queue_ER ORDER BY id").fetchall()
+        conn.close()
+        return queue
+
+    def get_queue_length_er(self):
+        conn = self.connect()
+        count = conn.execute("SELECT COUNT(*) FROM Queue_ER").fetchone()[0]
+        conn.close()
+        return count
+
+    def pop_from_queue_er(self):
+        conn = self.connect()
+        with conn:
+            row = conn.execute("SELECT id, patient_id, callback_url, enqueued_at FROM Queue_ER ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM Queue_ER WHERE id = ?", (row[0],))
+        conn.close()
+        return row[1:] if row is not None else None
+
+
+class DurableStore:
+    """
+    Storage backend keeping resources and queues in a SQLite file in WAL mode through one long-lived connection.
+    All queues share one table keyed by department with indexes for the queue order, callback_url and status.
+    Mutations are grouped into one transaction that is committed after group_size mutations or commit_interval
+    seconds, whichever comes first (group commit), so at most commit_interval seconds of changes are lost on a crash.
+    """
+
+    def __init__(self, path='hospital_resources.db', group_size=256, commit_interval=0.05, capacities=None):
+        self.path = path
+        self.group_size = group_size
+        self.commit_interval = commit_interval
+        self.lock = threading.RLock()
+        self.pending = 0
+        # autocommit mode, transactions are opened explicitly for the groups of mutations
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, cached_statements=64)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(DURABLE_SCHEMA)
+        # a new file starts with the given (or default) capacities, so the store works without init_db()
+        capacities = dict(RESOURCE_CAPACITIES, **(capacities or {}))
+        self.conn.executemany("INSERT OR IGNORE INTO Resource_Counts (name, count) VALUES (?, ?)",
+                              [(name, capacities[name]) for name in RESOURCE_NAMES])
+        atexit.register(self.close)
+        if commit_interval:
+            threading.Thread(target=self._group_commit, daemon=True).start()
+
+    def _write(self, sql, parameters):
+        with self.lock:
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN")
+            rowcount = self.conn.execute(sql, parameters).rowcount
+            self.pending += 1
+            if self.pending >= self.group_size:
+                self.commit()
+            return rowcount
+
+    # Rows are fetched while holding the lock, as the connection is shared with the group commit and other writers
+    def _read_one(self, sql, parameters=()):
+        with self.lock:
+            return self.conn.execute(sql, parameters).fetchone()
+
+    def _read_all(self, sql, parameters=()):
+        with self.lock:
+            return self.conn.execute(sql, parameters).fetchall()
+
+    def commit(self):
+        """
+        Commit the mutations of the current group.
+        """
+        with self.lock:
+            if self.conn.in_transaction:
+                self.conn.execute("COMMIT")
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.commit()
+                self.conn.close()
+                self.conn = None
+        atexit.unregister(self.close)
+
+    def _group_commit(self):
+        while self.conn is not None:
+            time.sleep(self.commit_interval)
+            if self.pending:
+                with self.lock:
+                    if self.conn is not None:
+                        self.commit()
+
+    def init_db(self, capacities=None):
+        """
+        Store the initial capacities, counts kept in an existing file are not overwritten.
+        """
+        capacities = dict(RESOURCE_CAPACITIES, **(capacities or {}))
+        for name in RESOURCE_NAMES:
+            self._write("INSERT OR IGNORE INTO Resource_Counts (name, count) VALUES (?, ?)", (name, capacities[name]))
+        self.commit()
+
+    def update_resource(self, resource, count):
+        check_resource(resource)
+        self._write("UPDATE Resource_Counts SET count = ? WHERE name = ?", (count, resource))
+
+    def get_resource(self, resource):
+        check_resource(resource)
+        return self._read_one("SELECT count FROM Resource_Counts WHERE name = ?", (resource,))[0]
+
+    def try_acquire(self, resource, n=1):
+        check_resource(resource)
+        return self._write("UPDATE Resource_Counts SET count = count - ? WHERE name = ? AND count >= ?",
+                           (n, resource, n)) == 1
+
+    def release(self, resource, n=1):
+        check_resource(resource)
+        self._write("UPDATE Resource_Counts SET count = count + ? WHERE name = ?", (n, resource))
+
+    def add_to_queue(self, queue_type, patient_id, diagnosis, status, callback_url, enqueued_at=0):
+        check_queue(queue_type)
+        with self.lock:
+            self._write("DELETE FROM Queue WHERE department = ? AND callback_url = ?", (queue_type, callback_url))
+            self._write("INSERT INTO Queue (department, priority, patient_id, diagnosis, status, callback_url, "
+                        "enqueued_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (queue_type, queue_priority(status), patient_id, diagnosis, status, callback_url, enqueued_at))
+
+    def get_count_queue(self, queue_type, status):
+        check_queue(queue_type)
+        return self._read_one("SELECT COUNT(*) FROM Queue WHERE department = ? AND status = ?",
+                              (queue_type, status))[0]
+
+    def get_queue(self, queue_type):
+        check_queue(queue_type)
+        return self._read_all("SELECT patient_id, diagnosis, status, callback_url, enqueued_at FROM Queue "
+                              "WHERE department = ? ORDER BY priority, id", (queue_type,))
+
+    def get_queue_length(self, queue_type):
+        check_queue(queue_type)
+        return self._count(queue_type)
+
+    def _count(self, department):
+        return self._read_one("SELECT COUNT(*) FROM Queue WHERE department = ?", (department,))[0]
+
+    def _pop(self, department):
+        with self.lock:
+            row = self._read_one("SELECT id, patient_id, diagnosis, status, callback_url, enqueued_at FROM Queue "
+                                 "WHERE department = ? ORDER BY priority, id LIMIT 1", (department,))
+            if row is not None:
+                self._write("DELETE FROM Queue WHERE id = ?", (row[0],))
+            return row
+
+    def pop_from_queue(self, queue_type):
+        check_queue(queue_type)
+        row = self._pop(queue_type)
+        return row[1:] if row is not None else None
+
+    def delete_from_queue(self, queue_type, callback_url):
+        check_queue(queue_type)
+        self._write("DELETE FROM Queue WHERE department = ? AND callback_url = ?", (queue_type, callback_url))
+
+    def add_to_queue_er(self, patient_id, callback_url, enqueued_at=0):
+        with self.lock:
+            # a patient queued again keeps its place in the ER queue
+            updated = self._write("UPDATE Queue SET patient_id = ?, enqueued_at = ? "
+                                  "WHERE department = 'Queue_ER' AND callback_url = ?",
+                                  (patient_id, enqueued_at, callback_url))
+            if not updated:
+                self._write("INSERT INTO Queue (department, priority, patient_id, callback_url, enqueued_at) "
+                            "VALUES ('Queue_ER', ?, ?, ?, ?)", (DEFAULT_PRIORITY, patient_id, callback_url, enqueued_at))
+
+    def delete_from_queue_er(self, callback_url):
+        self._write("DELETE FROM Queue WHERE department = 'Queue_ER' AND callback_url = ?", (callback_url,))
+
+    def get_queue_er(self):
+        return self._read_all("SELECT patient_id, callback_url, enqueued_at FROM Queue WHERE department = 'Queue_ER' "
+                              "ORDER BY priority, id")
+
+    def get_queue_length_er(self):
+        return self._count('Queue_ER')
+
+    def pop_from_queue_er(self):
+        row = self._pop('Queue_ER')
+        return (row[1], row[4], row[5]) if row is not None else None
+
+
+class MemoryStore:
+    """
+    Storage backend keeping resources and queues in process memory.
+    Every queue has one ordered dict per priority class keyed by callback_url and a counter per status,
+    so enqueueing, dequeueing and deleting are O(1) and no operation touches the disk.
+    Optionally the state is written behind to a SQLite file for crash inspection.
+    """
+
+    def __init__(self, capacities=None, snapshot_path=None, snapshot_interval=60):
+        self.lock = threading.RLock()
+        self.resources = {}
+        self.queues = {}
+        self.status_counts = {}
+        self.queue_er = OrderedDict()
+        self.init_db(capacities)
+        self.dirty = False
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.closed = threading.Event()
+        if snapshot_path:
+            threading.Thread(target=self._write_behind, daemon=True).start()
+
+    def close(self):
+        """
+        Stop the write-behind thread after a last snapshot of unsaved changes.
+        """
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        if self.snapshot_path and self.dirty:
+            self.snapshot(self.snapshot_path)
+
+    def init_db(self, capacities=None):
+        with self.lock:
+            self.resources = dict(RESOURCE_CAPACITIES, **(capacities or {}))
+            self.queues = {queue_type: (OrderedDict(), OrderedDict()) for queue_type in QUEUE_TABLES}
+            self.status_counts = {queue_type: Counter() for queue_type in QUEUE_TABLES}
+            self.queue_er = OrderedDict()
+            self.dirty = True
+
+    def update_resource(self, resource, count):
+        check_resource(resource)
+        with self.lock:
+            self.resources[resource] = count
+            self.dirty = True
+
+    def get_resource(self, resource):
+        check_resource(resource)
+        return self.resources[resource]
+
+    def try_acquire(self, resource, n=1):
+        check_resource(resource)
+        with self.lock:
+            if self.resources[resource] < n:
+                return False
+            self.resources[resource] -= n
+            self.dirty = True
+            return True
+
+    def release(self, resource, n=1):
+        check_resource(resource)
+        with self.lock:
+            self.resources[resource] += n
+            self.dirty = True
+
+    def add_to_queue(self, queue_type, patient_id, diagnosis, status, callback_url, enqueued_at=0):
+        check_queue(queue_type)
+        with self.lock:
+            self._remove(queue_type, callback_url)
+            self.queues[queue_type][queue_priority(status)][callback_url] = \
+                (patient_id, diagnosis, status, callback_url, enqueued_at)
+            self.status_counts[queue_type][status] += 1
+            self.dirty = True
+
+    def get_count_queue(self, queue_type, status):
+        check_queue(queue_type)
+        return self.status_counts[queue_type][status]
+
+    def get_queue(self, queue_type):
+        check_queue(queue_type)
+        with self.lock:
+            return [row for queue in self.queues[queue_type] for row in queue.values()]
+
+    def get_queue_length(self, queue_type):
+        check_queue(queue_type)
+        return sum(len(queue) for queue in self.queues[queue_type])
+
+    def pop_from_queue(self, queue_type):
+        check_queue(queue_type)
+        with self.lock:
+            for queue in self.queues[queue_type]:
+                if queue:
+                    _, row = queue.popitem(last=False)
+                    self.status_counts[queue_type][row[2]] -= 1
+                    self.dirty = True
+                    return row
+            return None
+
+    def delete_from_queue(self, queue_type, callback_url):
+        check_queue(queue_type)
+        with self.lock:
+            self._remove(queue_type, callback_url)
+            self.dirty = True
+
+    def _remove(self, queue_type, callback_url):
+        for queue in self.queues[queue_type]:
+            row = queue.pop(callback_url, None)
+            if row is not None:
+                self.status_counts[queue_type][row[2]] -= 1
+
+    def add_to_queue_er(self, patient_id, callback_url, enqueued_at=0):
+        with self.lock:
+            self.queue_er[callback_url] = (patient_id, callback_url, enqueued_at)
+            self.dirty = True
+
+    def delete_from_queue_er(self, callback_url):
+        with self.lock:
+            self.queue_er.pop(callback_url, None)
+            self.dirty = True
+
+    def get_queue_er(self):
+        with self.lock:
+            return list(self.queue_er.values())
+
+    def get_queue_length_er(self):
+        return len(self.queue_er)
+
+    def pop_from_queue_er(self):
+        with self.lock:
+            if not self.queue_er:
+                return None
+            _, row = self.queue_er.popitem(last=False)
+            self.dirty = True
+            return row
+
+    def snapshot(self, path):
+        """
+        Write the current state to a SQLite file with the schema of the SQLite backend.
+        """
+        with self.lock:
+            resources = tuple(self.resources[name] for name in RESOURCE_NAMES)
+            queues = {queue_type: [row + (priority,) for priority, queue in enumerate(queues) for row in queue.values()]
+                      for queue_type, queues in self.queues.items()}
+            queue_er = list(self.queue_er.values())
+            self.dirty = False
+
+        conn = sqlite3.connect(path)
+        migrate(conn)
+        with conn:
+            conn.execute("DELETE FROM Resources")
+            conn.execute("INSERT INTO Resources (id, Intake, Surgery, Bed_A, Bed_B, ER) VALUES (1, ?, ?, ?, ?, ?)",
+                         resources)
+            for queue_type, rows in queues.items():
+                conn.execute(f"DELETE FROM {queue_type}")
+                conn.executemany(
+                    f"INSERT INTO {queue_type} (patient_id, diagnosis, status, callback_url, enqueued_at, priority) "
+                    f"VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("DELETE FROM Queue_ER")
+            conn.executemany("INSERT INTO Queue_ER (patient_id, callback_url, enqueued_at) VALUES (?, ?, ?)", queue_er)
+        conn.close()
+
+    def _write_behind(self):
+        while not self.closed.wait(self.snapshot_interval):
+            if self.dirty:
+                self.snapshot(self.snapshot_path)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from replications import run_replication, aggregate
+from storage import RESOURCE_NAMES
+from time_helper import start_time, end_time
+
+# Parameters of a configuration: the capacity of every resource during the working hours and, prefixed with
+# 'off_hours.', outside the working hours
+PARAMETERS = RESOURCE_NAMES + tuple(f'off_hours.{name}' for name in RESOURCE_NAMES)
+
+# KPIs shown in the table
+TABLE_KPIS = ('sent_home_rate', 'replan_success_rate', 'mean_length_of_stay', 'waiting_time.ER',
+              'waiting_time.Surgery', 'waiting_time.Bed_A', 'waiting_time.Bed_B')
+
+
+def check_parameter(name):
+    if name not in PARAMETERS:
+        raise ValueError(f"Unknown parameter: {name}, expected one of {', '.join(PARAMETERS)}")
+
+
+def grid(values):
+    """
+    All combinations of the given values per parameter, e.g. {'Bed_A': [30, 35], 'Surgery': [5, 6]}.
+    """
+    for name in values:
+        check_parameter(name)
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+def latin_hypercube(ranges, samples, seed=0):
+    """
+    Latin hypercube sample of integer configurations, e.g. {'Bed_A': (25, 45)} with inclusive bounds.
+    Every parameter range is split into `samples` strata and every stratum is used exactly once.
+    """
+    for name in ranges:
+        check_parameter(name)
+    generator = np.random.default_rng(seed)
+    columns = {}
+    for name, (low, high) in ranges.items():
+        points = (generator.permutation(samples) + generator.random(samples)) / samples
+        columns[name] = np.floor(low + points * (high - low + 1)).astype(int).clip(low, high)
+    return [{name: int(columns[name][index]) for name in ranges} for index in range(samples)]
+
+
+def split_config(config):
+    """
+    Split a configuration into the capacities and the off-hours capacities of the engine.
+    """
+    capacities = {name: value for name, value in config.items() if not name.startswith('off_hours.')}
+    off_hours = {name[len('off_hours.'):]: value for name, value in config.items() if name.startswith('off_hours.')}
+    return capacities, off_hours
+
+
+def run_sweep(configs, replications, base_seed=0, replan=False, start=start_time, end=end_time, workers=None):
+    """
+    Simulate every configuration with the same seeds (common random numbers) in a process pool.
+    The first configuration is the baseline, the other configurations also get the confidence interval of the
+    per-seed differences to it, which is much narrower than the difference of two independent estimates.
+    """
+    seeds = [base_seed + index for index in range(replications)]
+    tasks = [(index, seed) for index in range(len(configs)) for seed in seeds]
+    split = [split_config(config) for config in configs]
+    workers = workers or os.cpu_count()
+    began = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        runs = list(executor.map(run_replication, [seed for _, seed in tasks],
+                                 [split[index][0] for index, _ in tasks], [replan] * len(tasks),
+                                 [start] * len(tasks), [end] * len(tasks), [split[index][1] for index, _ in tasks]))
+    elapsed = time.perf_counter() - began
+
+    by_config = [[] for _ in configs]
+    for (index, _), run in zip(tasks, runs):
+        by_config[index].append(run)
+    baseline = {run['seed']: run['kpis'] for run in by_config[0]}
+    rows = []
+    for index, config in enumerate(configs):
+        row = {'config': config, 'kpis': aggregate(by_config[index])}
+        if index > 0:
+            differences = [{'kpis': {name: value - baseline[run['seed']][name]
+                                     for name, value in run['kpis'].items()
+                                     if value is not None and baseline[run['seed']].get(name) is not None}}
+                           for run in by_config[index]]
+            row['vs_baseline'] = aggregate(differences)
+        rows.append(row)
+    return {
+        'replications': replications,
+        'base_seed': base_seed,
+        'replan': replan,
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'runs_per_second': round(len(tasks) / elapsed, 3),
+        'configurations': rows,
+    }
+
+
+def table(result):
+    """
+    Text table with one configuration per line and the mean and 95% half-width of the KPIs.
+    """
+    parameters = [name for name in PARAMETERS if any(name in row['config'] for row in result['configurations'])]
+    kpi_names = [name for name in TABLE_KPIS if any(name in row['kpis'] for row in result['configurations'])]
+    header = parameters + kpi_names
+    lines = []
+    for row in result['configurations']:
+        cells = [str(row['config'].get(name, 'default')) for name in parameters]
+        for name in kpi_names:
+            kpi = row['kpis'].get(name)
+            if kpi is None:
+                cells.append('-')
+            elif kpi['half_width'] is None:
+                cells.append(f"{kpi['mean']:.4f}")
+            else:
+                cells.append(f"{kpi['mean']:.4f} ±{kpi['half_width']:.4f}")
+        lines.append(cells)
+    widths = [max(len(cell) for cell in column) for column in zip(header, *lines)]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(cells, widths)) for cells in [header] + lines)
+
+
+def parse_values(value):
+    name, _, values = value.partition('=')
+    try:
+        return name, [int(item) for item in values.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected NAME=V1,V2,..., got {value}")
+
+
+def parse_range(value):
+    name, _, bounds = value.partition('=')
+    try:
+        low, high = (int(item) for item in bounds.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected NAME=LOW:HIGH, got {value}")
+    return name, (low, high)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare resource configurations with common random numbers.')
+    parser.add_argument('--grid', type=parse_values, action='append', default=[],
+                        help='values of a parameter, e.g. Bed_A=30,35,40 or off_hours.Surgery=1,2 (repeatable)')
+    parser.add_argument('--lhs', type=parse_range, action='append', default=[],
+                        help='range of a parameter for Latin hypercube sampling, e.g. ER=6:12 (repeatable)')
+    parser.add_argument('--samples', type=int, default=10, help='number of Latin hypercube samples')
+    parser.add_argument('-n', '--replications', type=int, default=5, help='replications per configuration')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first replication and of the sampling')
+    parser.add_argument('--replan', action='store_true', help='replan patients sent home with the planner')
+    parser.add_argument('--end', default=end_time.isoformat(), help='end of the simulation (ISO format)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPU count)')
+    parser.add_argument('--format', choices=('table', 'json'), default='table', help='output format')
+    args = parser.parse_args()
+    if args.grid and args.lhs:
+        parser.error('use either --grid or --lhs')
+
+    if args.lhs:
+        configs = latin_hypercube(dict(args.lhs), args.samples, args.seed)
+    else:
+        configs = grid(dict(args.grid))
+    # the default configuration is the baseline of the comparison
+    configs = [{}] + [config for config in configs if config]
+    result = run_sweep(configs, args.replications, args.seed, args.replan,
+                       end=datetime.datetime.fromisoformat(args.end), workers=args.workers)
+    if args.format == 'json':
+        print(json.dumps(result, indent=2))
+    else:
+        print(table(result))
+        print(f"{len(configs)} configurations x {args.replications} replications in {result['seconds']} s")
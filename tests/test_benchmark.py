@@ -0,0 +1,54 @@
+import json
+import os
+import subprocess
+import sys
+
+# benchmark imports simulator.py, which patches the standard library for gevent, so it runs in a separate interpreter
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(*args):
+    result = subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout)
+
+
+def test_quick_run_reports_every_backend_and_seeded_arrivals(tmp_path):
+    output = str(tmp_path / 'results.json')
+    results = run_python('benchmark.py', '--quick', '--only', 'db', 'arrivals', '--seed', '3', '--output', output)
+    with open(output) as file:
+        assert json.load(file) == results
+    assert results['meta']['seed'] == 3
+    assert set(results['db']) == {'memory', 'sqlite', 'durable'}
+    assert results['db']['memory']['try_acquire']['calls'] == 200
+    again = run_python('benchmark.py', '--quick', '--only', 'arrivals', '--seed', '3')
+    assert again['arrivals']['arrivals'] == results['arrivals']['arrivals']
+
+
+def test_compare_reports_the_change_of_timings_in_percent():
+    result = run_python('-c', '''
+import json
+from benchmark import compare, summarize
+baseline = {'meta': {'seed': 0}, 'db': {'get_resource': {'calls': 10, 'mean_ms': 2.0}}, 'x': {'patients_per_second': 50}}
+current = {'meta': {'seed': 0}, 'db': {'get_resource': {'calls': 10, 'mean_ms': 1.0}}, 'x': {'patients_per_second': 75}}
+print(json.dumps({'change': compare(baseline, current), 'summary': summarize([0.001, 0.003, 0.002])}))
+''')
+    assert result['change'] == {'db.get_resource.mean_ms': -50.0, 'x.patients_per_second': 50.0}
+    assert result['summary'] == {'calls': 3, 'mean_ms': 2.0, 'p50_ms': 2.0, 'p95_ms': 3.0}
+
+
+def test_planner_is_timed_with_and_without_cache_and_the_backend_is_restored():
+    result = run_python('-c', '''
+import json, random
+import benchmark
+import db
+from storage import MemoryStore
+store = db.use_backend(MemoryStore())
+planner = benchmark.bench_planner(random.Random(0), dict(benchmark.SIZES['quick'], planner_patients=(100,)))
+benchmark.bench_db(random.Random(0), dict(benchmark.SIZES['quick'], db_operations=20))
+benchmark.bench_dispatch(dict(benchmark.SIZES['quick'], dispatch_patients=20))
+print(json.dumps({'planner': planner, 'restored': db.backend is store}))
+''')
+    assert set(result['planner']['100']) == {'registry', 'registry_cached', 'list'}
+    assert result['planner']['100']['registry']['calls'] == result['planner']['100']['registry_cached']['calls']
+    assert result['restored']
@@ -0,0 +1,66 @@
+import datetime
+
+import pytest
+
+from capacity_calendar import CALENDAR, CapacityCalendar, calendar_for, parse_holidays
+from time_helper import start_time
+
+# Friday 2018-01-05
+FRIDAY = datetime.date(2018, 1, 5)
+
+
+def at(day, hour, minute=0):
+    return datetime.datetime.combine(day, datetime.time(hour, minute))
+
+
+def test_working_shift_of_a_weekday():
+    assert not CALENDAR.is_working(at(FRIDAY, 7, 59))
+    assert CALENDAR.is_working(at(FRIDAY, 8))
+    assert CALENDAR.is_working(at(FRIDAY, 17, 0))
+    assert not CALENDAR.is_working(at(FRIDAY, 17, 1))
+    assert not CALENDAR.is_working(at(FRIDAY + datetime.timedelta(days=1), 10))
+
+
+def test_next_transition():
+    assert CALENDAR.next_transition(at(FRIDAY, 6)) == at(FRIDAY, 8)
+    assert CALENDAR.next_transition(at(FRIDAY, 8)) == at(FRIDAY, 17, 1)
+    # the weekend lasts from Friday evening until Monday morning
+    assert CALENDAR.next_transition(at(FRIDAY, 18)) == at(FRIDAY + datetime.timedelta(days=3), 8)
+
+
+def test_holidays_have_no_working_shift():
+    calendar = CapacityCalendar(start_time, start_time + datetime.timedelta(days=14), holidays=[FRIDAY])
+    assert not calendar.is_working(at(FRIDAY, 10))
+    assert calendar.next_transition(at(FRIDAY - datetime.timedelta(days=1), 18)) == at(FRIDAY + datetime.timedelta(days=3), 8)
+    assert calendar.working_hours(at(FRIDAY, 0), at(FRIDAY, 23)) == []
+
+
+def test_capacities_per_shift():
+    assert CALENDAR.capacity('Surgery', at(FRIDAY, 10)) == 5
+    assert CALENDAR.capacity('Surgery', at(FRIDAY, 20)) == 1
+    assert CALENDAR.capacity('Bed_A', at(FRIDAY, 20)) == 30
+    assert CALENDAR.capacities_at(at(FRIDAY, 20))['Surgery'] == 1
+    calendar = calendar_for(start_time, start_time + datetime.timedelta(days=7), {'Surgery': 6}, {'Surgery': 2})
+    assert calendar is not CALENDAR
+    assert (calendar.capacity('Surgery', at(FRIDAY, 10)), calendar.capacity('Surgery', at(FRIDAY, 20))) == (6, 2)
+
+
+def test_shifts_between_two_times():
+    shifts = list(CALENDAR.shifts(at(FRIDAY, 12), at(FRIDAY, 20)))
+    assert shifts == [(at(FRIDAY, 12), at(FRIDAY, 17, 1), True),
+                      (at(FRIDAY, 17, 1), at(FRIDAY + datetime.timedelta(days=3), 8), False)]
+
+
+def test_working_hours_are_the_full_hours_of_the_shifts():
+    hours = CALENDAR.working_hours(at(FRIDAY, 0), at(FRIDAY + datetime.timedelta(days=3), 10))
+    assert hours == [at(FRIDAY, hour) for hour in range(8, 17)] + [at(FRIDAY + datetime.timedelta(days=3), 8),
+                                                                   at(FRIDAY + datetime.timedelta(days=3), 9)]
+
+
+def test_times_outside_the_calendar_are_rejected():
+    with pytest.raises(ValueError):
+        CALENDAR.is_working(start_time - datetime.timedelta(hours=1))
+
+
+def test_parse_holidays():
+    assert parse_holidays('2018-12-25, 2018-12-26,') == [datetime.date(2018, 12, 25), datetime.date(2018, 12, 26)]
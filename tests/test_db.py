@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+import db
+from storage import MemoryStore
+
+
+@pytest.fixture(autouse=True)
+def memory_backend():
+    previous, listeners = db.backend, list(db.listeners)
+    db.use_backend(MemoryStore())
+    yield db.backend
+    db.use_backend(previous)
+    db.listeners[:] = listeners
+    db.waiters.clear()
+
+
+def test_listeners_are_notified_of_enqueues_and_resource_changes():
+    notified = []
+    db.subscribe(notified.append)
+    db.add_to_queue('Queue_Surgery', 'p1', 'A2', 'Intake finished', 'url-1')
+    db.add_to_queue_er('p2', 'url-2')
+    db.update_resource('Bed_A', 3)
+    assert notified == ['Queue_Surgery', 'Queue_ER', 'Bed_A']
+
+
+def test_reads_do_not_notify():
+    notified = []
+    db.subscribe(notified.append)
+    db.get_resource('ER')
+    db.get_queue_length('Queue_Surgery')
+    db.pop_from_queue_er()
+    assert notified == []
+
+
+def test_configure_closes_the_previous_backend(tmp_path):
+    first = db.configure('durable', path=str(tmp_path / 'hospital.db'))
+    second = db.configure('memory')
+    assert first.conn is None
+    assert db.get_backend() is second
+
+
+def test_default_backend_is_created_on_first_use(monkeypatch):
+    monkeypatch.delenv('HOSPITAL_DB_BACKEND', raising=False)
+    db.use_backend(None)
+    assert db.get_resource('ER') == db.RESOURCE_CAPACITIES['ER']
+    assert isinstance(db.backend, MemoryStore)
+
+
+def test_acquire_waits_for_a_release():
+    db.update_resource('ER', 0)
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(db.acquire('ER', timeout=5)))
+    waiter.start()
+    while not db.waiters.get('ER'):
+        time.sleep(0.001)
+    # waiting callers are served before try_acquire
+    db.release('ER')
+    assert not db.try_acquire('ER')
+    waiter.join()
+    assert acquired == [True]
+    assert db.get_resource('ER') == 0
+
+
+def test_acquire_gives_up_after_the_timeout():
+    db.update_resource('ER', 0)
+    assert not db.acquire('ER', timeout=0.01)
+    assert not db.waiters['ER']
+
+
+def test_negative_release_withdraws_units():
+    db.update_resource('Surgery', 1)
+    db.release('Surgery', -3)
+    assert db.get_resource('Surgery') == -2
+    assert not db.try_acquire('Surgery')
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from delivery import Delivery
+
+
+def test_requests_are_delivered_in_the_background():
+    sent = []
+    outbox = Delivery(workers=4, backoff=0,
+                      transport=lambda method, url, **kwargs: sent.append((method, url)) or SimpleNamespace(status_code=200))
+    for index in range(20):
+        outbox.put(f"http://cpee/callback/{index}", json={'index': index})
+    outbox.post('http://cpee/start')
+    outbox.join()
+    assert outbox.delivered == 21 and outbox.failed == 0
+    assert ('POST', 'http://cpee/start') in sent
+    assert len(sent) == 21
+
+
+def test_server_errors_are_retried_then_given_up():
+    attempts = []
+
+    def transport(method, url, **kwargs):
+        attempts.append(url)
+        return SimpleNamespace(status_code=503 if url.endswith('down') or len(attempts) == 1 else 200)
+
+    outbox = Delivery(workers=1, retries=2, backoff=0, transport=transport)
+    outbox.put('http://cpee/flaky')
+    outbox.join()
+    assert attempts == ['http://cpee/flaky'] * 2
+    outbox.put('http://cpee/down')
+    outbox.join()
+    assert attempts.count('http://cpee/down') == 3
+    assert (outbox.delivered, outbox.failed) == (1, 1)
+
+
+def test_client_errors_are_not_retried():
+    attempts = []
+    outbox = Delivery(workers=1, retries=3, backoff=0,
+                      transport=lambda method, url, **kwargs: attempts.append(url) or SimpleNamespace(status_code=404))
+    outbox.put('http://cpee/gone')
+    outbox.join()
+    assert len(attempts) == 1
+
+
+def test_unexpected_errors_are_retried_and_keep_the_worker_alive():
+    attempts = []
+
+    def transport(method, url, **kwargs):
+        attempts.append(url)
+        if url.endswith('broken'):
+            raise ValueError('bad response')
+        return SimpleNamespace(status_code=200)
+
+    outbox = Delivery(workers=1, retries=1, backoff=0, transport=transport)
+    outbox.put('http://cpee/broken')
+    outbox.join()
+    # the only worker still delivers after the failure
+    outbox.put('http://cpee/fine')
+    outbox.join()
+    assert attempts == ['http://cpee/broken', 'http://cpee/broken', 'http://cpee/fine']
+    assert (outbox.delivered, outbox.failed) == (1, 1)
+
+
+def test_counters_are_exact_with_many_workers():
+    outbox = Delivery(workers=16, retries=0, backoff=0,
+                      transport=lambda method, url, **kwargs: SimpleNamespace(status_code=200 if url[-1] in '02468' else 500))
+    for index in range(2000):
+        outbox.put(f"http://cpee/callback/{index}")
+    outbox.join()
+    assert (outbox.delivered, outbox.failed) == (1000, 1000)
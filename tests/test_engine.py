@@ -0,0 +1,160 @@
+import datetime
+
+import pytest
+
+import engine
+from engine import Department, EventCalendar, HospitalSimulation
+from planner import admission_status, MAX_PENDING_PATIENTS
+from time_helper import start_time
+
+END = start_time + datetime.timedelta(days=14)
+
+
+def test_calendar_runs_events_in_time_order():
+    calendar = EventCalendar()
+    executed = []
+    calendar.schedule_at(2.0, executed.append, 'late')
+    calendar.schedule_at(1.0, executed.append, 'first')
+    calendar.schedule_at(1.0, executed.append, 'second')
+    calendar.schedule(0.5, executed.append, 'early')
+    assert calendar.run() == 4
+    assert executed == ['early', 'first', 'second', 'late']
+    assert calendar.now == 2.0
+
+
+def test_calendar_stops_before_until():
+    calendar = EventCalendar()
+    executed = []
+    calendar.schedule_at(1.0, executed.append, 1)
+    calendar.schedule_at(3.0, executed.append, 3)
+    calendar.run(until=2.0)
+    assert executed == [1]
+    assert calendar.now == 2.0
+    assert len(calendar) == 1
+
+
+def test_department_serves_er_patients_first():
+    department = Department('Surgery', 1)
+    department.enqueue('planned-1', 0.0, 'Intake finished')
+    department.enqueue('er-1', 1.0, 'ER Treatment finished')
+    department.enqueue('planned-2', 2.0, 'Intake finished')
+    department.enqueue('er-2', 3.0, 'ER Treatment finished')
+    assert department.queue_length() == 4
+    assert department.count_queue('Intake finished') == 2
+    assert [department.dequeue()[0] for _ in range(4)] == ['er-1', 'er-2', 'planned-1', 'planned-2']
+
+
+def test_department_available_units():
+    department = Department('Bed_A', 3)
+    department.busy = 2
+    assert department.available() == 1
+
+
+@pytest.mark.parametrize('patient_type, patient_id, intake_available, waiting, expected', [
+    ('ER', '', 0, 10, 'patient admitted'),
+    ('Planned', '', 4, 0, 'sent home'),
+    ('Planned', 'p', 0, 0, 'sent home'),
+    ('Planned', 'p', 1, MAX_PENDING_PATIENTS + 1, 'sent home'),
+    ('Planned', 'p', 1, MAX_PENDING_PATIENTS, 'patient admitted'),
+])
+def test_admission_status(patient_type, patient_id, intake_available, waiting, expected):
+    assert admission_status(patient_type, patient_id, intake_available, waiting) == expected
+
+
+def test_planned_patient_is_sent_home_without_free_intake():
+    simulation = HospitalSimulation(end=END, seed=1)
+    simulation.departments['Intake'].busy = simulation.departments['Intake'].capacity
+    simulation.patient_admission('Planned', 'patient-1', 'A2')
+    simulation.patient_admission('ER', 'patient-2', '')
+    assert simulation.stats['sent_home'] == 1
+    assert simulation.stats['admitted'] == 1
+    assert 'patient-1' not in simulation.resources
+    assert 'patient-2' in simulation.resources
+
+
+def test_run_accounts_for_every_arrival():
+    summary = HospitalSimulation(end=END, seed=1).run()
+    arrived = summary['arrived']['Planned'] + summary['arrived']['ER']
+    assert arrived > 0
+    assert summary['admitted'] + summary['sent_home'] == arrived
+    assert summary['released'] <= summary['admitted']
+
+
+def test_same_seed_gives_same_run():
+    first = HospitalSimulation(end=END, seed=7).run()
+    second = HospitalSimulation(end=END, seed=7).run()
+    assert first == second
+    assert HospitalSimulation(end=END, seed=8).run()['arrived'] != first['arrived']
+
+
+def test_dispatch_serves_on_all_free_units():
+    simulation = HospitalSimulation(end=END, seed=1)
+    department = simulation.departments['Bed_A']
+    department.capacity = 3
+    for index in range(5):
+        patient = {'cid': f"patient-{index}", 'type': 'Planned', 'diagnosis': 'A1', 'arrival': 0.0}
+        department.enqueue(patient, 0.0, 'Intake finished')
+    simulation.dispatch(department)
+    assert department.busy == 3
+    assert department.queue_length() == 2
+    assert len(simulation.calendar) == 3
+
+
+def test_duration_is_sampled_once_and_stored_when_a_task_starts():
+    simulation = HospitalSimulation(end=END, seed=1)
+    department = simulation.departments['Surgery']
+    patient = {'cid': 'patient-1', 'type': 'Planned', 'diagnosis': 'A2', 'arrival': 0.0}
+    simulation.resources.add('patient-1', 'Intake', start_time, 'A2', False)
+    sampled = []
+    service_time = simulation.service_time
+
+    def sample(department, patient):
+        sampled.append(service_time(department, patient))
+        return sampled[-1]
+
+    simulation.service_time = sample
+    simulation.calendar.now = 2.0
+    simulation.request(department, patient, 'Intake finished')
+    record = simulation.resources.get('patient-1')
+    assert len(sampled) == 1
+    assert (record.task, record.wait, record.duration) == ('Surgery', False, sampled[0])
+    assert record.start == start_time + datetime.timedelta(hours=2)
+
+
+def test_waiting_time_is_measured_from_the_enqueue_time():
+    simulation = HospitalSimulation(end=END, seed=1)
+    department = simulation.departments['Bed_B']
+    department.busy = department.capacity
+    patient = {'cid': 'patient-1', 'type': 'Planned', 'diagnosis': 'B1', 'arrival': 0.0}
+    simulation.calendar.now = 1.0
+    simulation.request(department, patient, 'Intake finished')
+    simulation.calendar.now = 3.5
+    department.busy -= 1
+    simulation.dispatch(department)
+    assert department.waiting_time == 2.5
+    assert simulation.metrics.department('Bed_B').waiting_time.stats.mean == 2.5
+
+
+def without_event_count(summary):
+    # the periodic checkpoints are events of their own
+    return {key: value for key, value in summary.items() if key != 'events'}
+
+
+def test_resumed_checkpoint_gives_the_uninterrupted_result(tmp_path):
+    path = str(tmp_path / 'checkpoint.gz')
+    uninterrupted = HospitalSimulation(end=END, seed=5, replan=True).run()
+    interrupted = HospitalSimulation(end=END, seed=5, replan=True)
+    interrupted.run(checkpoint_path=path, checkpoint_interval=100)
+    resumed = HospitalSimulation.resume(path)
+    assert resumed.calendar.now == 300
+    assert without_event_count(resumed.run()) == without_event_count(uninterrupted)
+
+
+def test_resume_rejects_other_versions_and_a_later_end(tmp_path, monkeypatch):
+    path = str(tmp_path / 'checkpoint.gz')
+    HospitalSimulation(end=END, seed=5).run(checkpoint_path=path, checkpoint_interval=100)
+    with pytest.raises(ValueError):
+        HospitalSimulation.resume(path, end=END + datetime.timedelta(days=1))
+    monkeypatch.setattr(engine, 'CHECKPOINT_VERSION', engine.CHECKPOINT_VERSION + 1)
+    with pytest.raises(ValueError):
+        HospitalSimulation.resume(path)
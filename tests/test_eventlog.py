@@ -0,0 +1,71 @@
+import datetime
+import math
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import eventlog
+from eventlog import EventLog, export_csv, export_xes, log_format, read_events
+
+ORIGIN = datetime.datetime(2018, 1, 1)
+
+
+def write_log(path, format=None, batch_size=2):
+    with EventLog(path, ORIGIN, epoch=10.0, format=format, batch_size=batch_size) as log:
+        log.log(10.0, 'p1', 'arrival', patient_type='Planned', diagnosis='A2')
+        log.log(10.5, 'p1', 'queue enter', 'Surgery', diagnosis='A2')
+        log.log(12.0, 'p1', 'queue leave', 'Surgery', diagnosis='A2', value=1.5)
+        log.log(13.25, 'p2', 'sent home', patient_type='ER')
+    return log
+
+
+@pytest.mark.parametrize('extension', ['csv', 'ndjson', 'parquet', 'arrow'])
+def test_events_round_trip(tmp_path, extension):
+    if extension in ('parquet', 'arrow'):
+        pytest.importorskip('pyarrow')
+    path = str(tmp_path / f"events.{extension}")
+    assert len(write_log(path)) == 4
+    events = list(read_events(path))
+    assert [event['activity'] for event in events] == ['arrival', 'queue enter', 'queue leave', 'sent home']
+    assert events[0]['time'] == ORIGIN
+    assert events[3]['time'] == ORIGIN + datetime.timedelta(hours=3.25)
+    assert events[2]['value'] == 1.5 and events[2]['department'] == 'Surgery'
+    assert events[0]['value'] is None or math.isnan(events[0]['value'])
+    assert events[3]['patient_type'] == 'ER' and events[3]['diagnosis'] == ''
+
+
+def test_format_follows_the_extension():
+    assert log_format('log.csv') == 'csv'
+    assert log_format('log.jsonl') == 'ndjson'
+    with pytest.raises(ValueError):
+        log_format('log.csv', 'excel')
+
+
+def test_columnar_formats_require_pyarrow(monkeypatch):
+    monkeypatch.setattr(eventlog, 'pa', None)
+    assert log_format('log') == 'csv'
+    with pytest.raises(ValueError):
+        log_format('log.parquet')
+
+
+def test_anchor_counts_times_from_the_given_moment(tmp_path):
+    path = str(tmp_path / 'events.csv')
+    with EventLog(path, ORIGIN) as log:
+        log.anchor(100.0, datetime.datetime(2018, 3, 1))
+        log.log(101.0, 'p1', 'arrival')
+    assert next(read_events(path))['time'] == datetime.datetime(2018, 3, 1, 1)
+
+
+def test_exports(tmp_path):
+    source = str(tmp_path / 'events.csv')
+    write_log(source)
+    target = str(tmp_path / 'flat.csv')
+    export_csv(source, target)
+    with open(target) as file:
+        lines = file.read().splitlines()
+    assert lines[0].startswith('case_id,activity,timestamp,lifecycle')
+    assert lines[2].split(',')[3] == 'start'
+    xes = str(tmp_path / 'log.xes')
+    export_xes(source, xes)
+    traces = ET.parse(xes).getroot().findall('{http://www.xes-standard.org/}trace')
+    assert [len(trace.findall('{http://www.xes-standard.org/}event')) for trace in traces] == [3, 1]
@@ -0,0 +1,52 @@
+import datetime
+
+import numpy as np
+
+from capacity_calendar import CALENDAR
+from instance_generator import arrival_stream, generate_arrivals
+from time_helper import start_time
+
+END = start_time + datetime.timedelta(days=14)
+
+
+def test_arrivals_are_sorted_and_within_the_period():
+    arrivals = generate_arrivals(start_time, END, seed=1)
+    assert len(arrivals) > 0
+    assert (np.diff(arrivals['time']) >= 0).all()
+    assert arrivals['time'].min() >= 0
+    assert arrivals['time'].max() < (END - start_time).total_seconds() / 3600
+
+
+def test_same_seed_gives_same_arrivals():
+    assert np.array_equal(generate_arrivals(start_time, END, seed=3), generate_arrivals(start_time, END, seed=3))
+    assert not np.array_equal(generate_arrivals(start_time, END, seed=3), generate_arrivals(start_time, END, seed=4))
+
+
+def test_planned_patients_arrive_in_working_shifts():
+    arrivals = generate_arrivals(start_time, END, seed=1)
+    planned = arrivals[arrivals['type'] != 'ER']
+    assert len(planned) > 0
+    for arrival in planned:
+        assert CALENDAR.is_working(start_time + datetime.timedelta(hours=float(arrival['time'])))
+    assert set(planned[planned['type'] == 'A']['diagnosis']) <= {'A1', 'A2', 'A3', 'A4'}
+    assert set(planned[planned['type'] == 'B']['diagnosis']) <= {'B1', 'B2', 'B3', 'B4'}
+
+
+def test_er_patients_arrive_around_the_clock_without_diagnosis():
+    arrivals = generate_arrivals(start_time, END, seed=1)
+    er = arrivals[arrivals['type'] == 'ER']
+    assert (er['diagnosis'] == '').all()
+    hours = {(start_time + datetime.timedelta(hours=float(time))).hour for time in er['time']}
+    assert len(hours) == 24
+
+
+def test_arrival_stream_is_sorted_within_the_period_and_reproducible():
+    arrivals = list(arrival_stream(start_time, END, np.random.default_rng(5)))
+    times = [arrival_time for arrival_time, _, _, _ in arrivals]
+    assert len(arrivals) > 0
+    assert times == sorted(times)
+    assert start_time <= times[0] and times[-1] < END
+    again = list(arrival_stream(start_time, END, np.random.default_rng(5)))
+    # the patient ids are new uuids per run
+    assert [(time, kind, diagnosis) for time, kind, _, diagnosis in arrivals] == \
+        [(time, kind, diagnosis) for time, kind, _, diagnosis in again]
@@ -0,0 +1,112 @@
+import json
+import os
+import subprocess
+import sys
+
+# local_cpee patches the standard library for gevent on import, so it runs in a separate interpreter
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(*args):
+    result = subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout)
+
+
+def test_scripts_and_conditions_of_the_model():
+    result = run_python('-c', '''
+import json
+from local_cpee import evaluate, run_script
+data = {'status': 'sent home', 'processes': []}
+run_script("data.status = result['status']\\ndata.processes << result['status']\\ndata.release = 'false'\\n"
+           "data.duration += result['duration']", data, {'status': 'patient admitted', 'duration': 2})
+print(json.dumps({'data': data, 'admitted': evaluate('data.status=="patient admitted"', data),
+                  'missing': evaluate('data.unknown=="x"', data)}))
+''')
+    assert result['data'] == {'status': 'patient admitted', 'processes': ['patient admitted'], 'release': 'false',
+                              'duration': 2}
+    assert result['admitted'] is True
+    assert result['missing'] is False
+
+
+def test_every_instance_of_a_run_finishes():
+    result = run_python('local_cpee.py', '--hours', '24', '--seed', '1')
+    assert result['instances'] > 0
+    assert result['finished'] == result['instances']
+    assert sum(result['statuses'].values()) == result['instances']
+    assert set(result['statuses']) <= {'released', 'sent home'}
+
+
+def test_arrivals_without_instance_are_counted_as_lost():
+    result = run_python('-c', '''
+import contextlib, json, os, random
+from types import SimpleNamespace
+import db
+from delivery import outbox
+from local_cpee import LocalCPEE
+db.configure()
+db.init_db()
+engine = LocalCPEE()
+deliver = engine.deliver
+drops = random.Random(2)
+dropped = []
+
+def lossy(method, url, **kwargs):
+    # about 5% of the instance creation requests are lost
+    if url.rstrip('/').endswith('/flow/start/url') and drops.random() < 0.05:
+        dropped.append(url)
+        return SimpleNamespace(status_code=503)
+    return deliver(method, url, **kwargs)
+
+engine.deliver = lossy
+outbox.retries = 0
+with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+    report = engine.run(48, seed=1)
+print(json.dumps({'report': report, 'dropped': len(dropped)}))
+''')
+    report = result['report']
+    assert result['dropped'] > 0
+    assert report['metrics']['counters'].get('arrival lost', 0) == result['dropped']
+    assert report['finished'] == report['instances']
+
+
+def test_verbose_run_shows_the_output_of_the_simulator():
+    result = subprocess.run([sys.executable, 'local_cpee.py', '--hours', '4', '--seed', '1', '--verbose'], cwd=ROOT,
+                            capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    assert 'shift started at' in result.stdout
+    quiet = subprocess.run([sys.executable, 'local_cpee.py', '--hours', '4', '--seed', '1'], cwd=ROOT,
+                           capture_output=True, text=True, timeout=300)
+    assert 'shift started at' not in quiet.stdout
+
+
+def test_patient_state_is_dropped_on_every_exit():
+    result = run_python('-c', '''
+import contextlib, datetime, json, os
+import db
+import simulator
+from local_cpee import LocalCPEE
+db.configure()
+db.init_db()
+engine = LocalCPEE()
+with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+    report = engine.run(24, seed=1)
+    left = [len(simulator.admitted_at), len(simulator.patient_types), len(simulator.resources)]
+    released = simulator.metrics.counters['released']
+    simulator.remove_resource('unknown')
+    # an instance dropped after the admission of its patient
+    simulator.admitted_at['p1'] = simulator.clock()
+    simulator.patient_types['p1'] = 'Planned'
+    simulator.add_resources('p1', 'Intake', datetime.datetime(2018, 1, 1), 'A1', False)
+    def fail(element, data):
+        raise RuntimeError('instance dropped')
+    engine.execute = fail
+    engine.run_instance({'data': {'patientID': 'p1'}, 'started': 0, 'ended': None})
+print(json.dumps({'report': report, 'left': left, 'released': released,
+                  'released_after': simulator.metrics.counters['released'],
+                  'dropped': [len(simulator.admitted_at), len(simulator.patient_types), len(simulator.resources)]}))
+''')
+    assert result['left'] == [0, 0, 0]
+    assert result['released'] == result['report']['statuses']['released']
+    assert result['released_after'] == result['released']
+    assert result['dropped'] == [0, 0, 0]
@@ -0,0 +1,65 @@
+import statistics
+
+import numpy as np
+import pytest
+
+from metrics import Distribution, Metrics, P2Quantile, RunningStats, TimeWeighted
+
+
+def test_running_stats_match_the_exact_statistics():
+    values = np.random.default_rng(1).normal(5, 2, 1000).tolist()
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    assert stats.count == 1000
+    assert stats.mean == pytest.approx(statistics.fmean(values))
+    assert stats.variance() == pytest.approx(statistics.variance(values))
+    assert (stats.min, stats.max) == (min(values), max(values))
+
+
+@pytest.mark.parametrize('p', [0.5, 0.9, 0.95])
+@pytest.mark.parametrize('distribution', ['normal', 'exponential', 'uniform'])
+def test_p2_quantile_is_close_to_numpy_percentile(p, distribution):
+    generator = np.random.default_rng(2)
+    values = getattr(generator, distribution)(size=20000)
+    quantile = P2Quantile(p)
+    for value in values.tolist():
+        quantile.add(value)
+    exact = np.percentile(values, p * 100)
+    spread = np.percentile(values, 99) - np.percentile(values, 1)
+    assert abs(quantile.value() - exact) < 0.02 * spread
+
+
+def test_p2_quantile_of_few_values_is_exact():
+    quantile = P2Quantile(0.5)
+    assert quantile.value() is None
+    for value in (3.0, 1.0, 2.0):
+        quantile.add(value)
+    assert quantile.value() == 2.0
+
+
+def test_distribution_snapshot_names_the_quantiles():
+    distribution = Distribution((0.5, 0.95))
+    for value in range(100):
+        distribution.add(float(value))
+    assert set(distribution.snapshot()) == {'count', 'mean', 'stdev', 'min', 'max', 'p50', 'p95'}
+
+
+def test_time_weighted_mean():
+    queue = TimeWeighted()
+    queue.update(0.0, 2)
+    queue.update(1.0, 0)
+    queue.update(3.0, 4)
+    # 2 for one hour, 0 for two hours, 4 for one hour
+    assert queue.area(4.0) == 6.0
+    assert queue.mean(4.0) == 1.5
+
+
+def test_utilization_is_busy_time_over_capacity_time():
+    metrics = Metrics()
+    metrics.observe_resource('Surgery', 0.0, 1, 2)
+    metrics.observe_resource('Surgery', 2.0, 2, 2)
+    metrics.count('sent home')
+    snapshot = metrics.snapshot(4.0)
+    assert snapshot['counters'] == {'sent home': 1}
+    assert snapshot['departments']['Surgery']['utilization'] == 0.75
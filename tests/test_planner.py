@@ -0,0 +1,141 @@
+import datetime
+
+import planner as planner_module
+from planner import MAX_PENDING_PATIENTS, OccupancyTimeline, capacity_limits, earliest_slot, plan_batch, planner
+from registry import PatientRecord
+
+# Monday 2018-01-08, 10 AM
+NOW = datetime.datetime(2018, 1, 8, 10, 0)
+
+
+def record(cid, task, start, diagnosis='A2', wait=False, duration=2.0):
+    return PatientRecord(cid, task, start, diagnosis, wait, duration)
+
+
+def test_timeline_counts_a_task_in_every_hour_it_covers():
+    timeline = OccupancyTimeline()
+    timeline.update(record('p1', 'Surgery', NOW, duration=2.5))
+    assert timeline.ongoing('Surgery', NOW) == 1
+    assert timeline.ongoing('Surgery', NOW + datetime.timedelta(hours=2)) == 1
+    assert timeline.ongoing('Surgery', NOW + datetime.timedelta(hours=3)) == 0
+    assert timeline.ongoing('Intake', NOW) == 0
+
+
+def test_timeline_replaces_the_previous_state_of_a_patient():
+    timeline = OccupancyTimeline()
+    timeline.update(record('p1', 'Intake', NOW, duration=1.0))
+    timeline.update(record('p1', 'Nursing', NOW, diagnosis='B1', duration=1.0))
+    assert timeline.ongoing('Intake', NOW) == 0
+    assert timeline.ongoing('Nursing_B', NOW) == 1
+    timeline.remove('p1')
+    assert timeline.ongoing('Nursing_B', NOW) == 0
+    assert not timeline.occupancy['Nursing_B']
+
+
+def test_waiting_patients_count_as_pending():
+    timeline = OccupancyTimeline()
+    timeline.update(record('p1', 'Surgery', NOW, wait=True))
+    timeline.update(record('p2', 'Nursing', NOW, diagnosis='A1', wait=True))
+    assert timeline.pending_count('Surgery') == 1
+    assert timeline.pending_count('Nursing_A') == 1
+    timeline.remove('p1')
+    assert timeline.pending_count('Surgery') == 0
+
+
+def test_expected_durations_are_used_without_sampled_ones():
+    timeline = OccupancyTimeline(duration_mode='expected')
+    # the mean operation time of A4 is 4 hours
+    timeline.update(record('p1', 'Surgery', NOW, diagnosis='A4', duration=0.5))
+    assert timeline.ongoing('Surgery', NOW + datetime.timedelta(hours=3)) == 1
+
+
+def test_sampled_durations_predict_the_end_without_drawing(monkeypatch):
+    def draw(*args):
+        raise AssertionError('random number drawn')
+
+    monkeypatch.setattr(planner_module.diagnosis_helper, 'calculate_duration', draw)
+    monkeypatch.setattr(planner_module, 'expected_duration', draw)
+    timeline = OccupancyTimeline()
+    assert timeline.duration_mode == 'sampled'
+    timeline.update(record('p1', 'Surgery', NOW, diagnosis='A4', duration=1.5))
+    assert timeline.ongoing('Surgery', NOW + datetime.timedelta(hours=1)) == 1
+    assert timeline.ongoing('Surgery', NOW + datetime.timedelta(hours=2)) == 0
+    assert planner('cid', NOW.isoformat(), {'diagnosis': 'A2'}, timeline) is not None
+
+
+def test_planner_gives_the_same_plan_for_a_timeline_and_a_list_of_states():
+    records = [record(f"p{index}", 'Intake', NOW.replace(hour=8) + datetime.timedelta(hours=index // 4), duration=1.0)
+               for index in range(12)]
+    states = [item.as_dict() for item in records]
+    timeline = OccupancyTimeline.from_resources(records)
+    arrival = NOW.replace(hour=7).isoformat()
+    plan = planner('cid', arrival, {'diagnosis': 'A2'}, timeline)
+    assert plan == planner('cid', arrival, {'diagnosis': 'A2'}, states)
+    # all four intake units are busy from 8 to 11 AM
+    assert plan['reschedule_time'] == '2018-01-08T11:00:00'
+
+
+def test_earliest_slot_is_the_next_working_hour_of_an_empty_hospital():
+    timeline = OccupancyTimeline()
+    # Friday evening, the next working hour is Monday 8 AM
+    assert earliest_slot(timeline, '2018-01-05T18:30:00', capacity_limits()) == datetime.datetime(2018, 1, 8, 8)
+    assert earliest_slot(timeline, '2018-01-08T10:30:00', capacity_limits()) == datetime.datetime(2018, 1, 8, 11)
+
+
+def test_no_slot_while_too_many_patients_wait_after_intake():
+    timeline = OccupancyTimeline()
+    for index in range(MAX_PENDING_PATIENTS + 2):
+        timeline.update(record(f"p{index}", 'Surgery', NOW, wait=True))
+    assert planner('cid', NOW.isoformat(), {}, timeline) is None
+
+
+def test_feasibility_cache_follows_changes_of_the_slot():
+    timeline = OccupancyTimeline()
+    limits = capacity_limits({'Intake': 1})
+    arrival = NOW.replace(hour=7).isoformat()
+    assert earliest_slot(timeline, arrival, limits) == NOW.replace(hour=8)
+    timeline.update(record('p1', 'Intake', NOW.replace(hour=8), duration=1.0))
+    assert earliest_slot(timeline, arrival, limits) == NOW.replace(hour=9)
+    timeline.remove('p1')
+    assert earliest_slot(timeline, arrival, limits) == NOW.replace(hour=8)
+    # other capacities are cached separately
+    assert earliest_slot(timeline, arrival, capacity_limits({'Intake': 0})) is None
+
+
+def test_batch_spreads_patients_over_the_intake_units():
+    timeline = OccupancyTimeline()
+    arrival = NOW.replace(hour=7).isoformat()
+    plans = plan_batch([(f"p{index}", arrival, {}) for index in range(6)], timeline)
+    times = [plan['reschedule_time'] for plan in plans]
+    # four intake units at 8 AM, the others at 9 AM
+    assert times == ['2018-01-08T08:00:00'] * 4 + ['2018-01-08T09:00:00'] * 2
+    assert timeline.reserved_at(NOW.replace(hour=8)) == 4
+
+
+def test_single_plans_reserve_nothing():
+    timeline = OccupancyTimeline()
+    planner('p1', NOW.replace(hour=7).isoformat(), {}, timeline)
+    assert not timeline.reserved
+
+
+def test_readmitted_patient_takes_the_place_of_its_reservation():
+    timeline = OccupancyTimeline()
+    slot = NOW.replace(hour=8)
+    plan_batch([('p1', NOW.replace(hour=7).isoformat(), {})], timeline)
+    assert timeline.reserved_at(slot) == 1
+    timeline.update(record('p1', 'Intake', slot, duration=1.0))
+    assert timeline.reserved_at(slot) == 0
+    assert timeline.ongoing('Intake', slot) == 1
+
+
+def test_reservations_are_replaced_cancelled_and_expired():
+    timeline = OccupancyTimeline()
+    timeline.reserve('p1', NOW)
+    timeline.reserve('p1', NOW.replace(hour=12))
+    assert timeline.reserved_at(NOW) == 0 and timeline.reserved_at(NOW.replace(hour=12)) == 1
+    timeline.cancel_reservation('p1')
+    assert not timeline.reserved
+    timeline.reserve('p2', NOW)
+    timeline.reserve('p3', NOW.replace(hour=12))
+    timeline.expire_reservations(NOW.replace(hour=11))
+    assert timeline.reservations == {'p3': timeline.reservations['p3']}
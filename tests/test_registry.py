@@ -0,0 +1,66 @@
+import datetime
+
+from planner import OccupancyTimeline
+from registry import PatientRecord, PatientRegistry
+
+NOW = datetime.datetime(2018, 1, 8, 10, 0)
+
+
+def test_add_update_and_remove():
+    registry = PatientRegistry()
+    registry.add('p1', 'Intake', NOW, 'A2', False, 1.0)
+    assert 'p1' in registry and len(registry) == 1
+    record = registry.update('p1', task='Surgery', wait=True)
+    assert (record.task, record.wait, record.diagnosis) == ('Surgery', True, 'A2')
+    # a new task resets the sampled duration
+    assert record.duration is None
+    assert registry.update('unknown', task='Surgery') is None
+    assert registry.remove('p1') is record
+    assert 'p1' not in registry and registry.remove('p1') is None
+
+
+def test_adding_a_known_cid_replaces_the_record():
+    registry = PatientRegistry()
+    registry.add('p1', 'Intake', NOW, 'A2', False)
+    registry.add('p1', 'Nursing', NOW, 'A1', False)
+    assert len(registry) == 1
+    assert registry.get('p1').task == 'Nursing'
+
+
+def test_indexes_by_task_and_wait_state():
+    registry = PatientRegistry()
+    registry.add('p1', 'Surgery', NOW, 'A2', True)
+    registry.add('p2', 'Surgery', NOW, 'A3', False)
+    registry.add('p3', 'Nursing', NOW, 'B1', True)
+    cids = lambda records: sorted(record.cid for record in records)
+    assert cids(registry.with_task('Surgery')) == ['p1', 'p2']
+    assert cids(registry.waiting('Surgery')) == ['p1']
+    assert cids(registry.waiting()) == ['p1', 'p3']
+    registry.update('p1', wait=False)
+    registry.update('p3', task='Surgery')
+    assert cids(registry.waiting('Surgery')) == ['p3']
+    assert cids(registry.with_task('Surgery')) == ['p1', 'p2', 'p3']
+    assert registry.with_task('Nursing') == [] and 'Nursing' not in registry.tasks
+    registry.remove('p3')
+    registry.add('p2', 'Nursing', NOW, 'A3', True)
+    assert cids(registry.with_task('Surgery')) == ['p1']
+    assert cids(registry.waiting()) == ['p2']
+    assert registry.waiting('Unknown') == []
+
+
+def test_changes_are_passed_on_to_the_timeline():
+    registry = PatientRegistry(OccupancyTimeline())
+    registry.add('p1', 'Intake', NOW, 'A2', False, 1.0)
+    assert registry.timeline.ongoing('Intake', NOW) == 1
+    registry.update('p1', task='Surgery', wait=True)
+    assert registry.timeline.ongoing('Intake', NOW) == 0
+    assert registry.timeline.pending_count('Surgery') == 1
+    registry.remove('p1')
+    assert registry.timeline.pending_count('Surgery') == 0
+
+
+def test_record_dict_round_trip():
+    record = PatientRecord('p1', 'Nursing', NOW, 'B3', True, 4.5)
+    copy = PatientRecord.from_dict(record.as_dict())
+    assert (copy.cid, copy.task, copy.start, copy.diagnosis, copy.wait, copy.duration) == \
+        ('p1', 'Nursing', NOW, 'B3', True, 4.5)
@@ -0,0 +1,50 @@
+import argparse
+import datetime
+import math
+import statistics
+
+import pytest
+
+from replications import aggregate, confidence_interval, parse_capacity, run_replication, run_replications
+from time_helper import start_time
+
+END = start_time + datetime.timedelta(days=7)
+
+
+def test_confidence_interval_uses_the_t_quantile():
+    values = [1.0, 2.0, 3.0, 4.0]
+    interval = confidence_interval(values)
+    half_width = 3.182 * statistics.stdev(values) / math.sqrt(4)
+    assert interval['mean'] == 2.5
+    assert interval['half_width'] == pytest.approx(half_width)
+    assert (interval['low'], interval['high']) == pytest.approx((2.5 - half_width, 2.5 + half_width))
+
+
+def test_confidence_interval_of_a_single_run_has_no_width():
+    assert confidence_interval([5.0])['half_width'] is None
+
+
+def test_aggregate_skips_missing_values():
+    runs = [{'kpis': {'a': 1.0, 'b': None}}, {'kpis': {'a': 3.0, 'b': 2.0}}]
+    result = aggregate(runs)
+    assert result['a']['n'] == 2 and result['a']['mean'] == 2.0
+    assert result['b']['n'] == 1
+
+
+def test_replications_are_independent_and_reproducible():
+    first = run_replication(1, end=END)
+    assert run_replication(1, end=END) == first
+    assert run_replication(2, end=END)['kpis'] != first['kpis']
+
+
+def test_process_pool_gives_the_runs_of_the_seeds():
+    result = run_replications(2, base_seed=1, end=END, workers=2)
+    assert [run['seed'] for run in result['runs']] == [1, 2]
+    assert result['runs'][0] == run_replication(1, end=END)
+    assert result['kpis']['admitted']['n'] == 2
+
+
+def test_parse_capacity():
+    assert parse_capacity('Surgery=6') == ('Surgery', 6)
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_capacity('Surgery')
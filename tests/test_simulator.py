@@ -0,0 +1,140 @@
+import json
+import os
+import subprocess
+import sys
+
+# simulator patches the standard library for gevent on import, so it runs in a separate interpreter
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs the simulator at 0.01 seconds per simulated hour and records the treatments and callbacks of the workers
+SETUP = '''
+import json
+import gevent
+import db
+import simulator
+simulator.SECONDS_PER_HOUR = 0.01
+db.configure()
+db.init_db()
+events = {'starts': [], 'callbacks': [], 'active': 0, 'peak': 0}
+start_treatment, finish_treatment = simulator.start_treatment, simulator.finish_treatment
+
+def start(resource, patient_id, diagnosis, duration, waiting_duration=None):
+    events['starts'].append((patient_id, simulator.clock(), duration, waiting_duration))
+    events['active'] += 1
+    events['peak'] = max(events['peak'], events['active'])
+    start_treatment(resource, patient_id, diagnosis, duration, waiting_duration)
+
+def finish(resource, patient_id, diagnosis):
+    events['active'] -= 1
+    finish_treatment(resource, patient_id, diagnosis)
+
+simulator.start_treatment, simulator.finish_treatment = start, finish
+simulator.callback = lambda response, url: events['callbacks'].append((url, response))
+
+def wait_for_callbacks(count, hours=200):
+    for _ in range(hours):
+        if len(events['callbacks']) >= count:
+            break
+        simulator.sleep(1)
+'''
+
+
+def run_simulator(script):
+    result = subprocess.run([sys.executable, '-c', SETUP + script], cwd=ROOT, capture_output=True, text=True,
+                            timeout=300)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_worker_starts_a_treatment_on_every_free_unit():
+    result = run_simulator('''
+db.update_resource('Surgery', 3)
+for index in range(7):
+    db.add_to_queue('Queue_Surgery', f"p{index}", 'A2', 'Intake finished', f"url-{index}", simulator.clock())
+worker = gevent.spawn(simulator.process_queue_surgery)
+wait_for_callbacks(7)
+starts = sorted(time for _, time, _, _ in events['starts'])
+first_end = min(time + duration for _, time, duration, _ in events['starts'])
+print(json.dumps({'starts': starts, 'first_end': first_end, 'peak': events['peak'], 'active': events['active'],
+                  'callbacks': len(events['callbacks']), 'free': db.get_resource('Surgery'),
+                  'queued': db.get_queue_length('Queue_Surgery')}))
+''')
+    # the three units start at once, before any treatment ends, and never more than three run at a time
+    assert result['starts'][2] - result['starts'][0] < 0.5
+    assert result['starts'][2] < result['first_end']
+    assert result['peak'] == 3
+    assert result['callbacks'] == 7
+    assert (result['active'], result['free'], result['queued']) == (0, 3, 0)
+
+
+def test_callback_duration_includes_the_waiting_time_since_enqueue():
+    result = run_simulator('''
+db.update_resource('Bed_B', 1)
+# p0 was enqueued two hours ago, p1 waits behind it for the only bed
+db.add_to_queue('Queue_Nursing_B', 'p0', 'B1', 'Intake finished', 'url-0', simulator.clock() - 2)
+db.add_to_queue('Queue_Nursing_B', 'p1', 'B1', 'Intake finished', 'url-1', simulator.clock())
+worker = gevent.spawn(simulator.process_queue_nursing_b)
+wait_for_callbacks(2)
+print(json.dumps({'starts': events['starts'], 'callbacks': dict(events['callbacks'])}))
+''')
+    (first, _, first_duration, first_wait), (second, _, second_duration, second_wait) = result['starts']
+    assert (first, second) == ('p0', 'p1')
+    assert abs(first_wait - 2) < 0.5
+    # p1 waits until p0 is nursed
+    assert abs(second_wait - first_wait + 2 - first_duration) < 0.5
+    assert result['callbacks']['url-0'] == {'status': 'Nursing finished',
+                                            'duration': round(first_wait + first_duration, 2)}
+    assert result['callbacks']['url-1']['duration'] == round(second_wait + second_duration, 2)
+
+
+def test_idle_worker_sleeps_until_an_enqueue_or_a_release():
+    result = run_simulator('''
+waits = []
+wait_for_work = simulator.wait_for_work
+
+def counting_wait(queue_type):
+    waits.append(queue_type)
+    wait_for_work(queue_type)
+
+simulator.wait_for_work = counting_wait
+db.update_resource('Bed_A', 0)
+worker = gevent.spawn(simulator.process_queue_nursing_a)
+simulator.sleep(1)
+settled = len(waits)
+simulator.sleep(20)
+idle = len(waits)
+# the worker wakes on the enqueue, finds no free bed and sleeps again
+db.add_to_queue('Queue_Nursing_A', 'p0', 'A1', 'Intake finished', 'url-0', simulator.clock())
+simulator.sleep(20)
+enqueued = len(waits)
+started_before_release = len(events['starts'])
+db.release('Bed_A')
+wait_for_callbacks(1)
+simulator.sleep(20)
+print(json.dumps({'settled': settled, 'idle': idle, 'enqueued': enqueued,
+                  'started_before_release': started_before_release, 'started': len(events['starts']),
+                  'waits': len(waits), 'callbacks': len(events['callbacks'])}))
+''')
+    # no wake-up while nothing changes
+    assert result['idle'] == result['settled'] <= 2
+    assert result['enqueued'] == result['idle'] + 1
+    assert result['started_before_release'] == 0
+    assert (result['started'], result['callbacks']) == (1, 1)
+    # woken by the release and by the release after the nursing, then idle again
+    assert result['waits'] <= result['enqueued'] + 3
+
+
+def test_worker_stores_the_sampled_duration_on_the_patient_record():
+    result = run_simulator('''
+import datetime
+simulator.add_resources('p0', 'Surgery', datetime.datetime(2018, 1, 8, 10), 'A2', True)
+db.add_to_queue('Queue_Surgery', 'p0', 'A2', 'Intake finished', 'url-0', simulator.clock())
+worker = gevent.spawn(simulator.process_queue_surgery)
+simulator.sleep(0.1)
+record = simulator.resources.get('p0')
+print(json.dumps({'sampled': events['starts'][0][2], 'duration': record.duration, 'wait': record.wait,
+                  'occupied': simulator.resources.timeline.patients['p0'][1] is not None}))
+''')
+    assert result['duration'] == result['sampled']
+    assert result['wait'] is False
+    assert result['occupied']
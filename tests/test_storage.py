@@ -0,0 +1,216 @@
+import gc
+import sqlite3
+import threading
+import weakref
+
+import pytest
+
+from storage import RESOURCE_CAPACITIES, SQLiteStore, DurableStore, MemoryStore
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'durable'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        store = MemoryStore()
+    elif request.param == 'sqlite':
+        store = SQLiteStore(str(tmp_path / 'hospital.db'))
+    else:
+        store = DurableStore(str(tmp_path / 'hospital.db'))
+    store.init_db()
+    yield store
+    store.close()
+
+
+def test_initial_capacities(store):
+    for name, count in RESOURCE_CAPACITIES.items():
+        assert store.get_resource(name) == count
+
+
+def test_update_resource(store):
+    store.update_resource('Bed_A', 7)
+    assert store.get_resource('Bed_A') == 7
+
+
+def test_unknown_names_are_rejected(store):
+    with pytest.raises(ValueError):
+        store.get_resource('Kitchen')
+    with pytest.raises(ValueError):
+        store.add_to_queue('Queue_Kitchen', 'p1', 'A1', 'Intake finished', 'url-1')
+
+
+def test_queue_is_first_come_first_served(store):
+    for index in range(3):
+        store.add_to_queue('Queue_Nursing_A', f"p{index}", 'A1', 'Intake finished', f"url-{index}", float(index))
+    assert store.get_queue_length('Queue_Nursing_A') == 3
+    assert [row[3] for row in store.get_queue('Queue_Nursing_A')] == ['url-0', 'url-1', 'url-2']
+    assert store.pop_from_queue('Queue_Nursing_A') == ('p0', 'A1', 'Intake finished', 'url-0', 0.0)
+    assert store.get_queue_length('Queue_Nursing_A') == 2
+
+
+def test_er_patients_are_served_first(store):
+    store.add_to_queue('Queue_Surgery', 'p1', 'A2', 'Intake finished', 'url-1', 1.0)
+    store.add_to_queue('Queue_Surgery', 'p2', 'A3', 'ER Treatment finished', 'url-2', 2.0)
+    store.add_to_queue('Queue_Surgery', 'p3', 'A4', 'Intake finished', 'url-3', 3.0)
+    store.add_to_queue('Queue_Surgery', 'p4', 'B3', 'ER Treatment finished', 'url-4', 4.0)
+    assert store.get_count_queue('Queue_Surgery', 'Intake finished') == 2
+    assert store.get_count_queue('Queue_Surgery', 'ER Treatment finished') == 2
+    popped = [store.pop_from_queue('Queue_Surgery')[0] for _ in range(4)]
+    assert popped == ['p2', 'p4', 'p1', 'p3']
+    assert store.pop_from_queue('Queue_Surgery') is None
+
+
+def test_pop_returns_the_enqueue_time(store):
+    store.add_to_queue('Queue_Nursing_B', 'p1', 'B1', 'Intake finished', 'url-1', 12.5)
+    assert store.pop_from_queue('Queue_Nursing_B')[4] == 12.5
+
+
+def test_delete_from_queue(store):
+    store.add_to_queue('Queue_Nursing_B', 'p1', 'B1', 'Intake finished', 'url-1')
+    store.add_to_queue('Queue_Nursing_B', 'p2', 'B2', 'Intake finished', 'url-2')
+    store.delete_from_queue('Queue_Nursing_B', 'url-1')
+    assert store.get_queue_length('Queue_Nursing_B') == 1
+    assert store.get_count_queue('Queue_Nursing_B', 'Intake finished') == 1
+    assert store.pop_from_queue('Queue_Nursing_B')[0] == 'p2'
+
+
+def test_queueing_a_patient_again_replaces_its_entry(store):
+    store.add_to_queue('Queue_Surgery', 'p1', 'A2', 'Intake finished', 'url-1', 1.0)
+    store.add_to_queue('Queue_Surgery', 'p2', 'A3', 'Intake finished', 'url-2', 2.0)
+    store.add_to_queue('Queue_Surgery', 'p1', 'A2', 'ER Treatment finished', 'url-1', 3.0)
+    assert store.get_queue_length('Queue_Surgery') == 2
+    assert store.get_count_queue('Queue_Surgery', 'Intake finished') == 1
+    assert store.pop_from_queue('Queue_Surgery') == ('p1', 'A2', 'ER Treatment finished', 'url-1', 3.0)
+    assert store.pop_from_queue('Queue_Surgery')[0] == 'p2'
+    assert store.pop_from_queue('Queue_Surgery') is None
+    store.add_to_queue_er('p3', 'url-3', 1.0)
+    store.add_to_queue_er('p4', 'url-4', 2.0)
+    store.add_to_queue_er('p3', 'url-3', 3.0)
+    assert store.get_queue_length_er() == 2
+    assert store.pop_from_queue_er() == ('p3', 'url-3', 3.0)
+
+
+def test_er_queue(store):
+    store.add_to_queue_er('p1', 'url-1', 1.0)
+    store.add_to_queue_er('p2', 'url-2', 2.0)
+    store.add_to_queue_er('p3', 'url-3', 3.0)
+    store.delete_from_queue_er('url-2')
+    assert store.get_queue_length_er() == 2
+    assert [row[1] for row in store.get_queue_er()] == ['url-1', 'url-3']
+    assert store.pop_from_queue_er() == ('p1', 'url-1', 1.0)
+    assert store.pop_from_queue_er() == ('p3', 'url-3', 3.0)
+    assert store.pop_from_queue_er() is None
+
+
+def test_memory_snapshot_uses_the_sqlite_schema(tmp_path):
+    store = MemoryStore()
+    store.update_resource('ER', 3)
+    store.add_to_queue('Queue_Surgery', 'p1', 'A2', 'ER Treatment finished', 'url-1', 5.0)
+    path = str(tmp_path / 'snapshot.db')
+    store.snapshot(path)
+    copy = SQLiteStore(path)
+    assert copy.get_resource('ER') == 3
+    assert copy.pop_from_queue('Queue_Surgery') == ('p1', 'A2', 'ER Treatment finished', 'url-1', 5.0)
+
+
+def test_migration_adds_the_priority_class_to_old_queue_tables(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE Queue_Surgery (id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id TEXT, diagnosis TEXT, "
+                 "status TEXT, callback_url TEXT)")
+    conn.executemany("INSERT INTO Queue_Surgery (patient_id, diagnosis, status, callback_url) VALUES (?, ?, ?, ?)",
+                     [('p1', 'A2', 'Intake finished', 'url-1'), ('p2', 'A3', 'ER Treatment finished', 'url-2')])
+    conn.commit()
+    conn.close()
+    store = SQLiteStore(path)
+    assert store.pop_from_queue('Queue_Surgery') == ('p2', 'A3', 'ER Treatment finished', 'url-2', 0)
+    assert store.pop_from_queue('Queue_Surgery')[0] == 'p1'
+
+
+def test_new_durable_store_is_seeded_and_keeps_its_counts(tmp_path):
+    path = str(tmp_path / 'durable.db')
+    store = DurableStore(path, capacities={'Surgery': 7})
+    assert store.get_resource('Surgery') == 7
+    assert store.try_acquire('Surgery')
+    store.add_to_queue('Queue_Surgery', 'p1', 'A2', 'Intake finished', 'url-1', 1.0)
+    store.close()
+    reopened = DurableStore(path)
+    reopened.init_db()
+    assert reopened.get_resource('Surgery') == 6
+    assert reopened.pop_from_queue('Queue_Surgery') == ('p1', 'A2', 'Intake finished', 'url-1', 1.0)
+    reopened.close()
+
+
+def test_durable_group_commit(tmp_path):
+    path = str(tmp_path / 'durable.db')
+    store = DurableStore(path, group_size=2, commit_interval=0)
+    store.update_resource('ER', 1)
+    reader = sqlite3.connect(path)
+    read = lambda: reader.execute("SELECT count FROM Resource_Counts WHERE name = 'ER'").fetchone()[0]
+    assert read() == RESOURCE_CAPACITIES['ER']
+    store.update_resource('ER', 2)
+    assert read() == 2
+    store.update_resource('ER', 3)
+    store.commit()
+    assert read() == 3
+    reader.close()
+    store.close()
+
+
+def test_durable_reads_while_others_write(tmp_path):
+    store = DurableStore(str(tmp_path / 'durable.db'), group_size=8, commit_interval=0.001)
+    errors = []
+
+    def writer(index):
+        for number in range(200):
+            store.add_to_queue('Queue_Surgery', f"p{index}", 'A2', 'Intake finished', f"url-{index}-{number}")
+            store.pop_from_queue('Queue_Surgery')
+
+    def reader():
+        try:
+            for _ in range(400):
+                assert all(len(row) == 5 for row in store.get_queue('Queue_Surgery'))
+                assert store.get_queue_length('Queue_Surgery') >= 0
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(index,)) for index in range(4)]
+    threads += [threading.Thread(target=reader) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert store.get_queue_length('Queue_Surgery') == 0
+    store.close()
+
+
+def test_closed_durable_store_is_released(tmp_path):
+    store = DurableStore(str(tmp_path / 'durable.db'), commit_interval=0)
+    reference = weakref.ref(store)
+    store.close()
+    del store
+    gc.collect()
+    assert reference() is None
+
+
+def test_try_acquire_never_takes_more_units_than_available(store):
+    store.update_resource('Surgery', 5)
+    taken = []
+
+    def worker():
+        for _ in range(20):
+            if store.try_acquire('Surgery'):
+                taken.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(taken) == 5
+    assert store.get_resource('Surgery') == 0
+    assert not store.try_acquire('Surgery')
+    store.release('Surgery', 2)
+    assert not store.try_acquire('Surgery', 3)
+    assert store.try_acquire('Surgery', 2)
+    assert store.get_resource('Surgery') == 0
@@ -0,0 +1,37 @@
+import datetime
+
+import pytest
+
+from sweep import grid, latin_hypercube, run_sweep, split_config
+from time_helper import start_time
+
+END = start_time + datetime.timedelta(days=7)
+
+
+def test_grid_gives_every_combination():
+    configs = grid({'Bed_A': [30, 35], 'Surgery': [5, 6, 7]})
+    assert len(configs) == 6
+    assert {'Bed_A': 35, 'Surgery': 7} in configs
+    with pytest.raises(ValueError):
+        grid({'Kitchen': [1]})
+
+
+def test_latin_hypercube_uses_every_stratum_once():
+    configs = latin_hypercube({'Bed_A': (20, 39), 'Surgery': (1, 10)}, samples=10, seed=1)
+    assert sorted(config['Bed_A'] // 2 for config in configs) == list(range(10, 20))
+    assert sorted(config['Surgery'] for config in configs) == list(range(1, 11))
+    assert latin_hypercube({'Bed_A': (20, 39)}, samples=10, seed=1) == \
+        latin_hypercube({'Bed_A': (20, 39)}, samples=10, seed=1)
+
+
+def test_split_config():
+    assert split_config({'Surgery': 6, 'off_hours.Surgery': 2}) == ({'Surgery': 6}, {'Surgery': 2})
+
+
+def test_configurations_share_their_random_numbers():
+    result = run_sweep([{}, {'Bed_A': 30}, {'Bed_A': 10}], replications=2, base_seed=1, end=END, workers=2)
+    baseline, same, fewer_beds = result['configurations']
+    # the default has 30 beds of type A, the same configuration gives the same runs
+    assert same['vs_baseline']['admitted']['mean'] == 0
+    assert same['vs_baseline']['admitted']['stdev'] == 0
+    assert fewer_beds['kpis']['waiting_time.Bed_A']['mean'] > baseline['kpis']['waiting_time.Bed_A']['mean']
@@ -0,0 +1,45 @@
+import numpy as np
+
+from diagnosis_helper import DiagnosisHelper
+from variates import STREAMS, RandomStreams, cumulative
+
+
+def draws(streams, count=100):
+    return [(streams.normal('Surgery', 2, 0.5), streams.uniform('arrivals'), streams.normal('Intake', 1, 0.125))
+            for _ in range(count)]
+
+
+def test_same_seed_gives_identical_values():
+    assert draws(RandomStreams(7)) == draws(RandomStreams(7))
+    assert draws(RandomStreams(7)) != draws(RandomStreams(8))
+
+
+def test_streams_do_not_depend_on_each_others_draws():
+    quiet, busy = RandomStreams(7), RandomStreams(7)
+    for _ in range(5000):
+        busy.uniform('diagnosis')
+        busy.normal('ER', 2, 0.5)
+    assert [quiet.normal('Surgery', 0, 1) for _ in range(10)] == [busy.normal('Surgery', 0, 1) for _ in range(10)]
+
+
+def test_buffered_values_follow_the_generator():
+    streams = RandomStreams(3, block_size=16)
+    generator = np.random.default_rng(np.random.SeedSequence(3).spawn(len(STREAMS))[STREAMS.index('ER')])
+    expected = [value for _ in range(3) for value in generator.standard_normal(16).tolist()]
+    assert [streams.normal('ER', 0, 1) for _ in range(48)] == expected
+
+
+def test_choice_follows_the_probabilities():
+    streams = RandomStreams(11)
+    values = ['a', 'b', 'c']
+    picks = [streams.choice('diagnosis', values, cumulative([0.2, 0.5, 0.3])) for _ in range(20000)]
+    shares = [picks.count(value) / len(picks) for value in values]
+    assert np.allclose(shares, [0.2, 0.5, 0.3], atol=0.02)
+
+
+def test_diagnosis_helper_is_reproducible_with_seeded_streams():
+    def sample(helper):
+        diagnoses = [helper.assign_diagnosis('EM') for _ in range(50)]
+        return diagnoses, [helper.intake_time() for _ in range(50)]
+
+    assert sample(DiagnosisHelper(RandomStreams(5))) == sample(DiagnosisHelper(RandomStreams(5)))
@@ -0,0 +1,71 @@
+from bisect import bisect_right
+
+import numpy as np
+
+# Values drawn from a generator per refill of a buffer
+BLOCK_SIZE = 4096
+
+# Purposes with a random number stream of their own: the arrivals, the diagnoses and the service times of every
+# department. New streams are only ever appended, so the existing ones keep their values for a seed.
+STREAMS = ('arrivals', 'diagnosis', 'Intake', 'ER', 'Surgery', 'Bed_A', 'Bed_B')
+
+
+class BufferedStream:
+    """
+    Values of one distribution of a numpy Generator, drawn in blocks of block_size and handed out one at a time.
+    """
+    __slots__ = ('generator', 'method', 'block_size', 'buffer', 'position')
+
+    def __init__(self, generator, method, block_size=BLOCK_SIZE):
+        self.generator = generator
+        self.method = method
+        self.block_size = block_size
+        self.buffer = []
+        self.position = 0
+
+    def next(self):
+        if self.position == len(self.buffer):
+            self.buffer = getattr(self.generator, self.method)(self.block_size).tolist()
+            self.position = 0
+        value = self.buffer[self.position]
+        self.position += 1
+        return value
+
+
+class RandomStreams:
+    """
+    Independent random number streams per purpose (STREAMS), derived from one seed with numpy's SeedSequence.
+    A stream gives the same values for the same seed whatever the other streams draw, so two scenarios run with
+    the same seed share their arrivals, diagnoses and service times (common random numbers).
+    """
+
+    def __init__(self, seed=None, block_size=BLOCK_SIZE):
+        self.seed = seed
+        children = np.random.SeedSequence(seed).spawn(len(STREAMS))
+        self.generators = {name: np.random.default_rng(child) for name, child in zip(STREAMS, children)}
+        self.normals = {name: BufferedStream(generator, 'standard_normal', block_size)
+                        for name, generator in self.generators.items()}
+        self.uniforms = {name: BufferedStream(generator, 'random', block_size)
+                         for name, generator in self.generators.items()}
+
+    def generator(self, name):
+        """
+        The Generator of a stream, for vectorized draws such as the arrivals of a whole year.
+        """
+        return self.generators[name]
+
+    def normal(self, name, mean, stddev):
+        return mean + stddev * self.normals[name].next()
+
+    def uniform(self, name):
+        return self.uniforms[name].next()
+
+    def choice(self, name, values, cumulative):
+        """
+        One of the values with the probabilities given as cumulative sums ending with 1.
+        """
+        return values[min(bisect_right(cumulative, self.uniform(name)), len(values) - 1)]
+
+
+def cumulative(probabilities):
+    return np.cumsum(probabilities).tolist()